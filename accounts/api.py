@@ -0,0 +1,62 @@
+"""
+ユーザーのJSON API。ETagと 304 の扱いは tweets.api と同じ。
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.views.generic import View
+
+from accounts.follows import FollowListPaginator, follow_list_queryset, follow_list_version, resolve_is_following
+from tweets.api import ApiLoginRequiredMixin, TimelineApiView, api_response, make_etag
+from tweets.pagination import InvalidCursor
+
+User = get_user_model()
+
+
+class UserTimelineApiView(TimelineApiView):
+    def get_queryset(self):
+        user = get_object_or_404(User, username=self.kwargs["username"])
+        return super().get_queryset().filter(user=user)
+
+
+class FollowListApiView(ApiLoginRequiredMixin, View):
+    """
+    フォロー中・フォロワーの一覧。フォローした日時の降順でページ分割する (accounts.follows)。
+    弱いETagは一覧のフォローの変化だけを見るので、相手のフォロー数の変化は一覧が変わるまで 304 のままになる。
+    """
+
+    # following ならフォローしている相手、follower ならフォローしてくれている相手
+    relation = None
+
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User.objects.only("id"), username=kwargs["username"])
+        cursor = request.GET.get("cursor")
+        # 一覧を読む前に、フォローの件数と最大のIDだけで作ったETagを比べる
+        etag = make_etag(
+            request.user.pk, self.relation, cursor, follow_list_version(user, self.relation, request.user)
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+
+        paginator = FollowListPaginator(settings.TIMELINE_PAGE_SIZE, self.relation)
+        try:
+            page = paginator.paginate(follow_list_queryset(user, self.relation), cursor)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        resolve_is_following(page.object_list, request.user)
+        users = [
+            {
+                "id": follow.pk,
+                "username": follow.username,
+                "following_count": follow.following_count,
+                "followers_count": follow.followers_count,
+                "followed_at": follow.followed_at,
+                "is_following": follow.is_following,
+            }
+            for follow in page
+        ]
+        return api_response({"users": users, "next_cursor": page.next_cursor}, etag)
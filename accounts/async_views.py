@@ -0,0 +1,68 @@
+"""
+プロフィールとフォロー一覧の非同期版 (tweets.async_views を参照)。
+"""
+
+import asyncio
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import Http404
+from django.views.generic import View
+from django.views.generic.base import TemplateResponseMixin
+
+from accounts.follows import FollowListPaginator, aresolve_is_following, follow_list_queryset
+from accounts.headers import acache_header, aget_cached_header
+from accounts.models import Follow
+from accounts.suggestions import suggestions_for
+from tweets.async_views import AsyncLoginRequiredMixin, AsyncTimelineView, aget_object_or_404
+from tweets.pagination import InvalidCursor
+
+User = get_user_model()
+
+
+class AsyncUserProfileView(AsyncTimelineView):
+    template_name = "accounts/profile.html"
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.user)
+
+    async def get(self, request, *args, **kwargs):
+        # フォロー数・フォロワー数はユーザーの行に持っていて、見出しはキャッシュする (accounts.headers)
+        self.user = await aget_cached_header(kwargs["username"])
+        if self.user is None:
+            self.user = await aget_object_or_404(User.objects.all(), username=kwargs["username"])
+            await acache_header(self.user)
+        is_following = Follow.objects.filter(follower_id=request.user.pk, followee_id=self.user.pk)
+        # フォロー中かどうか・タイムライン・おすすめは互いに依存しないので、まとめて待つ
+        is_following, page, suggestions = await asyncio.gather(
+            is_following.aexists(), self.get_page(), self.get_suggestions(request.user)
+        )
+        context = self.get_timeline_context(page)
+        context["username"] = self.user.username
+        context["followings_count"] = self.user.following_count
+        context["followers_count"] = self.user.followers_count
+        context["is_following"] = is_following
+        context["suggestions"] = suggestions
+        return self.render_to_response(context)
+
+    async def get_suggestions(self, user):
+        return [suggestion async for suggestion in suggestions_for(user)]
+
+
+class AsyncFollowListView(AsyncLoginRequiredMixin, TemplateResponseMixin, View):
+    # following ならフォローしている相手、follower ならフォローしてくれている相手
+    relation = None
+
+    def get_template_names(self):
+        return ["accounts/following.html" if self.relation == "following" else "accounts/follower.html"]
+
+    async def get(self, request, *args, **kwargs):
+        user = await aget_object_or_404(User.objects.only("id"), username=kwargs["username"])
+        paginator = FollowListPaginator(settings.TIMELINE_PAGE_SIZE, self.relation)
+        try:
+            page = await paginator.apaginate(follow_list_queryset(user, self.relation), request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        users = await aresolve_is_following(page.object_list, request.user)
+        context = {"object_list": users, "user_list": users, "page_obj": page, "username": kwargs["username"]}
+        return self.render_to_response(context)
@@ -0,0 +1,83 @@
+"""
+フォロー中・フォロワー一覧の組み立て。
+
+一覧は Follow をフォローした日時の降順にキーセット方式で読み、相手のユーザーは同じ検索で JOIN する。
+閲覧者がそれぞれの相手をフォローしているかどうかは、ページ内のIDに対する IN 検索1回でまとめて付ける
+(tweets.timeline の resolve_liked と同じ)。フォロー数・フォロワー数はユーザーの行にあるので追加の検索はいらない。
+"""
+
+from django.db.models import Count, Max, Q
+
+from accounts.models import Follow
+from tweets.pagination import KeysetPaginator
+
+# 一覧に表示するユーザーの列
+USER_FIELDS = ("id", "username", "following_count", "followers_count")
+
+
+def follow_list_queryset(user, relation):
+    """relation が following なら user がフォローしている相手、follower なら user をフォローしている相手の Follow。"""
+    if relation == "following":
+        follows, other = Follow.objects.filter(follower=user), "followee"
+    else:
+        follows, other = Follow.objects.filter(followee=user), "follower"
+    return follows.select_related(other).only("id", "created_at", *[f"{other}__{field}" for field in USER_FIELDS])
+
+
+def follow_list_version(user, relation, viewer):
+    """
+    一覧が変わったかどうかを、行を読まずに調べるための値。user の relation の Follow と閲覧者のフォロー
+    (is_following が変わる) それぞれの件数と最大のIDを、フォローの索引だけで1回で数える。
+    相手のフォロー数・フォロワー数の変化は含めない。
+    """
+    listed = Q(follower=user) if relation == "following" else Q(followee=user)
+    mine = Q(follower_id=viewer.pk)
+    return Follow.objects.filter(listed | mine).aggregate(
+        count=Count("id", filter=listed),
+        last_id=Max("id", filter=listed),
+        viewer_count=Count("id", filter=mine),
+        viewer_last_id=Max("id", filter=mine),
+    )
+
+
+class FollowListPaginator(KeysetPaginator):
+    """Follow を (created_at, id) の降順でページ分割し、ページには相手のユーザーを入れる。"""
+
+    def __init__(self, page_size, relation):
+        super().__init__(page_size)
+        self.relation = relation
+
+    def _make_page(self, rows):
+        page = super()._make_page(rows)
+        users = []
+        for follow in page.object_list:
+            user = follow.followee if self.relation == "following" else follow.follower
+            user.followed_at = follow.created_at
+            users.append(user)
+        page.object_list = users
+        return page
+
+
+def _following_ids(users, viewer):
+    user_ids = [user.pk for user in users]
+    if not user_ids or not viewer.is_authenticated:
+        return None
+    return Follow.objects.filter(follower_id=viewer.pk, followee_id__in=user_ids).values_list("followee_id", flat=True)
+
+
+def _set_is_following(users, following_ids):
+    for user in users:
+        user.is_following = user.pk in following_ids
+    return users
+
+
+def resolve_is_following(users, viewer):
+    """users の各要素に、viewer がフォローしているかどうかを is_following として付ける。"""
+    following_ids = _following_ids(users, viewer)
+    return _set_is_following(users, set(following_ids) if following_ids is not None else set())
+
+
+async def aresolve_is_following(users, viewer):
+    """resolve_is_following の非同期版。"""
+    following_ids = _following_ids(users, viewer)
+    return _set_is_following(users, {pk async for pk in following_ids} if following_ids is not None else set())
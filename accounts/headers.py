@@ -0,0 +1,48 @@
+"""
+プロフィールの見出し (ユーザーID・ユーザー名・フォロー数・フォロワー数) のキャッシュ。
+
+見出しはプロフィールを開くたびに読むので、ユーザー名をキーにして2段キャッシュ (mysite.cache) に置き、
+よく見られるプロフィールはプロセス内のLRUから返す。フォロー数が変わったとき (accounts.models.follows_changed) と
+ユーザーの保存・削除で消す (accounts.signals)。ユーザー名を変えると、古いユーザー名のキーは
+PROFILE_HEADER_CACHE_TIMEOUT 秒まで残る。閲覧者ごとに違うフォロー中かどうかはキャッシュせず、毎回調べる。
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from accounts.models import User
+
+HEADER_FIELDS = ("id", "username", "following_count", "followers_count")
+
+
+def header_key(username):
+    return f"profile:header:{username}"
+
+
+def _to_user(values):
+    return None if values is None else User(**dict(zip(HEADER_FIELDS, values)))
+
+
+def _to_values(user):
+    return [getattr(user, field) for field in HEADER_FIELDS]
+
+
+def get_cached_header(username):
+    """キャッシュにある見出しを、HEADER_FIELDS だけを入れた User で返す。なければ None。"""
+    return _to_user(cache.get(header_key(username)))
+
+
+async def aget_cached_header(username):
+    return _to_user(await cache.aget(header_key(username)))
+
+
+def cache_header(user):
+    cache.set(header_key(user.username), _to_values(user), settings.PROFILE_HEADER_CACHE_TIMEOUT)
+
+
+async def acache_header(user):
+    await cache.aset(header_key(user.username), _to_values(user), settings.PROFILE_HEADER_CACHE_TIMEOUT)
+
+
+def invalidate_headers(usernames):
+    cache.delete_many([header_key(username) for username in usernames])
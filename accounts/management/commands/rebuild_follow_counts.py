@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Max, Q
+
+from accounts.models import User, count_follows, sync_follow_counts
+
+
+class Command(BaseCommand):
+    help = "User.following_count / followers_count をフォローの中間テーブルから数え直す。--check のときは不一致を報告するだけ。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="更新せずに不一致があれば失敗する")
+        parser.add_argument("--batch-size", type=int, default=10000, help="1回に処理するユーザーIDの範囲")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_pk = User.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+        mismatched = 0
+        for start in range(0, max_pk + 1, batch_size):
+            users = User.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+            wrong = users.annotate(
+                actual_following_count=count_follows("follower_id"),
+                actual_followers_count=count_follows("followee_id"),
+            ).exclude(Q(following_count=F("actual_following_count")) & Q(followers_count=F("actual_followers_count")))
+            pks = list(wrong.values_list("pk", flat=True))
+            if not pks:
+                continue
+            mismatched += len(pks)
+            if not options["check"]:
+                sync_follow_counts(pks)
+
+        if options["check"]:
+            if mismatched:
+                raise CommandError(f"{mismatched} 人のユーザーでフォロー数が一致しません。")
+            self.stdout.write("フォロー数はすべて一致しています。")
+        else:
+            self.stdout.write(f"{mismatched} 人のユーザーのフォロー数を修正しました。")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.suggestions import update_stale_suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        "おすすめユーザー (FollowSuggestion) を作り直す。"
+        "前回より後にフォローしたユーザーと、SUGGESTION_MAX_AGE より古いユーザーの分だけを処理する。定期的に実行する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="1回に処理するユーザーIDの範囲")
+        parser.add_argument("--max-users", type=int, default=None, help="1回の実行で作り直すユーザー数の上限")
+        parser.add_argument("--all", action="store_true", help="古くなっていないユーザーも含めて全員分を作り直す")
+
+    def handle(self, *args, **options):
+        updated = update_stale_suggestions(options["batch_size"], options["max_users"], force=options["all"])
+        self.stdout.write(f"{updated} 人のユーザーのおすすめを作り直しました。")
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:31
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_follow_counts(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Follow = User.following.through
+
+    def count_by(field):
+        follows = (
+            Follow.objects.filter(**{field: OuterRef("pk")}).order_by().values(field).annotate(count=Count("id"))
+        )
+        return Coalesce(Subquery(follows.values("count")), 0)
+
+    User.objects.update(following_count=count_by("from_user_id"), followers_count=count_by("to_user_id"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="followers_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:33
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_user_follow_counts"),
+    ]
+
+    operations = [
+        # 一意制約の (from_user_id, to_user_id) とは逆向きで、フォロワー一覧の検索用。
+        migrations.RunSQL(
+            'CREATE INDEX "user_following_to_from_idx" ON "accounts_user_following" ("to_user_id", "from_user_id")',
+            'DROP INDEX "user_following_to_from_idx"',
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:26
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+BATCH_SIZE = 5000
+
+
+def order_created_at(apps, schema_editor):
+    """
+    既存の行の created_at を、ID の新しいものからマイグレーションの日時を1秒ずつさかのぼらせて入れる。
+    中間テーブルには日時がないので、今までのフォローの順 (ID の順) をフォローした日時の順として残す。
+    """
+    Follow = apps.get_model("accounts", "Follow")
+    follows = Follow.objects.using(schema_editor.connection.alias)
+    now = django.utils.timezone.now()
+    rank = 0
+    chunk = list(follows.order_by("-pk").only("pk")[:BATCH_SIZE])
+    while chunk:
+        for follow in chunk:
+            follow.created_at = now - timedelta(seconds=rank)
+            rank += 1
+        follows.bulk_update(chunk, ["created_at"])
+        chunk = list(follows.filter(pk__lt=chunk[-1].pk).order_by("-pk").only("pk")[:BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_follow_reverse_index"),
+    ]
+
+    operations = [
+        # 自動生成の中間テーブル accounts_user_following を、そのまま Follow として扱う (テーブルは変えない)
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="Follow",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID"),
+                        ),
+                        (
+                            "from_user",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                        (
+                            "to_user",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                    ],
+                    options={
+                        "verbose_name_plural": "フォロー",
+                        "db_table": "accounts_user_following",
+                        "unique_together": {("from_user", "to_user")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="user",
+                    name="following",
+                    field=models.ManyToManyField(
+                        related_name="follower",
+                        through="accounts.Follow",
+                        through_fields=("from_user", "to_user"),
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        # 0003 で作った索引は Follow の Meta.indexes に移す。
+        # SQLite は列の追加でテーブルを作り直し、モデルにない索引は消えるので、先に消して AddIndex で作り直す
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS "user_following_to_from_idx"',
+            'CREATE INDEX "user_following_to_from_idx" ON "accounts_user_following" ("to_user_id", "from_user_id")',
+        ),
+        migrations.AddField(
+            model_name="follow",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(order_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["from_user", "-created_at", "-id"], name="follow_from_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["to_user", "-created_at", "-id"], name="follow_to_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["to_user", "from_user"], name="user_following_to_from_idx"),
+        ),
+    ]
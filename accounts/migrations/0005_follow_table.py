@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+import django.utils.timezone
+
+# 1回のトランザクションで写すIDの範囲。テーブルの書き込みロックを長く持たないよう小さめにする
+BATCH_SIZE = 5000
+
+
+def _copy(schema_editor, source, target, columns):
+    """source の行を ID の範囲ごとに target へ写す。写している間に増えた行も、増えなくなるまで追いかける。"""
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    source_columns, target_columns = zip(*columns)
+    sql = (
+        f"INSERT INTO {qn(target._meta.db_table)} ({', '.join(map(qn, target_columns))}) "
+        f"SELECT {', '.join(map(qn, source_columns))} FROM {qn(source._meta.db_table)} "
+        f"WHERE {qn('id')} > %s AND {qn('id')} <= %s AND {qn(source_columns[1])} <> {qn(source_columns[2])}"
+    )
+    # 最大の ID もマイグレーションの接続で読む。ルーターがレプリカへ送ると、遅れている分の行を写さずに旧テーブルを消してしまう
+    rows = source.objects.using(connection.alias)
+    copied = 0
+    while True:
+        max_pk = rows.aggregate(max_pk=models.Max("pk"))["max_pk"] or 0
+        if max_pk <= copied:
+            break
+        for start in range(copied, max_pk, BATCH_SIZE):
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(sql, [start, min(start + BATCH_SIZE, max_pk)])
+        copied = max_pk
+    # ID をそのまま写したので、PostgreSQL などのシーケンスを写した後の最大値に合わせる
+    with connection.cursor() as cursor:
+        for statement in connection.ops.sequence_reset_sql(no_style(), [target]):
+            cursor.execute(statement)
+
+
+def copy_follows(apps, schema_editor):
+    _copy(
+        schema_editor,
+        apps.get_model("accounts", "LegacyFollow"),
+        apps.get_model("accounts", "Follow"),
+        [("id", "id"), ("from_user_id", "follower_id"), ("to_user_id", "followee_id"), ("created_at", "created_at")],
+    )
+
+
+def copy_follows_back(apps, schema_editor):
+    _copy(
+        schema_editor,
+        apps.get_model("accounts", "Follow"),
+        apps.get_model("accounts", "LegacyFollow"),
+        [("id", "id"), ("follower_id", "from_user_id"), ("followee_id", "to_user_id"), ("created_at", "created_at")],
+    )
+
+
+class Migration(migrations.Migration):
+    # 写す処理はチャンクごとにコミットする
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0004_follow_model"),
+    ]
+
+    operations = [
+        # 旧テーブル (accounts_user_following) は db_table を持つので、名前を変えてもテーブルはそのまま
+        migrations.RenameModel(old_name="Follow", new_name="LegacyFollow"),
+        migrations.CreateModel(
+            name="Follow",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "followee",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "follower",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "フォロー",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["follower", "-created_at", "-id"], name="follow_follower_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["followee", "-created_at", "-id"], name="follow_followee_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["followee", "follower"], name="follow_followee_follower_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="follow",
+            constraint=models.UniqueConstraint(fields=("follower", "followee"), name="follow_unique_pair"),
+        ),
+        migrations.AddConstraint(
+            model_name="follow",
+            constraint=models.CheckConstraint(
+                check=models.Q(("follower", models.F("followee")), _negated=True), name="follow_not_self"
+            ),
+        ),
+        # 空のテーブルに索引と制約を作ってから写す。自分自身へのフォローは写さない
+        migrations.RunPython(copy_follows, copy_follows_back),
+        migrations.AlterField(
+            model_name="user",
+            name="following",
+            field=models.ManyToManyField(
+                related_name="follower",
+                through="accounts.Follow",
+                through_fields=("follower", "followee"),
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.DeleteModel(name="LegacyFollow"),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_follow_table"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="suggestions_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="FollowSuggestion",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("score", models.FloatField()),
+                ("mutual_count", models.PositiveIntegerField()),
+                ("recent_likes", models.PositiveIntegerField()),
+                (
+                    "candidate",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "おすすめユーザー",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="followsuggestion",
+            index=models.Index(fields=["user", "-score", "candidate"], name="suggestion_user_score_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="followsuggestion",
+            constraint=models.UniqueConstraint(fields=("user", "candidate"), name="suggestion_unique_pair"),
+        ),
+    ]
@@ -1,5 +1,12 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+# フォロー数・フォロワー数が変わったときに送る。users は件数が変わったユーザー (username を読む)
+follows_changed = Signal()
 
 
 class User(AbstractUser):
@@ -8,8 +15,202 @@ class User(AbstractUser):
         "self",
         symmetrical=False,
         related_name="follower",
+        through="Follow",
+        through_fields=("follower", "followee"),
     )
+    # following の件数。follow / unfollow で中間テーブルと同じトランザクション内で更新する
+    following_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    # おすすめユーザー (FollowSuggestion) を最後に作った日時。これより後のフォローがあれば作り直す (accounts.suggestions)
+    suggestions_updated_at = models.DateTimeField(null=True, blank=True)
+
+    def _add_follow_counts(self, user, delta):
+        # 2行を常に主キー順で更新し、同時に逆向きのフォローが起きてもデッドロックしないようにする
+        updates = sorted([(self.pk, "following_count"), (user.pk, "followers_count")])
+        for pk, field in updates:
+            users = User.objects.filter(pk=pk)
+            if delta < 0:
+                users = users.filter(**{f"{field}__gt": 0})
+            users.update(**{field: F(field) + delta})
+
+    def follow(self, user):
+        """フォローする。中間テーブルに実際に行が追加されたときだけ両者の件数を増やして True を返す。"""
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    Follow.objects.create(follower_id=self.pk, followee_id=user.pk)
+            except IntegrityError:
+                return False
+            self._add_follow_counts(user, 1)
+            follows_changed.send(sender=User, users=[self, user])
+        return True
+
+    def unfollow(self, user):
+        """フォローを解除する。中間テーブルから実際に行が削除されたときだけ両者の件数を減らして True を返す。"""
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(follower_id=self.pk, followee_id=user.pk).delete()
+            if not deleted:
+                return False
+            self._add_follow_counts(user, -1)
+            follows_changed.send(sender=User, users=[self, user])
+        return True
+
+
+def count_follows(field):
+    """field (follower_id か followee_id) が外側のユーザーと一致するフォローの件数を数えるサブクエリ。"""
+    follows = Follow.objects.filter(**{field: OuterRef("pk")}).order_by().values(field).annotate(count=Count("id"))
+    return Coalesce(Subquery(follows.values("count")), 0)
+
+
+def sync_follow_counts(user_ids):
+    """user_ids のユーザーの following_count / followers_count を Follow から数え直す。"""
+    users = User.objects.filter(pk__in=user_ids)
+    users.update(
+        following_count=count_follows("follower_id"),
+        followers_count=count_follows("followee_id"),
+    )
+    follows_changed.send(sender=User, users=users.only("username"))
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _sync_follow_counts_in_chunks(user_ids, batch_size):
+    for chunk in _chunks(sorted(user_ids), batch_size):
+        with transaction.atomic():
+            sync_follow_counts(chunk)
+
+
+class FollowQuerySet(models.QuerySet):
+    """
+    インポートやモデレーションで多数のフォローをまとめて付け外しする。
+    チャンクごとにトランザクションを分けて書き込みのロックを短くし、関わったユーザーの件数は最後に1人1回ずつ Follow から
+    数え直す (多くのチャンクに出てくる人気のアカウントを、チャンクごとに数え直さない)。
+    タイムラインの受信箱は更新しないので、フォローした後は tweets.feed.backfill_follows で埋める。
+    """
+
+    def bulk_follow(self, pairs, batch_size=1000):
+        """
+        (フォローする側のID, される側のID) の組をまとめてフォローにする。
+        既にある組と自分自身へのフォローは無視し、実際に追加した件数を返す。
+        """
+        pairs = {(follower_id, followee_id) for follower_id, followee_id in pairs if follower_id != followee_id}
+        added = 0
+        user_ids = set()
+        for chunk in _chunks(sorted(pairs), batch_size):
+            with transaction.atomic():
+                new_pairs = set(chunk) - _existing_pairs(chunk).keys()
+                Follow.objects.bulk_create(
+                    [
+                        Follow(follower_id=follower_id, followee_id=followee_id)
+                        for follower_id, followee_id in new_pairs
+                    ],
+                    ignore_conflicts=True,
+                )
+            added += len(new_pairs)
+            user_ids.update(pk for pair in new_pairs for pk in pair)
+        _sync_follow_counts_in_chunks(user_ids, batch_size)
+        return added
+
+    def bulk_unfollow(self, pairs, batch_size=1000):
+        """(フォローする側のID, される側のID) の組のフォローをまとめて解除し、削除した件数を返す。"""
+        deleted = 0
+        user_ids = set()
+        for chunk in _chunks(sorted(set(pairs)), batch_size):
+            with transaction.atomic():
+                existing = _existing_pairs(chunk)
+                count, _ = Follow.objects.filter(pk__in=existing.values()).delete()
+            deleted += count
+            user_ids.update(pk for pair in existing for pk in pair)
+        _sync_follow_counts_in_chunks(user_ids, batch_size)
+        return deleted
+
+    def unfollow_all(self, batch_size=1000):
+        """
+        この QuerySet のフォローをすべて解除し、削除した件数を返す。
+        スパムアカウントのフォロワーを外すときなどに Follow.objects.filter(followee_id__in=...) から呼ぶ。
+        """
+        deleted = 0
+        user_ids = set()
+        while True:
+            with transaction.atomic():
+                rows = list(self.order_by("pk").values_list("pk", "follower_id", "followee_id")[:batch_size])
+                if not rows:
+                    break
+                count, _ = Follow.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            deleted += count
+            user_ids.update(user_id for _, *pair in rows for user_id in pair)
+        _sync_follow_counts_in_chunks(user_ids, batch_size)
+        return deleted
+
+
+def _existing_pairs(pairs):
+    """pairs のうち既にあるフォローの {(follower_id, followee_id): ID}。IN 2つで広めに読み、組は Python で絞る。"""
+    pairs = set(pairs)
+    rows = Follow.objects.filter(
+        follower_id__in={follower_id for follower_id, _ in pairs},
+        followee_id__in={followee_id for _, followee_id in pairs},
+    ).values_list("follower_id", "followee_id", "pk")
+    return {
+        (follower_id, followee_id): pk for follower_id, followee_id, pk in rows if (follower_id, followee_id) in pairs
+    }
+
+
+class Follow(models.Model):
+    """
+    User.following の中間テーブル。follower が followee をフォローしている。
+    一覧はフォローした日時の降順に、fan-out はフォロワーのIDだけを読むので、両方向の索引を持つ。
+    """
+
+    # 索引は (follower, followee) の一意制約と Meta.indexes が先頭の列で兼ねるので、外部キー単独の索引は作らない
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", db_index=False)
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", db_index=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = FollowQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.follower_id} -> {self.followee_id}"
+
+    class Meta:
+        verbose_name_plural = "フォロー"
+        constraints = [
+            models.UniqueConstraint(fields=["follower", "followee"], name="follow_unique_pair"),
+            models.CheckConstraint(check=~Q(follower=F("followee")), name="follow_not_self"),
+        ]
+        indexes = [
+            # フォロー中一覧・フォロワー一覧 (フォローした日時の降順)
+            models.Index(fields=["follower", "-created_at", "-id"], name="follow_follower_created_idx"),
+            models.Index(fields=["followee", "-created_at", "-id"], name="follow_followee_created_idx"),
+            # フォロワーのIDだけを読む fan-out 用
+            models.Index(fields=["followee", "follower"], name="follow_followee_follower_idx"),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """
+    user へのおすすめユーザー。update_follow_suggestions が作り、プロフィールでは score の降順に読むだけにする。
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", db_index=False)
+    candidate = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    # user がフォローしている人のうち candidate をフォローしている人数
+    mutual_count = models.PositiveIntegerField()
+    # candidate の最近のツイートに付いたいいねの数
+    recent_likes = models.PositiveIntegerField()
 
+    def __str__(self):
+        return f"{self.user_id} -> {self.candidate_id} ({self.score:.2f})"
 
-# class FriendShip(models.Model):
-#     pass
+    class Meta:
+        verbose_name_plural = "おすすめユーザー"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "candidate"], name="suggestion_unique_pair"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-score", "candidate"], name="suggestion_user_score_idx"),
+        ]
@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.headers import invalidate_headers
+from accounts.models import User, follows_changed
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_header(sender, instance, **kwargs):
+    invalidate_headers([instance.username])
+
+
+@receiver(follows_changed, sender=User)
+def invalidate_follow_counts(sender, users, **kwargs):
+    usernames = [user.username for user in users]
+    invalidate_headers(usernames)
+    # コミットまでの間に他のリクエストが古い件数を入れ直すことがあるので、コミットの後にも消す
+    transaction.on_commit(lambda: invalidate_headers(usernames))
@@ -0,0 +1,177 @@
+"""
+おすすめユーザー (who to follow)。
+
+候補は、自分がフォローしている人がフォローしている人 (2段先) のうち、まだフォローしていない人。
+自分のフォローのうち何人が候補をフォローしているか (mutual_count) と、候補の最近のツイートに付いたいいねの数で並べる。
+
+    score = mutual_count + SUGGESTION_ENGAGEMENT_WEIGHT * log(1 + recent_likes)
+
+update_follow_suggestions コマンドが、フォローが変わったユーザーと古くなったユーザーの分だけを作り直して
+FollowSuggestion に保存する。グラフはユーザーのチャンクごとに SQL 1回でたどり、1人あたりにたどるフォローは
+新しいものから SUGGESTION_MAX_FOLLOWING 件 (自分のフォロー・その先のフォローそれぞれ) までにする。
+プロフィールでは、閲覧者の FollowSuggestion を (user, score) の索引で読むだけにする。
+"""
+
+import heapq
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Exists, IntegerField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import Follow, FollowSuggestion, User
+from tweets.models import Tweet
+
+# 一度に読む候補のIDの数
+CANDIDATE_BATCH_SIZE = 1000
+
+# user_ids の各ユーザーについて、(ユーザーID, 候補のID, mutual_count) を返す。
+# recent は各ユーザーのフォローを新しい順に番号を付けて先頭だけ残し、1人あたりにたどる行数を抑える
+_CANDIDATES_SQL = """
+WITH seeds AS (
+    SELECT follower_id AS user_id, followee_id FROM (
+        SELECT follower_id, followee_id,
+               ROW_NUMBER() OVER (PARTITION BY follower_id ORDER BY created_at DESC, id DESC) AS n
+        FROM {follow} WHERE follower_id IN ({user_ids})
+    ) recent WHERE n <= %s
+),
+hops AS (
+    SELECT follower_id, followee_id FROM (
+        SELECT follower_id, followee_id,
+               ROW_NUMBER() OVER (PARTITION BY follower_id ORDER BY created_at DESC, id DESC) AS n
+        FROM {follow} WHERE follower_id IN (SELECT followee_id FROM seeds)
+    ) recent WHERE n <= %s
+)
+SELECT seeds.user_id, hops.followee_id, COUNT(*)
+FROM seeds JOIN hops ON hops.follower_id = seeds.followee_id
+WHERE hops.followee_id <> seeds.user_id
+  AND NOT EXISTS (
+    SELECT 1 FROM {follow} followed
+    WHERE followed.follower_id = seeds.user_id AND followed.followee_id = hops.followee_id
+  )
+GROUP BY seeds.user_id, hops.followee_id
+"""
+
+
+def _mutual_counts(user_ids):
+    """{ユーザーID: {候補のID: mutual_count}}"""
+    connection = connections[router.db_for_read(Follow)]
+    sql = _CANDIDATES_SQL.format(
+        follow=connection.ops.quote_name(Follow._meta.db_table), user_ids=", ".join(["%s"] * len(user_ids))
+    )
+    counts = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*user_ids, settings.SUGGESTION_MAX_FOLLOWING, settings.SUGGESTION_MAX_FOLLOWING])
+        for user_id, candidate_id, mutual_count in cursor.fetchall():
+            counts[user_id][candidate_id] = mutual_count
+    return counts
+
+
+def _recent_likes(candidate_ids, since):
+    """有効な候補だけの {候補のID: 作成が since 以降のツイートに付いたいいねの数}。"""
+    likes = (
+        Tweet.objects.filter(user_id=OuterRef("pk"), created_at__gte=since)
+        .order_by()
+        .values("user_id")
+        .annotate(likes=Sum("like_count"))
+        .values("likes")
+    )
+    candidate_ids = sorted(candidate_ids)
+    recent_likes = {}
+    for start in range(0, len(candidate_ids), CANDIDATE_BATCH_SIZE):
+        users = User.objects.filter(pk__in=candidate_ids[start : start + CANDIDATE_BATCH_SIZE], is_active=True)
+        users = users.annotate(recent_likes=Coalesce(Subquery(likes, output_field=IntegerField()), 0))
+        recent_likes.update(users.values_list("pk", "recent_likes"))
+    return recent_likes
+
+
+def score(mutual_count, recent_likes):
+    return mutual_count + settings.SUGGESTION_ENGAGEMENT_WEIGHT * math.log1p(recent_likes)
+
+
+def update_suggestions(user_ids, now=None):
+    """user_ids のユーザーのおすすめを作り直し、保存した件数を返す。"""
+    now = now or timezone.now()
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    mutual_counts = _mutual_counts(user_ids)
+    recent_likes = _recent_likes(
+        {pk for candidates in mutual_counts.values() for pk in candidates},
+        now - timedelta(days=settings.SUGGESTION_ENGAGEMENT_DAYS),
+    )
+    suggestions = []
+    for user_id, candidates in mutual_counts.items():
+        scored = [
+            (score(mutual_count, recent_likes[pk]), -pk, mutual_count)
+            for pk, mutual_count in candidates.items()
+            if pk in recent_likes
+        ]
+        for value, negative_pk, mutual_count in heapq.nlargest(settings.SUGGESTION_COUNT, scored):
+            suggestions.append(
+                FollowSuggestion(
+                    user_id=user_id,
+                    candidate_id=-negative_pk,
+                    score=value,
+                    mutual_count=mutual_count,
+                    recent_likes=recent_likes[-negative_pk],
+                )
+            )
+    # 読み込みは済ませておき、書き込みのトランザクションを短くする
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FollowSuggestion.objects.bulk_create(suggestions)
+        User.objects.filter(pk__in=user_ids).update(suggestions_updated_at=now)
+    return len(suggestions)
+
+
+def stale_users(now=None):
+    """おすすめを作り直すユーザー。まだ作っていない・前回より後にフォローした・SUGGESTION_MAX_AGE より古い。"""
+    now = now or timezone.now()
+    followed = Follow.objects.filter(follower_id=OuterRef("pk"), created_at__gt=OuterRef("suggestions_updated_at"))
+    return User.objects.filter(is_active=True).filter(
+        Q(suggestions_updated_at__isnull=True)
+        | Q(suggestions_updated_at__lt=now - timedelta(seconds=settings.SUGGESTION_MAX_AGE))
+        | Exists(followed)
+    )
+
+
+def update_stale_suggestions(batch_size=500, max_users=None, force=False):
+    """
+    古くなったユーザー (force のときは全員) のおすすめを、ユーザーIDの範囲ごとに作り直す。
+    max_users 人を超えたら残りは次回に回す。作り直したユーザー数を返す。
+    """
+    now = timezone.now()
+    users = User.objects.filter(is_active=True) if force else stale_users(now)
+    max_pk = User.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+    updated = 0
+    for start in range(0, max_pk + 1, batch_size):
+        if max_users is not None and updated >= max_users:
+            break
+        chunk = users.filter(pk__gte=start, pk__lt=start + batch_size).order_by("pk")
+        user_ids = list(chunk.values_list("pk", flat=True))
+        if max_users is not None:
+            user_ids = user_ids[: max_users - updated]
+        update_suggestions(user_ids, now)
+        updated += len(user_ids)
+    return updated
+
+
+def suggestions_for(user, limit=None):
+    """
+    user へのおすすめの QuerySet。候補のユーザーを candidate に入れる。
+    保存した後にフォローした相手は、(follower, followee) の一意制約の索引で除く。
+    """
+    followed = Follow.objects.filter(follower_id=user.pk, followee_id=OuterRef("candidate_id"))
+    suggestions = (
+        FollowSuggestion.objects.filter(user_id=user.pk)
+        .filter(~Exists(followed))
+        .select_related("candidate")
+        .only("score", "mutual_count", "recent_likes", "candidate__username", "candidate__followers_count")
+        .order_by("-score", "candidate_id")
+    )
+    return suggestions[: limit or settings.SUGGESTION_DISPLAY_COUNT]
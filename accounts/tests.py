@@ -1,10 +1,25 @@
+import importlib
 import random
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
+from django.apps import apps
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from accounts import urls as accounts_urls
+from accounts.follows import follow_list_queryset
+from accounts.models import Follow, sync_follow_counts
+from accounts.suggestions import suggestions_for, update_stale_suggestions
 from mysite import settings
+from mysite.testing import QueryBudgetMixin
 from tweets.models import Tweet
 
 User = get_user_model()
@@ -299,7 +314,7 @@ class TestUserProfileView(TestCase):
             self.followees.append(followee)
         # self.userが全部のアカウントをフォロー
         for followee in self.followees:
-            self.user.following.add(followee)
+            self.user.follow(followee)
 
         # self.userが10以下の数ツイート
         for i in range(random.randint(3, 10)):
@@ -376,6 +391,346 @@ class TestFollowView(TestCase):
         self.assertEqual(self.user.following.count(), 0)
 
 
+class TestFollowCounts(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="hoge@example.com", password="hogepass")
+        self.targetuser = User.objects.create_user(
+            username="targetuser", email="fuga@example.com", password="fugapass"
+        )
+        self.client.force_login(self.user)
+
+    def assertCounts(self, following_count, followers_count):
+        self.user.refresh_from_db()
+        self.targetuser.refresh_from_db()
+        self.assertEqual(self.user.following_count, following_count)
+        self.assertEqual(self.targetuser.followers_count, followers_count)
+
+    def test_follow_and_unfollow_keep_counts(self):
+        follow_url = reverse("accounts:follow", kwargs={"username": self.targetuser.username})
+        unfollow_url = reverse("accounts:unfollow", kwargs={"username": self.targetuser.username})
+        self.client.post(follow_url)
+        self.client.post(follow_url)
+        self.assertCounts(1, 1)
+        self.client.post(unfollow_url)
+        self.client.post(unfollow_url)
+        self.assertCounts(0, 0)
+
+    def test_profile_header_from_one_row(self):
+        self.user.follow(self.targetuser)
+        url = reverse("accounts:user_profile", kwargs={"username": self.targetuser.username})
+        # session, ログインユーザー, プロフィールの見出し, ツイート一覧, おすすめユーザー
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.context["followers_count"], 1)
+        self.assertEqual(response.context["followings_count"], 0)
+        self.assertTrue(response.context["is_following"])
+
+    def test_profile_header_cache(self):
+        url = reverse("accounts:user_profile", kwargs={"username": self.targetuser.username})
+        self.client.get(url)
+        # 2回目は見出しの行を読まず、フォロー中かどうかだけを調べる
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([query for query in queries if '"accounts_user"."username" = ' in query["sql"]])
+        self.assertEqual(response.context["followers_count"], 0)
+        self.assertFalse(response.context["is_following"])
+
+        # フォローすると件数の入った見出しを消す
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.targetuser.username}))
+        for view in ["accounts:user_profile", "accounts:async_user_profile"]:
+            response = self.client.get(reverse(view, kwargs={"username": self.targetuser.username}))
+            self.assertEqual(response.context["followers_count"], 1)
+            self.assertTrue(response.context["is_following"])
+
+        Follow.objects.bulk_unfollow([(self.user.pk, self.targetuser.pk)])
+        self.assertEqual(self.client.get(url).context["followers_count"], 0)
+
+        self.targetuser.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_rebuild_follow_counts(self):
+        self.user.following.add(self.targetuser)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_follow_counts", "--check", stdout=StringIO())
+        call_command("rebuild_follow_counts", stdout=StringIO())
+        self.assertCounts(1, 1)
+        call_command("rebuild_follow_counts", "--check", stdout=StringIO())
+
+
+class TestUserApi(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="hoge@example.com", password="hogepass")
+        self.others = [
+            User.objects.create_user(username=f"other{i}", email=f"other{i}@example.com", password="hogepass")
+            for i in range(3)
+        ]
+        for other in self.others:
+            self.user.follow(other)
+        self.others[0].follow(self.user)
+        Tweet.objects.create(user=self.user, content="mine")
+        Tweet.objects.create(user=self.others[0], content="theirs")
+        self.client.force_login(self.user)
+
+    def test_user_tweets(self):
+        url = reverse("accounts:api_user_tweets", kwargs={"username": self.user.username})
+        response = self.client.get(url)
+        self.assertEqual([tweet["content"] for tweet in response.json()["tweets"]], ["mine"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_follow_lists(self):
+        url = reverse("accounts:api_following", kwargs={"username": self.user.username})
+        with self.settings(TIMELINE_PAGE_SIZE=2):
+            first = self.client.get(url).json()
+            second = self.client.get(url, {"cursor": first["next_cursor"]}).json()
+        usernames = [user["username"] for user in first["users"] + second["users"]]
+        self.assertEqual(usernames, ["other2", "other1", "other0"])
+        self.assertIsNone(second["next_cursor"])
+
+        url = reverse("accounts:api_followers", kwargs={"username": self.user.username})
+        response = self.client.get(url)
+        (follower,) = response.json()["users"]
+        self.assertEqual(follower["id"], self.others[0].pk)
+        self.assertEqual(follower["username"], "other0")
+        self.assertEqual((follower["following_count"], follower["followers_count"]), (1, 1))
+        self.assertTrue(follower["is_following"])
+
+        etag = response["ETag"]
+        # session, ユーザー, 一覧の持ち主, フォローの集計だけで 304 を返す
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.others[1].follow(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # 閲覧者がフォローを外すと is_following が変わる
+        etag = response["ETag"]
+        self.user.unfollow(self.others[1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user["is_following"] for user in response.json()["users"]], [False, True])
+
+
+class TestAsyncUserViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="hoge@example.com", password="hogepass")
+        self.targetuser = User.objects.create_user(
+            username="targetuser", email="fuga@example.com", password="fugapass"
+        )
+        self.user.follow(self.targetuser)
+        Tweet.objects.create(user=self.targetuser, content="hello")
+        self.client.force_login(self.user)
+
+    def test_profile(self):
+        kwargs = {"username": self.targetuser.username}
+        expected = self.client.get(reverse("accounts:user_profile", kwargs=kwargs))
+        response = self.client.get(reverse("accounts:async_user_profile", kwargs=kwargs))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/profile.html")
+        for key in ["username", "followings_count", "followers_count", "is_following"]:
+            self.assertEqual(response.context[key], expected.context[key])
+        self.assertEqual(list(response.context["object_list"]), list(expected.context["object_list"]))
+        response = self.client.get(reverse("accounts:async_user_profile", kwargs={"username": "nobody"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_follow_lists(self):
+        response = self.client.get(reverse("accounts:async_following_list", kwargs={"username": "testuser"}))
+        self.assertTemplateUsed(response, "accounts/following.html")
+        self.assertEqual(response.context["object_list"], [self.targetuser])
+        response = self.client.get(reverse("accounts:async_follower_list", kwargs={"username": "targetuser"}))
+        self.assertTemplateUsed(response, "accounts/follower.html")
+        self.assertEqual(response.context["object_list"], [self.user])
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestFollowLists(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="hoge@example.com", password="hogepass")
+        self.viewer = User.objects.create_user(username="viewer", email="viewer@example.com", password="hogepass")
+        self.others = [
+            User.objects.create_user(username=f"other{i}", email=f"other{i}@example.com", password="hogepass")
+            for i in range(3)
+        ]
+        for other in self.others:
+            other.follow(self.user)
+            self.user.follow(other)
+        self.viewer.follow(self.others[1])
+        # 後からフォローしたものほど新しい。other0 のフォローをいちばん新しくする
+        now = timezone.now()
+        Follow.objects.filter(follower=self.user, followee=self.others[0]).update(created_at=now + timedelta(days=1))
+        self.client.force_login(self.viewer)
+
+    def get_all(self, name):
+        url = reverse(f"accounts:{name}", kwargs={"username": self.user.username})
+        users, cursor = [], None
+        while True:
+            response = self.client.get(url, {"cursor": cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            if name.startswith("api_"):
+                data = response.json()
+                users += [(user["username"], user["is_following"]) for user in data["users"]]
+                cursor = data["next_cursor"]
+            else:
+                users += [(user.username, user.is_following) for user in response.context["object_list"]]
+                page = response.context["page_obj"]
+                cursor = page.next_cursor if page.has_next() else None
+            if cursor is None:
+                return users
+
+    def test_ordered_by_follow_time(self):
+        expected = [("other0", False), ("other2", False), ("other1", True)]
+        for name in ["following_list", "api_following", "async_following_list"]:
+            with self.subTest(name=name):
+                self.assertEqual(self.get_all(name), expected)
+        expected = [("other2", False), ("other1", True), ("other0", False)]
+        for name in ["follower_list", "api_followers", "async_follower_list"]:
+            with self.subTest(name=name):
+                self.assertEqual(self.get_all(name), expected)
+
+    def test_migration_keeps_follow_order(self):
+        # 日時のなかった既存のフォローは、IDの順をフォローした日時の順として残す
+        Follow.objects.update(created_at=timezone.now())
+        migration = importlib.import_module("accounts.migrations.0004_follow_model")
+        migration.order_created_at(apps, SimpleNamespace(connection=connection))
+        follows = list(Follow.objects.order_by("-created_at"))
+        self.assertEqual(follows, list(Follow.objects.order_by("-pk")))
+        self.assertEqual(len({follow.created_at for follow in follows}), len(follows))
+
+    def test_invalid_cursor(self):
+        url = reverse("accounts:following_list", kwargs={"username": self.user.username})
+        self.assertEqual(self.client.get(url, {"cursor": "x"}).status_code, 404)
+
+    def test_query_plan(self):
+        queryset = follow_list_queryset(self.user, "follower").order_by("-created_at", "-id")
+        self.assertIn("follow_followee_created_idx", queryset.explain())
+
+
+class TestBulkFollow(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="hogepass")
+            for i in range(4)
+        ]
+        self.users[0].follow(self.users[1])
+
+    def assert_counts(self):
+        for user in User.objects.all():
+            self.assertEqual(user.following_count, Follow.objects.filter(follower=user).count())
+            self.assertEqual(user.followers_count, Follow.objects.filter(followee=user).count())
+
+    def test_bulk_follow(self):
+        a, b, c, d = [user.pk for user in self.users]
+        # 既にある組・重複・自分自身へのフォローは数えない
+        added = Follow.objects.bulk_follow([(a, b), (a, c), (a, c), (b, b), (c, a), (d, a)], batch_size=2)
+        self.assertEqual(added, 3)
+        self.assertEqual(
+            set(Follow.objects.values_list("follower_id", "followee_id")), {(a, b), (a, c), (c, a), (d, a)}
+        )
+        self.assert_counts()
+
+    def test_bulk_unfollow(self):
+        a, b, c, d = [user.pk for user in self.users]
+        Follow.objects.bulk_follow([(a, c), (b, c), (c, a)])
+        deleted = Follow.objects.bulk_unfollow([(a, b), (c, a), (b, a), (d, c)], batch_size=1)
+        self.assertEqual(deleted, 2)
+        self.assertEqual(set(Follow.objects.values_list("follower_id", "followee_id")), {(a, c), (b, c)})
+        self.assert_counts()
+
+    def test_unfollow_all(self):
+        a, b, c, d = [user.pk for user in self.users]
+        Follow.objects.bulk_follow([(b, a), (c, a), (d, a), (a, c)])
+        self.assertEqual(Follow.objects.filter(followee_id=a).unfollow_all(batch_size=2), 3)
+        self.assertEqual(set(Follow.objects.values_list("follower_id", "followee_id")), {(a, b), (a, c)})
+        self.assert_counts()
+
+    def test_counts_are_synced_once_per_user(self):
+        a, b, c, d = [user.pk for user in self.users]
+        # どのチャンクにも出てくる a も、数え直すのは最後に1回だけ
+        with mock.patch("accounts.models.sync_follow_counts", wraps=sync_follow_counts) as sync:
+            Follow.objects.bulk_follow([(b, a), (c, a), (d, a)], batch_size=1)
+            Follow.objects.filter(followee_id=a).unfollow_all(batch_size=1)
+            Follow.objects.bulk_unfollow([(a, b), (a, c)], batch_size=1)
+        synced = [user_id for call in sync.call_args_list for user_id in call.args[0]]
+        self.assertEqual(sorted(synced), sorted([a, b, c, d] * 2 + [a, b]))
+        self.assert_counts()
+
+    def test_constraints(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(follower=self.users[2], followee=self.users[2])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(follower=self.users[0], followee=self.users[1])
+
+
+@override_settings(SUGGESTION_ENGAGEMENT_WEIGHT=1.0)
+class TestFollowSuggestions(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(username=name, email=f"{name}@example.com", password="hogepass")
+            for name in ["me", "friend1", "friend2", "popular", "quiet", "known"]
+        }
+        u = self.users
+        u["me"].follow(u["friend1"])
+        u["me"].follow(u["friend2"])
+        u["me"].follow(u["known"])
+        for friend in ["friend1", "friend2"]:
+            u[friend].follow(u["popular"])
+            u[friend].follow(u["quiet"])
+            u[friend].follow(u["known"])
+            u[friend].follow(u["me"])
+        tweet = Tweet.objects.create(user=u["popular"], content="hello")
+        for name in ["friend1", "friend2", "known"]:
+            tweet.add_like(u[name])
+        # 古いツイートのいいねは数えない
+        old = Tweet.objects.create(user=u["quiet"], content="old")
+        old.add_like(u["friend1"])
+        Tweet.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+    def suggested(self, name):
+        return [
+            (suggestion.candidate.username, suggestion.mutual_count, suggestion.recent_likes)
+            for suggestion in suggestions_for(self.users[name])
+        ]
+
+    def test_ranking(self):
+        self.assertEqual(update_stale_suggestions(), len(self.users))
+        # 自分自身とフォロー済みの相手は出さない。mutual_count が同じなら最近のいいねが多いほうが上
+        self.assertEqual(self.suggested("me"), [("popular", 2, 3), ("quiet", 2, 0)])
+        self.assertEqual(self.suggested("friend1"), [("friend2", 1, 0)])
+
+    def test_incremental(self):
+        update_stale_suggestions()
+        self.assertEqual(update_stale_suggestions(), 0)
+        self.users["friend1"].follow(self.users["friend2"])
+        self.assertEqual(update_stale_suggestions(), 1)
+        self.assertEqual(self.suggested("friend1"), [])
+        with override_settings(SUGGESTION_MAX_AGE=0):
+            self.assertEqual(update_stale_suggestions(max_users=2), 2)
+        self.assertEqual(update_stale_suggestions(force=True), len(self.users))
+
+    def test_followed_after_update_is_hidden(self):
+        update_stale_suggestions()
+        self.users["me"].follow(self.users["popular"])
+        self.assertEqual(self.suggested("me"), [("quiet", 2, 0)])
+
+    @override_settings(SUGGESTION_MAX_FOLLOWING=1)
+    def test_work_cap(self):
+        # me が最後にフォローしたのは known なので、known のフォローしか候補にならない
+        self.users["known"].follow(self.users["quiet"])
+        update_stale_suggestions()
+        self.assertEqual(self.suggested("me"), [("quiet", 1, 0)])
+
+    def test_profile(self):
+        call_command("update_follow_suggestions", stdout=StringIO())
+        self.client.force_login(self.users["me"])
+        for name in ["user_profile", "async_user_profile"]:
+            with self.subTest(name=name):
+                response = self.client.get(reverse(f"accounts:{name}", kwargs={"username": "known"}))
+                names = [suggestion.candidate.username for suggestion in response.context["suggestions"]]
+                self.assertEqual(names, ["popular", "quiet"])
+                self.assertContains(response, "おすすめユーザー")
+
+    def test_query_plan(self):
+        self.assertIn("suggestion_user_score_idx", suggestions_for(self.users["me"]).explain())
+
+
 class TestUnfollowView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -460,7 +815,8 @@ class TestFollowingListView(TestCase):
         )
         self.assertEqual(res.status_code, 200)
         user_list = res.context["user_list"]
-        self.assertEqual(list(user_list), self.followees)
+        # フォローした日時の新しい順
+        self.assertEqual(list(user_list), self.followees[::-1])
 
 
 class TestFollowerListView(TestCase):
@@ -493,4 +849,96 @@ class TestFollowerListView(TestCase):
         )
         self.assertEqual(res.status_code, 200)
         user_list = res.context["user_list"]
-        self.assertEqual(list(user_list), self.followers)
+        self.assertEqual(list(user_list), self.followers[::-1])
+
+
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    """どのビューも、フォローやツイートの数によらず一定のクエリ数で応答すること。"""
+
+    urls_module = accounts_urls
+    # ログイン中は session とログインユーザーの2回を含む。登録・ログインはセッションの作成と保存を含む。
+    # フォロー一覧は相手のユーザー・ページ・閲覧者がフォローしているかの3回で、APIはETag用のフォローの集計を含む。
+    # プロフィールはおすすめユーザーの1回を含む
+    query_budgets = {
+        "signup": 0,
+        "signup:post": 11,
+        "login": 0,
+        "login:post": 9,
+        "logout:post": 4,
+        "user_profile": 6,
+        "following_list": 5,
+        "follower_list": 5,
+        "follow:post": 12,
+        "unfollow:post": 9,
+        "api_user_tweets": 6,
+        "api_following": 6,
+        "api_followers": 6,
+        "async_user_profile": 7,
+        "async_following_list": 5,
+        "async_follower_list": 5,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="hoge@example.com", password="hogepass")
+        self.target = User.objects.create_user(username="target", email="target@example.com", password="hogepass")
+        self.client.force_login(self.user)
+        self.users = []
+        self.grow()
+
+    def grow(self, count=3):
+        """target のフォロー・フォロワーとツイート、いいねを count ずつ増やす。"""
+        start = len(self.users)
+        for i in range(start, start + count):
+            user = User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="hogepass")
+            user.follow(self.target)
+            self.target.follow(user)
+            self.users.append(user)
+            tweet = Tweet.objects.create(user=self.target, content=f"tweet {i}")
+            tweet.add_like(user)
+            tweet.add_like(self.user)
+
+    def test_every_view_has_budget(self):
+        self.assertEveryViewHasBudget()
+
+    def test_anonymous_pages(self):
+        self.client.logout()
+        self.assertQueryBudget("signup", lambda: self.client.get(reverse("accounts:signup")))
+        self.assertQueryBudget("login", lambda: self.client.get(reverse("accounts:login")))
+        data = {
+            "username": "newuser",
+            "email": "new@example.com",
+            "password1": "s3cret-pass",
+            "password2": "s3cret-pass",
+        }
+        self.assertQueryBudget("signup:post", lambda: self.client.post(reverse("accounts:signup"), data))
+        self.assertQueryBudget("logout:post", lambda: self.client.post(reverse("accounts:logout")))
+        data = {"username": "newuser", "password": "s3cret-pass"}
+        self.assertQueryBudget("login:post", lambda: self.client.post(reverse("accounts:login"), data))
+
+    def test_profile_and_lists(self):
+        names = [
+            "user_profile",
+            "following_list",
+            "follower_list",
+            "api_user_tweets",
+            "api_following",
+            "api_followers",
+            "async_user_profile",
+            "async_following_list",
+            "async_follower_list",
+        ]
+        for name in names:
+            with self.subTest(name=name):
+                url = reverse(f"accounts:{name}", kwargs={"username": self.target.username})
+                self.assertNoNPlusOne(name, lambda: self.client.get(url), self.grow)
+
+    def test_follow_and_unfollow(self):
+        url_kwargs = {"username": self.target.username}
+        for _ in range(2):
+            self.assertQueryBudget(
+                "follow:post", lambda: self.client.post(reverse("accounts:follow", kwargs=url_kwargs))
+            )
+            self.assertQueryBudget(
+                "unfollow:post", lambda: self.client.post(reverse("accounts:unfollow", kwargs=url_kwargs))
+            )
+            self.grow()
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = "accounts"
 urlpatterns = [
@@ -23,4 +23,27 @@ urlpatterns = [
     ),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
+    path("api/<str:username>/tweets/", api.UserTimelineApiView.as_view(), name="api_user_tweets"),
+    path(
+        "api/<str:username>/following/",
+        api.FollowListApiView.as_view(relation="following"),
+        name="api_following",
+    ),
+    path(
+        "api/<str:username>/followers/",
+        api.FollowListApiView.as_view(relation="follower"),
+        name="api_followers",
+    ),
+    # 読み込み系の非同期版 (ASGIで動かす)
+    path("async/<str:username>/profile/", async_views.AsyncUserProfileView.as_view(), name="async_user_profile"),
+    path(
+        "async/<str:username>/following_list/",
+        async_views.AsyncFollowListView.as_view(relation="following"),
+        name="async_following_list",
+    ),
+    path(
+        "async/<str:username>/follower_list/",
+        async_views.AsyncFollowListView.as_view(relation="follower"),
+        name="async_follower_list",
+    ),
 ]
@@ -2,13 +2,19 @@ from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Exists, OuterRef
+from django.db.models import Exists, OuterRef
 from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, ListView, RedirectView
 
+from accounts.follows import FollowListPaginator, follow_list_queryset, resolve_is_following
+from accounts.headers import cache_header, get_cached_header
+from accounts.suggestions import suggestions_for
+from tweets.feed import backfill_timeline, purge_timeline
 from tweets.models import Tweet
+from tweets.pagination import CursorPaginationMixin
+from tweets.timeline import TimelineMixin
 
 from .forms import SignUpForm
 
@@ -40,78 +46,65 @@ class LogoutView(LoginRequiredMixin, auth_views.LogoutView):
     pass
 
 
-class UserProfileView(LoginRequiredMixin, ListView):
+class UserProfileView(LoginRequiredMixin, TimelineMixin, ListView):
     template_name = "accounts/profile.html"
     model = Tweet
-    queryset = Tweet.objects.select_related("user")
 
     def get_user(self):
         if not hasattr(self, "user"):
             username = self.kwargs.get("username")
-            self.user = get_object_or_404(User, username=username)
+            # 見出しがキャッシュにあれば、フォロー中かどうかだけをフォローの索引で調べる (accounts.headers)
+            self.user = get_cached_header(username)
+            if self.user is not None:
+                self.user.is_following = User.following.through.objects.filter(
+                    follower_id=self.request.user.pk, followee_id=self.user.pk
+                ).exists()
+                return self.user
+            # フォロー数・フォロワー数・フォロー中かどうかまでプロフィールの見出しを1行で読む
+            is_following = User.following.through.objects.filter(
+                follower_id=self.request.user.pk,
+                followee_id=OuterRef("pk"),
+            )
+            users = User.objects.annotate(is_following=Exists(is_following))
+            self.user = get_object_or_404(users, username=username)
+            cache_header(self.user)
 
         return self.user
 
     def get_queryset(self, **kwargs):
         user = self.get_user()  # Userオブジェクトを取得
-        queryset = (
-            self.queryset.filter(user=user)  # Userオブジェクトでフィルター
-            .order_by("-created_at")
-            .annotate(
-                like_counts=Count("liked_by"),
-                is_liked=Exists(
-                    Tweet.objects.filter(
-                        pk=OuterRef("pk"),
-                        liked_by=self.request.user,
-                    ),
-                ),
-            )
-        )
-        return queryset
+        return super().get_queryset(**kwargs).filter(user=user)  # Userオブジェクトでフィルター
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.get_user()
         context["username"] = user.username
-        context["followings_count"] = user.following.count()
-        context["followers_count"] = User.objects.filter(
-            following=user,
-        ).count()
-        context["is_following"] = self.request.user.following.filter(
-            username=user.username,
-        ).exists()
+        context["followings_count"] = user.following_count
+        context["followers_count"] = user.followers_count
+        context["is_following"] = user.is_following
+        context["suggestions"] = list(suggestions_for(self.request.user))
         return context
 
 
-# コピペ元amaさん
-class FollowingListView(LoginRequiredMixin, ListView):
-    model = User
-    template_name = "accounts/following.html"
+class FollowListMixin(CursorPaginationMixin):
+    """フォロー中・フォロワー一覧。フォローした日時の降順に ?cursor= でページ分割する (accounts.follows)。"""
+
+    # 一覧は Follow の QuerySet から作るが、テンプレートには相手のユーザーを user_list として渡す
+    context_object_name = "user_list"
+    # following ならフォローしている相手、follower ならフォローしてくれている相手
+    relation = None
 
-    # デフォルトでは単にモデルのオブジェクトを並べるだけ
     def get_queryset(self, **kwargs):
-        user = get_object_or_404(
-            User.objects.prefetch_related("following"),
-            username=self.kwargs.get("username"),
-        )
-        return user.following.all()
-
-    def get_context_deta(self, **kwargs):
-        context = super().get_context_deta(**kwargs)
-        context["username"] = self.kwargs["username"]
-        return context
+        user = get_object_or_404(User.objects.only("id"), username=self.kwargs.get("username"))
+        return follow_list_queryset(user, self.relation)
 
+    def get_cursor_paginator(self, page_size):
+        return FollowListPaginator(page_size, self.relation)
 
-class FollowerListView(LoginRequiredMixin, ListView):
-    model = User
-    template_name = "accounts/follower.html"
-
-    def get_queryset(self, **kwargs):
-        user = get_object_or_404(
-            User.objects.prefetch_related("follower"),
-            username=self.kwargs.get("username"),
-        )
-        return user.follower.all()
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        resolve_is_following(object_list, self.request.user)
+        return (paginator, page, object_list, is_paginated)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -119,6 +112,16 @@ class FollowerListView(LoginRequiredMixin, ListView):
         return context
 
 
+class FollowingListView(LoginRequiredMixin, FollowListMixin, ListView):
+    template_name = "accounts/following.html"
+    relation = "following"
+
+
+class FollowerListView(LoginRequiredMixin, FollowListMixin, ListView):
+    template_name = "accounts/follower.html"
+    relation = "follower"
+
+
 class FollowView(LoginRequiredMixin, RedirectView):
     url = reverse_lazy("tweets:home")
     http_method_names = ["post"]
@@ -127,7 +130,8 @@ class FollowView(LoginRequiredMixin, RedirectView):
         if self.kwargs["username"] == request.user.username:
             return HttpResponseBadRequest("自分自身をフォローすることはできません。")
         target_user = get_object_or_404(User, username=self.kwargs["username"])
-        request.user.following.add(target_user)
+        if request.user.follow(target_user):
+            backfill_timeline(request.user, target_user)
         return super().post(request, *args, **kwargs)
 
 
@@ -139,5 +143,6 @@ class UnFollowView(LoginRequiredMixin, RedirectView):
         if self.kwargs["username"] == request.user.username:
             return HttpResponseBadRequest("自分自身にリクエストできません。")
         target_user = get_object_or_404(User, username=self.kwargs["username"])
-        request.user.following.remove(target_user)
+        if request.user.unfollow(target_user):
+            purge_timeline(request.user, target_user)
         return super().post(request, *args, **kwargs)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MysiteConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "mysite"
+
+    def ready(self):
+        from mysite import db  # noqa: F401
@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# get_asgi_application() で設定を読み込んだ後でないと import できない
+from tweets.stream import route_stream  # noqa: E402
+
+# /tweets/stream/ (Server-Sent Events) だけはDjangoを通さず、非同期のまま処理する
+application = route_stream(django_application)
@@ -0,0 +1,25 @@
+"""
+ベンチマーク用の集計。
+"""
+
+import math
+
+
+def percentile(samples, p):
+    """最近傍順位法による p パーセンタイル。"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    """応答時間 (秒) のリストと全体の経過秒数から、ミリ秒単位のパーセンタイルと1秒あたりの処理数を作る。"""
+    return {
+        "requests": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+        "rps": round(len(samples) / elapsed, 1) if elapsed else None,
+    }
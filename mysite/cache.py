@@ -0,0 +1,180 @@
+"""
+2段キャッシュのバックエンド。
+
+プロセス内のLRU (件数上限と短いTTL付き) を、settings.CACHES の別エイリアスで設定した共有キャッシュの前に置く。
+読み込みはまずプロセス内を見て、なければ共有キャッシュから取ってプロセス内にも入れる。
+書き込み・削除は両方に行うが、他のプロセスのプロセス内キャッシュは LOCAL_TIMEOUT 秒まで古い値を返しうる。
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache.TieredCache",
+            "LOCATION": "shared",  # 共有キャッシュのエイリアス
+            "OPTIONS": {"LOCAL_MAX_ENTRIES": 10000, "LOCAL_TIMEOUT": 5},
+        },
+        "shared": {...},
+    }
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from mysite.metrics import record_cache_lookup
+
+# Djangoはキャッシュのインスタンスをスレッドごとに作るので、LocMemCacheと同じく実体はモジュールに置いてプロセスで共有する
+_local_caches = {}
+_locks = {}
+_stats = {}
+
+_MISSING = object()
+
+
+def key_prefix(key):
+    """統計を取る単位。"tweet:fragment:1" なら "tweet:fragment"。"""
+    return key.rsplit(":", 1)[0] if ":" in key else key
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = location
+        self._local_max_entries = options.get("LOCAL_MAX_ENTRIES", 1000)
+        self._local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self._local = _local_caches.setdefault(location, OrderedDict())
+        self._lock = _locks.setdefault(location, threading.Lock())
+        self._stats = _stats.setdefault(location, defaultdict(Counter))
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def get_stats(self):
+        """キーの接頭辞ごとの local_hits / shared_hits / misses。"""
+        with self._lock:
+            return {prefix: dict(counter) for prefix, counter in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _count(self, key, result):
+        with self._lock:
+            self._stats[key_prefix(key)][result] += 1
+        record_cache_lookup(result != "misses")
+
+    def _local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self._local_timeout
+        return min(self._local_timeout, timeout)
+
+    def _get_local(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+            return value
+
+    def _set_local(self, local_key, value, timeout):
+        ttl = self._local_ttl(timeout)
+        with self._lock:
+            if ttl <= 0:
+                self._local.pop(local_key, None)
+                return
+            self._local[local_key] = (time.monotonic() + ttl, value)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _delete_local(self, local_keys):
+        with self._lock:
+            for local_key in local_keys:
+                self._local.pop(local_key, None)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self._get_local(local_key)
+        if value is not _MISSING:
+            self._count(key, "local_hits")
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count(key, "misses")
+            return default
+        self._count(key, "shared_hits")
+        self._set_local(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remaining = []
+        for key in keys:
+            value = self._get_local(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                remaining.append(key)
+            else:
+                self._count(key, "local_hits")
+                found[key] = value
+        if remaining:
+            shared = self.shared.get_many(remaining, version=version)
+            for key in remaining:
+                if key in shared:
+                    self._count(key, "shared_hits")
+                    self._set_local(self.make_key(key, version=version), shared[key], DEFAULT_TIMEOUT)
+                    found[key] = shared[key]
+                else:
+                    self._count(key, "misses")
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._set_local(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._set_local(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._set_local(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._delete_local([self.make_and_validate_key(key, version=version)])
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        if self._get_local(self.make_and_validate_key(key, version=version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._delete_local([self.make_and_validate_key(key, version=version)])
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._delete_local([self.make_and_validate_key(key, version=version) for key in keys])
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
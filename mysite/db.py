@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from mysite import metrics, slow_queries
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    SQLiteの接続ごとに settings.SQLITE_PRAGMAS を設定する。
+    WALにすると読み込みが書き込みを待たなくなり、busy_timeout の間は
+    ロック待ちで "database is locked" にせずリトライする。
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(connection_created)
+def install_slow_query_log(sender, connection, **kwargs):
+    """SLOW_QUERY_LOG_ENABLED なら、接続のクエリを mysite.slow_queries で記録する。"""
+    if settings.SLOW_QUERY_LOG_ENABLED:
+        slow_queries.install(connection)
+
+
+@receiver(connection_created)
+def install_request_metrics(sender, connection, **kwargs):
+    """PERF_METRICS_ENABLED なら、接続のクエリを処理中のリクエストの RequestStats に足し込む (mysite.metrics)。"""
+    if settings.PERF_METRICS_ENABLED:
+        metrics.install(connection)
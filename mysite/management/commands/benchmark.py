@@ -0,0 +1,168 @@
+import json
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from accounts import urls as accounts_urls
+from mysite.benchmark import summarize
+from tweets import urls as tweets_urls
+from tweets.models import Tweet
+
+User = get_user_model()
+
+# GETでも状態が変わるので測らないURL
+SKIPPED_URLS = {"accounts:logout"}
+
+
+def get_benchmark_urls():
+    """tweets/urls.py と accounts/urls.py のうち GET できるURLの名前と引数名。"""
+    urls = []
+    for module in [tweets_urls, accounts_urls]:
+        for pattern in module.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue
+            name = f"{module.app_name}:{pattern.name}"
+            view_class = getattr(pattern.callback, "view_class", None)
+            if name in SKIPPED_URLS or view_class is None or "get" not in view_class.http_method_names:
+                continue
+            if not hasattr(view_class, "get"):
+                continue
+            urls.append((name, list(pattern.pattern.converters)))
+    return urls
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "tweets/urls.py と accounts/urls.py の GET できる各URLについて、応答時間のパーセンタイル・クエリ数・"
+        "ピークメモリを測ってJSONで出力する。--sizes を指定すると、大きさごとに使い捨てのデータベースを作って "
+        "seed_data で埋めてから測る。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="URLごとのリクエスト数")
+        parser.add_argument(
+            "--sizes",
+            help="ユーザー数,ツイート数 を ; で区切って並べる (例: 100,2000;1000,20000)。省略時は今のデータベースで測る",
+        )
+        parser.add_argument("--username", help="閲覧するユーザー。省略時はフォロワーの最も多いユーザー")
+        parser.add_argument("--output", help="結果を書き出すJSONファイル。省略時は標準出力")
+        parser.add_argument("--baseline", help="比較する以前の結果のJSONファイル")
+
+    def handle(self, *args, **options):
+        runs = []
+        if options["sizes"]:
+            for size in options["sizes"].split(";"):
+                users, tweets = (int(value) for value in size.split(","))
+                runs.append(self.run_with_seed(users, tweets, options))
+        else:
+            runs.append({"size": None, "results": self.run(options)})
+
+        report = {
+            "commit": get_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "requests": options["requests"],
+            "runs": runs,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if options["baseline"]:
+            self.compare(report, options["baseline"])
+
+    def run_with_seed(self, users, tweets, options):
+        # テストランナーと同じ方法で空のデータベースを作り、測り終えたら捨てる
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # SQLiteのメモリ上のデータベースは前の大きさのデータが残っていることがある
+            call_command("flush", interactive=False, verbosity=0)
+            call_command("seed_data", users=users, tweets=tweets, likes=tweets * 2, prefix="bench", stdout=self.stderr)
+            return {"size": {"users": users, "tweets": tweets}, "results": self.run(options)}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"ユーザー {username} が見つかりません。")
+        user = User.objects.order_by("-followers_count", "pk").first()
+        if user is None:
+            raise CommandError("ユーザーがいません。")
+        return user
+
+    def run(self, options):
+        user = self.get_user(options["username"])
+        tweet = Tweet.objects.filter(user=user).order_by("-created_at", "-id").first() or Tweet.objects.last()
+        values = {"username": user.username, "pk": tweet.pk if tweet else 0}
+        results = {}
+        # テスト用クライアントのホスト名 (testserver) を受け付ける
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            client = Client()
+            client.force_login(user)
+            for name, params in get_benchmark_urls():
+                url = reverse(name, kwargs={param: values[param] for param in params})
+                results[name] = self.measure(client, url, options["requests"])
+                self.stderr.write(f"{name}: p50={results[name]['p50_ms']}ms queries={results[name]['queries']}")
+        return results
+
+    def measure(self, client, url, requests):
+        # 1回目はキャッシュが空なので数えない
+        status = client.get(url).status_code
+        samples = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            client.get(url)
+            samples.append(time.perf_counter() - request_started)
+        result = {"path": url, "status": status, **summarize(samples, time.perf_counter() - started)}
+
+        # クエリの記録とメモリの追跡は遅くなるので、時間を測るリクエストとは別に1回だけ行う
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url)
+            result["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+        result["queries"] = len(queries)
+        return result
+
+    def compare(self, report, baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for run, base_run in zip(report["runs"], baseline["runs"]):
+            self.stderr.write(f"size={run['size']} (baseline {baseline['commit']})")
+            for name, result in run["results"].items():
+                base = base_run["results"].get(name)
+                if base is None:
+                    continue
+                ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float("inf")
+                self.stderr.write(
+                    f"  {name:<28} p50 {base['p50_ms']} -> {result['p50_ms']}ms ({ratio:.2f}x) "
+                    f"queries {base['queries']} -> {result['queries']}"
+                )
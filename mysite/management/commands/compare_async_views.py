@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from mysite.benchmark import summarize
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "同じ読み込み処理の同期ビューと非同期ビューに、同時接続数を揃えてリクエストを送り、応答時間を比べる。"
+        "同期側はスレッド、非同期側はイベントループ上のタスクで同時に送る。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", required=True, help="ログインして閲覧するユーザー")
+        parser.add_argument("--requests", type=int, default=100, help="URLごとのリクエスト数")
+        parser.add_argument("--concurrency", type=int, default=10, help="同時に送るリクエスト数")
+        parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+
+    def get_pairs(self, user):
+        tweet = Tweet.objects.order_by("-created_at", "-id").first()
+        if tweet is None:
+            raise CommandError("ツイートがありません。")
+        username = {"username": user.username}
+        return [
+            ("home", reverse("tweets:home"), reverse("tweets:async_home")),
+            (
+                "home_following",
+                reverse("tweets:home") + "?feed=following",
+                reverse("tweets:async_home") + "?feed=following",
+            ),
+            ("detail", reverse("tweets:detail", args=[tweet.pk]), reverse("tweets:async_detail", args=[tweet.pk])),
+            (
+                "profile",
+                reverse("accounts:user_profile", kwargs=username),
+                reverse("accounts:async_user_profile", kwargs=username),
+            ),
+            (
+                "following_list",
+                reverse("accounts:following_list", kwargs=username),
+                reverse("accounts:async_following_list", kwargs=username),
+            ),
+            (
+                "follower_list",
+                reverse("accounts:follower_list", kwargs=username),
+                reverse("accounts:async_follower_list", kwargs=username),
+            ),
+        ]
+
+    def run_sync(self, user, url, requests, concurrency):
+        def fetch(client):
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"{url}: {response.status_code}")
+            return time.perf_counter() - started
+
+        def worker(count):
+            client = Client()
+            client.force_login(user)
+            try:
+                return [fetch(client) for _ in range(count)]
+            finally:
+                connections.close_all()
+
+        counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = [sample for result in executor.map(worker, counts) for sample in result]
+        return summarize(samples, time.perf_counter() - started)
+
+    def run_async(self, client, url, requests, concurrency):
+        async def fetch(semaphore):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f"{url}: {response.status_code}")
+                return time.perf_counter() - started
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            started = time.perf_counter()
+            samples = await asyncio.gather(*(fetch(semaphore) for _ in range(requests)))
+            return summarize(samples, time.perf_counter() - started)
+
+        return asyncio.run(main())
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"ユーザー {options['username']} が見つかりません。")
+        requests, concurrency = options["requests"], options["concurrency"]
+        results = {}
+        # テスト用クライアントのホスト名 (testserver) を受け付ける
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            async_client = AsyncClient()
+            async_client.force_login(user)
+            for name, sync_url, async_url in self.get_pairs(user):
+                results[name] = {
+                    "sync": self.run_sync(user, sync_url, requests, concurrency),
+                    "async": self.run_async(async_client, async_url, requests, concurrency),
+                }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            for mode, summary in result.items():
+                self.stdout.write(
+                    f"{name:<16} {mode:<5} p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms "
+                    f"p99={summary['p99_ms']}ms {summary['rps']} req/s"
+                )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from mysite.metrics import HISTOGRAMS, collect, estimate_percentile, format_prometheus, recent
+
+
+class Command(BaseCommand):
+    help = (
+        "各プロセスが共有キャッシュに書き出したリクエストの計測値を合算して表示する。"
+        "既定ではURL名ごとの直近5分の表、--prometheus で起動からの累計を Prometheus のテキスト形式で出力する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prometheus", action="store_true", help="Prometheus のテキスト形式で出力する")
+
+    def handle(self, *args, **options):
+        data = collect()
+        if options["prometheus"]:
+            self.stdout.write(format_prometheus(data), ending="")
+            return
+
+        views = sorted({view for _, view in data["histograms"]})
+        self.stdout.write(
+            f"{'view':<32} {'count':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} "
+            f"{'db_ms':>8} {'queries':>8} {'tpl_ms':>8} {'cache_hit':>9}"
+        )
+        for view in views:
+            durations = recent(data["histograms"][("http_request_duration_seconds", view)])
+            count = sum(durations.get("counts", []))
+            if not count:
+                continue
+            buckets = HISTOGRAMS["http_request_duration_seconds"][1]
+            p50, p95, p99 = (estimate_percentile(buckets, durations, p) * 1000 for p in (50, 95, 99))
+            db_time = recent(data["histograms"][("db_query_duration_seconds", view)])["sum"] / count * 1000
+            queries = recent(data["histograms"][("db_queries", view)])["sum"] / count
+            template_time = recent(data["histograms"][("template_render_seconds", view)])["sum"] / count * 1000
+            hits = data["counters"].get(("cache_hits_total", view), 0)
+            misses = data["counters"].get(("cache_misses_total", view), 0)
+            hit_ratio = f"{hits / (hits + misses):.0%}" if hits + misses else "-"
+            # パーセンタイルはバケットの上限なので「以下」の意味で読む
+            self.stdout.write(
+                f"{view:<32} {count:>7} {p50:>8.0f} {p95:>8.0f} {p99:>8.0f} "
+                f"{db_time:>8.1f} {queries:>8.1f} {template_time:>8.1f} {hit_ratio:>9}"
+            )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from mysite.slow_queries import collect, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "各プロセスが共有キャッシュに書き出したクエリの集計 (SLOW_QUERY_LOG_ENABLED のとき) を fingerprint ごとに合算し、"
+        "合計時間の長い順に表示する。遅いクエリそのものと実行計画は SLOW_QUERY_LOG_FILE にある。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20, help="表示する fingerprint の数")
+        parser.add_argument(
+            "--sort", choices=["total_ms", "count", "p99_ms", "max_ms"], default="total_ms", help="並べ替えに使う列"
+        )
+
+    def handle(self, *args, **options):
+        rows = [{"fingerprint": key, **summarize(stats)} for key, stats in collect().items()]
+        rows.sort(key=lambda row: row[options["sort"]], reverse=True)
+        self.stdout.write(f"{'count':>7} {'total_ms':>10} {'avg_ms':>8} {'p99_ms':>8} {'max_ms':>8}  fingerprint")
+        for row in rows[: options["limit"]]:
+            self.stdout.write(
+                f"{row['count']:>7} {row['total_ms']:>10.1f} {row['avg_ms']:>8.2f} {row['p99_ms']:>8.1f} "
+                f"{row['max_ms']:>8.1f}  {row['fingerprint']}"
+            )
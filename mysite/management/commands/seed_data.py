@@ -0,0 +1,142 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tweets.models import TimelineEntry, Tweet
+
+User = get_user_model()
+Follow = User.following.through
+Like = Tweet.liked_by.through
+
+
+def zipf_weights(n, exponent):
+    """順位 (0 始まり) が上のものほど選ばれやすい重み。"""
+    return [1 / (rank + 1) ** exponent for rank in range(n)]
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class Command(BaseCommand):
+    help = (
+        "ベンチマーク用に、人気がべき乗則に従うユーザー・ツイート・フォロー・いいねを bulk_create でまとめて作る。"
+        "フォロー数・いいね数・検索の索引とフォロー中タイムラインの受信箱も作り直す。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="ユーザー数")
+        parser.add_argument("--tweets", type=int, default=20000, help="ツイート数")
+        parser.add_argument("--follows-per-user", type=int, default=50, help="1人あたりの平均フォロー数")
+        parser.add_argument("--likes", type=int, default=50000, help="いいねの数 (重複は除く)")
+        parser.add_argument("--exponent", type=float, default=1.1, help="人気の偏り (Zipf の指数)")
+        parser.add_argument("--days", type=int, default=30, help="ツイートの日時をさかのぼる日数")
+        parser.add_argument("--prefix", default="seed", help="作るユーザー名の接頭辞")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="bulk_create 1回あたりの行数")
+        parser.add_argument("--random-seed", type=int, default=0, help="乱数の種")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["random_seed"])
+        self.chunk_size = options["chunk_size"]
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"ユーザー名が {prefix} で始まるユーザーがすでにいます。")
+
+        user_ids = self.create_users(prefix, options["users"])
+        # {ユーザーID: 人気}。user_ids[0] が最も人気のあるユーザー
+        popularity = dict(zip(user_ids, zipf_weights(len(user_ids), options["exponent"])))
+        followers = self.create_follows(user_ids, popularity, options["follows_per_user"])
+        tweets = self.create_tweets(user_ids, popularity, options["tweets"], options["days"])
+        self.create_likes(user_ids, tweets, popularity, options["likes"])
+        call_command("rebuild_follow_counts", stdout=self.stdout)
+        call_command("rebuild_like_counts", stdout=self.stdout)
+        call_command("rebuild_search_index", stdout=self.stdout, stderr=self.stderr)
+        call_command("update_trending", stdout=self.stdout)
+        call_command("update_follow_suggestions", "--all", stdout=self.stdout)
+        self.fill_timelines(followers, tweets)
+
+    def create_users(self, prefix, count):
+        # ハッシュの計算は遅いので全員同じパスワードにする
+        password = make_password("password")
+        for chunk in chunked(range(count), self.chunk_size):
+            User.objects.bulk_create(
+                [User(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password=password) for i in chunk]
+            )
+        users = User.objects.filter(username__startswith=prefix).values_list("username", "pk")
+        ids = dict(users)
+        user_ids = [ids[f"{prefix}{i}"] for i in range(count)]
+        self.stdout.write(f"{len(user_ids)} 人のユーザーを作りました。")
+        return user_ids
+
+    def create_follows(self, user_ids, popularity, follows_per_user):
+        """フォロー数は平均 follows_per_user のパレート分布、フォロー先は人気に比例して選ぶ。{ユーザーID: フォロワーIDのリスト} を返す。"""
+        followers = {pk: [] for pk in user_ids}
+        follows = []
+        cum_weights = list(accumulate(popularity[pk] for pk in user_ids))
+        for pk in user_ids:
+            count = min(len(user_ids) - 1, int(follows_per_user / 2 * self.rng.paretovariate(2)))
+            targets = set(self.rng.choices(user_ids, cum_weights=cum_weights, k=count)) - {pk}
+            for target in targets:
+                followers[target].append(pk)
+                follows.append(Follow(follower_id=pk, followee_id=target))
+            if len(follows) >= self.chunk_size:
+                Follow.objects.bulk_create(follows, ignore_conflicts=True)
+                follows = []
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.stdout.write(f"{sum(len(ids) for ids in followers.values())} 件のフォローを作りました。")
+        return followers
+
+    def create_tweets(self, user_ids, popularity, count, days):
+        """人気のあるユーザーほど多く投稿する。[(ツイートID, ユーザーID, 作成日時)] を古い順に返す。"""
+        now = timezone.now()
+        step = timedelta(days=days) / max(count, 1)
+        cum_weights = list(accumulate(popularity[pk] for pk in user_ids))
+        tweets = []
+        for chunk in chunked(range(count), self.chunk_size):
+            authors = self.rng.choices(user_ids, cum_weights=cum_weights, k=len(chunk))
+            created = Tweet.objects.bulk_create(
+                [Tweet(user_id=author, content=f"tweet {i}") for i, author in zip(chunk, authors)]
+            )
+            # created_at は auto_now_add で上書きされるので、作った後で過去から順に並べ直す
+            for i, tweet in zip(chunk, created):
+                tweet.created_at = tweet.updated_at = now - (count - i) * step
+            Tweet.objects.bulk_update(created, ["created_at", "updated_at"])
+            tweets += [(tweet.pk, tweet.user_id, tweet.created_at) for tweet in created]
+        self.stdout.write(f"{len(tweets)} 件のツイートを作りました。")
+        return tweets
+
+    def create_likes(self, user_ids, tweets, popularity, count):
+        """いいねするユーザーは一様に、ツイートは投稿者の人気に比例して選ぶ。"""
+        cum_weights = list(accumulate(popularity[user_id] for _, user_id, _ in tweets))
+        for chunk in chunked(range(count), self.chunk_size):
+            likers = self.rng.choices(user_ids, k=len(chunk))
+            liked = self.rng.choices(tweets, cum_weights=cum_weights, k=len(chunk))
+            Like.objects.bulk_create(
+                [Like(user_id=user_id, tweet_id=tweet[0]) for user_id, tweet in zip(likers, liked)],
+                ignore_conflicts=True,
+            )
+
+    def fill_timelines(self, followers, tweets):
+        """fan_out_tweet と同じく、本人と (フォロワーが多すぎなければ) フォロワーの受信箱に入れる。"""
+        entries = []
+        total = 0
+        for tweet_id, user_id, created_at in tweets:
+            owners = [user_id]
+            if len(followers[user_id]) < settings.FEED_FANOUT_MAX_FOLLOWERS:
+                owners += followers[user_id]
+            entries += [TimelineEntry(owner_id=owner, tweet_id=tweet_id, created_at=created_at) for owner in owners]
+            if len(entries) >= self.chunk_size:
+                TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                total += len(entries)
+                entries = []
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        total += len(entries)
+        self.stdout.write(f"{total} 件のタイムラインの行を作りました。")
@@ -0,0 +1,275 @@
+"""
+リクエストごとの性能の記録。
+
+PerformanceMiddleware (mysite.middleware) がURL名ごとに処理時間・クエリの時間と回数・テンプレートの描画時間・
+キャッシュのヒット数を記録し、プロセス内のヒストグラムに足し込む。ヒストグラムは起動からの累計 (Prometheus 用) と、
+WINDOW_SECONDS ごとの直近 WINDOW_COUNT 区間 (dump_metrics で直近の分布を見る用) を持つ。
+
+各プロセスは PERF_SNAPSHOT_INTERVAL 秒ごとに自分の値を共有キャッシュへ書き出し、/metrics/ と dump_metrics は
+すべてのプロセスの値を合算して返す。
+"""
+
+import copy
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("リクエストの処理時間 (秒)", DURATION_BUCKETS),
+    "db_query_duration_seconds": ("リクエスト中のクエリの合計時間 (秒)", DURATION_BUCKETS),
+    "db_queries": ("リクエスト中のクエリ数", COUNT_BUCKETS),
+    "template_render_seconds": ("リクエスト中のテンプレートの描画時間 (秒)", DURATION_BUCKETS),
+}
+COUNTERS = {
+    "cache_hits_total": "キャッシュのヒット数",
+    "cache_misses_total": "キャッシュのミス数",
+}
+
+WINDOW_SECONDS = 60
+WINDOW_COUNT = 5
+
+SNAPSHOT_KEY = "perf:snapshots"
+
+# 処理中のリクエストの RequestStats。テンプレートの描画やキャッシュの読み込みから足し込む
+_current = ContextVar("perf_request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+    def server_timing(self):
+        return ", ".join(
+            [
+                f"total;dur={self.wall_time * 1000:.1f}",
+                f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+                f"tpl;dur={self.template_time * 1000:.1f}",
+                f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            ]
+        )
+
+
+def db_wrapper(execute, sql, params, many, context):
+    """
+    接続ごとに付けておく execute_wrapper。処理中のリクエストがあればクエリの時間と回数を足し込む。
+    非同期のビューのクエリは sync_to_async のスレッドの接続で実行されるので、リクエストの側で接続に付け外しせず、
+    ContextVar でリクエストを見つける。
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+
+
+def install(connection):
+    """接続に db_wrapper を付ける。connection_created は再接続のたびに呼ばれるので、付いていれば何もしない。"""
+    if db_wrapper not in connection.execute_wrappers:
+        # 実行中の execute_wrapper() は終わるときに最後の要素を外すので、先頭に入れる
+        connection.execute_wrappers.insert(0, db_wrapper)
+
+
+def record_template_render(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.template_time += seconds
+
+
+def record_cache_lookup(hit):
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def _new_histogram(buckets):
+    # counts の最後は +Inf
+    return {"counts": [0] * (len(buckets) + 1), "sum": 0.0}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # {(名前, URL名): {"counts", "sum", "windows": {区間の開始時刻: {"counts", "sum"}}}}
+            self._histograms = {}
+            self._counters = Counter()
+            self.published_at = 0.0
+
+    def observe(self, name, view, value, now):
+        buckets = HISTOGRAMS[name][1]
+        index = bisect_left(buckets, value)
+        start = int(now // WINDOW_SECONDS) * WINDOW_SECONDS
+        with self._lock:
+            histogram = self._histograms.setdefault((name, view), {**_new_histogram(buckets), "windows": {}})
+            window = histogram["windows"].setdefault(start, _new_histogram(buckets))
+            for target in (histogram, window):
+                target["counts"][index] += 1
+                target["sum"] += value
+            for old in [key for key in histogram["windows"] if key <= start - WINDOW_SECONDS * WINDOW_COUNT]:
+                del histogram["windows"][old]
+
+    def increment(self, name, view, amount):
+        if amount:
+            with self._lock:
+                self._counters[(name, view)] += amount
+
+    def record_request(self, view, stats):
+        now = time.time()
+        self.observe("http_request_duration_seconds", view, stats.wall_time, now)
+        self.observe("db_query_duration_seconds", view, stats.db_time, now)
+        self.observe("db_queries", view, stats.queries, now)
+        self.observe("template_render_seconds", view, stats.template_time, now)
+        self.increment("cache_hits_total", view, stats.cache_hits)
+        self.increment("cache_misses_total", view, stats.cache_misses)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "updated_at": time.time(),
+                "histograms": copy.deepcopy(self._histograms),
+                "counters": dict(self._counters),
+            }
+
+
+registry = Registry()
+
+
+def process_id():
+    # fork したワーカーごとに別の値になるよう、呼ぶたびに求める
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def snapshot_due():
+    return time.time() - registry.published_at >= settings.PERF_SNAPSHOT_INTERVAL
+
+
+def publish_snapshot(force=False):
+    """前回から PERF_SNAPSHOT_INTERVAL 秒以上たっていれば、このプロセスの値を共有キャッシュに書き出す。"""
+    now = time.time()
+    if not force and not snapshot_due():
+        return
+    registry.published_at = now
+    cache = caches[settings.PERF_SNAPSHOT_CACHE]
+    # 複数のプロセスが同時に書くと一方が消えることがあるが、次の書き出しで戻る
+    snapshots = cache.get(SNAPSHOT_KEY, {})
+    snapshots[process_id()] = registry.snapshot()
+    snapshots = {
+        process: snapshot
+        for process, snapshot in snapshots.items()
+        if now - snapshot["updated_at"] < settings.PERF_SNAPSHOT_MAX_AGE
+    }
+    cache.set(SNAPSHOT_KEY, snapshots, None)
+
+
+def merge_snapshots(snapshots):
+    histograms = {}
+    counters = Counter()
+    for snapshot in snapshots:
+        for key, histogram in snapshot["histograms"].items():
+            buckets = HISTOGRAMS[key[0]][1]
+            merged = histograms.setdefault(key, {**_new_histogram(buckets), "windows": defaultdict(dict)})
+            _add_histogram(merged, histogram)
+            for start, window in histogram["windows"].items():
+                _add_histogram(merged["windows"][start], window)
+        counters.update(snapshot["counters"])
+    return {"histograms": histograms, "counters": dict(counters)}
+
+
+def _add_histogram(target, source):
+    if not target:
+        target.update(counts=[0] * len(source["counts"]), sum=0.0)
+    target["counts"] = [a + b for a, b in zip(target["counts"], source["counts"])]
+    target["sum"] += source["sum"]
+
+
+def collect():
+    """すべてのプロセスの値を合算する。このプロセスの値は最新のものを書き出してから使う。"""
+    publish_snapshot(force=True)
+    snapshots = caches[settings.PERF_SNAPSHOT_CACHE].get(SNAPSHOT_KEY, {})
+    return merge_snapshots(snapshots.values())
+
+
+def recent(histogram, now=None):
+    """直近 WINDOW_COUNT 区間を合わせた分布。"""
+    now = time.time() if now is None else now
+    oldest = int(now // WINDOW_SECONDS) * WINDOW_SECONDS - WINDOW_SECONDS * (WINDOW_COUNT - 1)
+    merged = {}
+    for start, window in histogram["windows"].items():
+        if start >= oldest:
+            _add_histogram(merged, window)
+    return merged
+
+
+def estimate_percentile(buckets, histogram, p):
+    """バケットから p パーセンタイルの上限を見積もる。+Inf に入るときは最後の境界を返す。"""
+    total = sum(histogram.get("counts", []))
+    if not total:
+        return None
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [buckets[-1]], histogram["counts"]):
+        cumulative += count
+        if cumulative >= p / 100 * total:
+            return bound
+    return buckets[-1]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(view, **extra):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in {"view": view, **extra}.items()) + "}"
+
+
+def format_prometheus(data, prefix="mysite_"):
+    """Prometheus のテキスト形式にする。"""
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {prefix}{name} {help_text}", f"# TYPE {prefix}{name} histogram"]
+        for (metric, view), histogram in sorted(data["histograms"].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*buckets, "+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{_labels(view, le=bound)} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{_labels(view)} {histogram['sum']}")
+            lines.append(f"{prefix}{name}_count{_labels(view)} {cumulative}")
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {prefix}{name} {help_text}", f"# TYPE {prefix}{name} counter"]
+        for (metric, view), value in sorted(data["counters"].items()):
+            if metric == name:
+                lines.append(f"{prefix}{name}{_labels(view)} {value}")
+    return "\n".join(lines) + "\n"
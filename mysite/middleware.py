@@ -0,0 +1,149 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import reverse
+
+from mysite.metrics import RequestStats, publish_snapshot, registry, snapshot_due
+from mysite.profiling import MODES, aprofile_call, profile_call
+from mysite.routers import read_from_replicas
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+
+class AsyncCapableMiddleware:
+    """
+    同期・非同期のどちらのハンドラーにもそのままつなげるミドルウェア。
+    ASGI で get_response がコルーチン関数なら自分もコルーチン関数として振る舞い、__acall__ で処理する。
+    同期だけのミドルウェアが1つでもあると、Django がその前後を sync_to_async / async_to_sync でつなぐので、
+    非同期のビューもワーカーのスレッドを経由することになる。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class PrimaryPinningMiddleware(AsyncCapableMiddleware):
+    """
+    安全なメソッドで固定のクッキーがないリクエストだけ、読み込みをレプリカで行う (mysite.routers)。
+    更新リクエストにはクッキーを付け、しばらくの間そのクライアントの読み込みもプライマリに固定する。
+    レプリカの遅延で、直前のツイートやいいねが見えなくなるのを防ぐ。
+    """
+
+    cookie_name = "pin_primary"
+
+    def handle(self, request):
+        with read_from_replicas(not self.is_pinned(request)):
+            response = self.get_response(request)
+        return self.set_pin_cookie(request, response)
+
+    async def __acall__(self, request):
+        # ContextVar は sync_to_async で動くORMの処理にも引き継がれる
+        with read_from_replicas(not self.is_pinned(request)):
+            response = await self.get_response(request)
+        return self.set_pin_cookie(request, response)
+
+    def is_pinned(self, request):
+        return request.method not in SAFE_METHODS or self.cookie_name in request.COOKIES
+
+    def set_pin_cookie(self, request, response):
+        if request.method not in SAFE_METHODS and settings.DATABASE_READ_REPLICAS:
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class PerformanceMiddleware(AsyncCapableMiddleware):
+    """
+    URL名ごとに処理時間・クエリの時間と回数・テンプレートの描画時間・キャッシュのヒット数を記録する (mysite.metrics)。
+    PERF_SERVER_TIMING が有効なら、内訳を Server-Timing ヘッダーで返す。全体の時間を測るため MIDDLEWARE の先頭に置く。
+    クエリは接続ごとに付けた mysite.metrics.db_wrapper が数える。
+    """
+
+    def handle(self, request):
+        if not settings.PERF_METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        with RequestStats() as stats:
+            response = self.get_response(request)
+        stats.wall_time = time.perf_counter() - started
+        self.record(request, stats)
+        publish_snapshot()
+        return self.add_server_timing(response, stats)
+
+    async def __acall__(self, request):
+        if not settings.PERF_METRICS_ENABLED:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with RequestStats() as stats:
+            response = await self.get_response(request)
+        stats.wall_time = time.perf_counter() - started
+        self.record(request, stats)
+        # 共有キャッシュへの書き出しはファイルを読み書きするので、書き出すときだけスレッドで行う
+        if snapshot_due():
+            await sync_to_async(publish_snapshot)()
+        return self.add_server_timing(response, stats)
+
+    def record(self, request, stats):
+        view = request.resolver_match.view_name if request.resolver_match else "<unresolved>"
+        registry.record_request(view, stats)
+
+    def add_server_timing(self, response, stats):
+        if settings.PERF_SERVER_TIMING:
+            response["Server-Timing"] = stats.server_timing()
+        return response
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    スタッフユーザーのリクエストに ?_profile=cprofile|sample かヘッダー X-Profile があれば、
+    以降の処理をプロファイルして保存し、ダウンロード先を X-Profile-Url ヘッダーで返す (mysite.profiling)。
+    ユーザーを見るので AuthenticationMiddleware の後に置く。付いていないリクエストはクエリ文字列とヘッダーを見るだけ。
+    """
+
+    param = "_profile"
+    header = "X-Profile"
+
+    def handle(self, request):
+        mode = self.get_mode(request)
+        if mode not in MODES or not request.user.is_staff:
+            return self.get_response(request)
+        response, filename = profile_call(mode, lambda: self.get_response(request), request.path)
+        return self.add_profile_url(response, filename)
+
+    async def __acall__(self, request):
+        mode = self.get_mode(request)
+        # request.user はDBを読む遅延オブジェクトなので、指定があるときだけスレッドで評価する
+        if mode not in MODES or not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+        response, filename = await aprofile_call(mode, lambda: self.get_response(request), request.path)
+        return self.add_profile_url(response, filename)
+
+    def get_mode(self, request):
+        return request.GET.get(self.param) or request.headers.get(self.header)
+
+    def add_profile_url(self, response, filename):
+        response["X-Profile-Url"] = reverse("profile_download", args=[filename])
+        return response
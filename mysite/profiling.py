@@ -0,0 +1,138 @@
+"""
+1回のリクエストのプロファイル。
+
+ProfilingMiddleware (mysite.middleware) が、スタッフユーザーのリクエストに ?_profile=cprofile か ?_profile=sample
+(またはヘッダー X-Profile) が付いているときだけ、以降の処理をプロファイラーの中で動かす。
+
+- cprofile: cProfile の結果を .prof (pstats, snakeviz など) で保存する。
+- sample: 別スレッドから PROFILE_SAMPLE_INTERVAL 秒ごとにリクエストのスレッドのスタックを取り、
+  flamegraph.pl や speedscope で読める collapsed 形式 (関数;関数;... 回数) で保存する。cProfile より軽い。
+
+非同期のリクエスト (aprofile_call) では、コルーチンはイベントループのスレッドで、ORMやテンプレートの描画は
+sync_to_async のスレッドで動く。ASGIHandler はリクエストごとに ThreadSensitiveContext を作るので、後者はリクエストで
+1つのスレッドになる。この2つのスレッドをプロファイルする。イベントループのスレッドの結果には、同時に動いている
+他のリクエストのコルーチンも混ざる。
+
+ファイルは PROFILE_DIR に置き、新しい PROFILE_MAX_FILES 個だけ残す。
+"""
+
+import cProfile
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+MODES = {"cprofile": ".prof", "sample": ".collapsed"}
+
+# 保存したファイルの名前。ダウンロードのときにパスを組み立てる前に確かめる
+FILENAME = re.compile(r"^[\w.-]+\.(prof|collapsed)$")
+UNSAFE = re.compile(r"[^\w.-]")
+
+
+class Sampler:
+    """thread_ids (threading.get_ident() の値) のスレッドのスタックを一定間隔で数える。"""
+
+    def __init__(self, thread_ids, interval):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def collapse(frame):
+    """根から順に "ファイル名:関数名" を ; でつなぐ。"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        # collapsed 形式は空白で回数と区切るので、"<frozen runpy>" などの空白を置き換える
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}".replace(" ", "_"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def make_filename(mode, name):
+    label = UNSAFE.sub("_", name.strip("/")) or "root"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}{MODES[mode]}"
+
+
+def save(write, filename):
+    """write(パス) で PROFILE_DIR に書き出し、古いファイルを消す。"""
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    write(directory / filename)
+    prune(directory)
+
+
+def profile_call(mode, func, name):
+    """func() をプロファイラーの中で呼び、(戻り値, 保存したファイルの名前) を返す。"""
+    filename = make_filename(mode, name)
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func)
+        save(profiler.dump_stats, filename)
+    else:
+        with Sampler([threading.get_ident()], settings.PROFILE_SAMPLE_INTERVAL) as sampler:
+            result = func()
+        save(sampler.dump, filename)
+    return result, filename
+
+
+async def aprofile_call(mode, func, name):
+    """profile_call の非同期版。await func() をイベントループと sync_to_async のスレッドでプロファイルする。"""
+    filename = make_filename(mode, name)
+    worker_id = await sync_to_async(threading.get_ident)()
+    if mode == "cprofile":
+        # cProfile は有効にしたスレッドしか見ないので、スレッドごとに1つ使って最後にまとめる
+        profiler, worker_profiler = cProfile.Profile(), cProfile.Profile()
+        await sync_to_async(worker_profiler.enable)()
+        profiler.enable()
+        try:
+            result = await func()
+        finally:
+            profiler.disable()
+            await sync_to_async(worker_profiler.disable)()
+        stats = pstats.Stats(profiler)
+        stats.add(worker_profiler)
+        await sync_to_async(save)(stats.dump_stats, filename)
+    else:
+        with Sampler([threading.get_ident(), worker_id], settings.PROFILE_SAMPLE_INTERVAL) as sampler:
+            result = await func()
+        await sync_to_async(save)(sampler.dump, filename)
+    return result, filename
+
+
+def prune(directory):
+    files = sorted(
+        (path for path in directory.iterdir() if FILENAME.match(path.name)), key=lambda path: path.stat().st_mtime
+    )
+    for path in files[: max(0, len(files) - settings.PROFILE_MAX_FILES)]:
+        path.unlink(missing_ok=True)
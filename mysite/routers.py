@@ -0,0 +1,46 @@
+"""
+読み込みをレプリカへ、書き込みをプライマリ (default) へ振り分けるDBルーター。
+
+既定ではすべてプライマリで読み、レプリカを使うのは read_from_replicas() の中だけにする。
+管理コマンドやマイグレーションのように、読んだ結果をもとにプライマリへ書き込む処理が遅れたデータを読まないため。
+PrimaryPinningMiddleware は、GET などの安全なリクエストで、直前の更新から REPLICA_PIN_SECONDS 秒が
+過ぎているクライアントのものだけをレプリカで読むので、自分の書き込みは必ず読み返せる。
+トランザクションの中の読み込みは、同じトランザクションの書き込みと食い違わないよう常にプライマリで行う。
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+def reads_from_replicas():
+    return _replica_reads.get()
+
+
+@contextmanager
+def read_from_replicas(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_READ_REPLICAS
+        if not replicas or not reads_from_replicas() or connections["default"].in_atomic_block:
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリと同じデータなので、どのエイリアスから読んだオブジェクト同士でも関連付けてよい
+        return True
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,14 +41,18 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "mysite.apps.MysiteConfig",
 ]
 
 MIDDLEWARE = [
+    "mysite.middleware.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "mysite.middleware.PrimaryPinningMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mysite.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -56,7 +61,8 @@ ROOT_URLCONF = "mysite.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # 描画時間を mysite.metrics に記録する DjangoTemplates
+        "BACKEND": "mysite.template_backends.TimedDjangoTemplates",
         "DIRS": [
             BASE_DIR / "templates",
         ],
@@ -78,13 +84,88 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# 環境変数で切り替える。DB_ENGINE=postgresql のときは DB_NAME / DB_USER / DB_PASSWORD / DB_HOST / DB_PORT を使う。
+# CONN_MAX_AGE の間は接続を使い回し、CONN_HEALTH_CHECKS で使い回す前に接続が生きているか確かめる。
+
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite3")
+
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "mysite"),
+            "USER": os.environ.get("DB_USER", ""),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", ""),
+            "PORT": os.environ.get("DB_PORT", ""),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # ロック待ちの秒数 (sqlite3.connect の timeout)
+                "timeout": int(os.environ.get("DB_BUSY_TIMEOUT", 20)),
+            },
+        }
     }
+
+# 読み込み用レプリカ。DB_REPLICAS にカンマ区切りで、SQLiteならファイル名、PostgreSQLならホスト名を並べる。
+# テストではプライマリのミラーとして扱う。振り分けは mysite/routers.py を参照。
+
+DATABASE_READ_REPLICAS = []
+
+for i, replica in enumerate(filter(None, os.environ.get("DB_REPLICAS", "").split(",")), start=1):
+    alias = f"replica{i}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        ("HOST" if DB_ENGINE == "postgresql" else "NAME"): replica,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_READ_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["mysite.routers.PrimaryReplicaRouter"]
+
+# 更新リクエストの後、同じクライアントの読み込みをプライマリに固定する秒数
+REPLICA_PIN_SECONDS = 5
+
+# SQLiteの接続ごとに実行するPRAGMA (mysite/db.py)
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": int(os.environ.get("DB_BUSY_TIMEOUT", 20)) * 1000,
+    "temp_store": "MEMORY",
+}
+
+
+# Cache
+# プロセス内のLRUを共有キャッシュ (ファイル) の前に置く2段構成。mysite/cache.py を参照。
+
+CACHES = {
+    "default": {
+        "BACKEND": "mysite.cache.TieredCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "LOCAL_MAX_ENTRIES": 10000,
+            "LOCAL_TIMEOUT": 5,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache",
+    },
 }
 
+# テストでは共有キャッシュを LocMemCache に差し替える (mysite/testing.py)
+TEST_RUNNER = "mysite.testing.TestRunner"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -134,3 +215,98 @@ AUTH_USER_MODEL = "accounts.User"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "welcome:top"
+
+# タイムラインの1ページあたりの件数
+TIMELINE_PAGE_SIZE = 50
+
+# フォロー中タイムライン (tweets.feed)
+# フォロワーがこの人数以上のアカウントは受信箱に書き込まず、読み込み時に取りに行く
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_BATCH_SIZE = 1000
+# フォロー直後に受信箱へ入れる相手の最近のツイート数
+FEED_BACKFILL_SIZE = 50
+
+# タイムラインの行のHTMLキャッシュ (tweets.fragments) の有効期限 (秒)
+TWEET_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# プロフィールの見出し (フォロー数・フォロワー数) のキャッシュの有効期限 (秒)。accounts.headers
+PROFILE_HEADER_CACHE_TIMEOUT = 60
+
+# おすすめユーザー (accounts.suggestions)
+# 1人あたりに保存する件数と、プロフィールに出す件数
+SUGGESTION_COUNT = 20
+SUGGESTION_DISPLAY_COUNT = 5
+# 1人あたりの計算量の上限。フォローを新しいものからこの数だけたどる (自分のフォロー・その先のフォローそれぞれ)
+SUGGESTION_MAX_FOLLOWING = 100
+# 作成からこの日数以内のツイートに付いたいいねを「最近のいいね」として数え、log(1 + いいね数) にこの重みを掛けて足す
+SUGGESTION_ENGAGEMENT_DAYS = 7
+SUGGESTION_ENGAGEMENT_WEIGHT = 0.5
+# 自分のフォローが変わらなくても、この秒数たったら作り直す (フォロー先のフォローやいいねの変化を拾う)
+SUGGESTION_MAX_AGE = 24 * 60 * 60
+
+# いいねの一括更新 (tweets:like_batch) で1回に受け付ける操作数の上限
+LIKE_BATCH_MAX_OPERATIONS = 100
+
+# True にすると、いいねの操作を PendingLike に溜めて flush_likes コマンドでまとめて反映する (tweets.likes)
+LIKES_WRITE_BEHIND = False
+
+# トレンド (tweets.trending)
+# いいねの重みが半分になるまでの秒数
+TRENDING_HALF_LIFE = 6 * 60 * 60
+# 減衰させたいいねの数がこれを下回ったツイートは TrendingScore から消す
+TRENDING_MIN_SCORE = 0.1
+# 読んだ位置より小さいIDのいいねを、後からコミットされたものとして読み直す秒数 (IDの採番からコミットまでの時間の上限)
+TRENDING_GAP_SECONDS = 5 * 60
+
+# ライブタイムライン (tweets.stream)
+# 接続ごとに溜めておくイベント数の上限。超えたら古いものから捨てる
+STREAM_QUEUE_SIZE = 100
+# イベントがないときにコメント行を送る間隔 (秒)
+STREAM_HEARTBEAT_SECONDS = 15
+
+# リクエストごとの性能の記録 (mysite.metrics, mysite.middleware.PerformanceMiddleware)
+PERF_METRICS_ENABLED = True
+# 処理時間の内訳を Server-Timing ヘッダーで返す。内部の情報なので DEBUG のときだけにする
+PERF_SERVER_TIMING = DEBUG
+# 他のプロセスからも読めるよう、ヒストグラムを書き出すキャッシュとその間隔 (秒)。止まったプロセスの分は MAX_AGE 秒で捨てる
+PERF_SNAPSHOT_CACHE = "shared"
+PERF_SNAPSHOT_INTERVAL = 10
+PERF_SNAPSHOT_MAX_AGE = 300
+# 設定すると /metrics/ を Authorization: Bearer <トークン> で読める (スタッフユーザーは常に読める)
+PERF_METRICS_TOKEN = os.environ.get("PERF_METRICS_TOKEN")
+
+# 遅いクエリの記録 (mysite.slow_queries)。SLOW_QUERY_LOG=1 のときだけクエリを数える
+SLOW_QUERY_LOG_ENABLED = os.environ.get("SLOW_QUERY_LOG") == "1"
+# これ以上かかったクエリを実行計画と一緒に SLOW_QUERY_LOG_FILE に書く (ミリ秒)
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100))
+SLOW_QUERY_LOG_FILE = BASE_DIR / "slow_queries.log"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "slow_queries": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": SLOW_QUERY_LOG_FILE,
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "encoding": "utf-8",
+            # 最初に書くまでファイルを作らない
+            "delay": True,
+            "formatter": "message",
+        },
+    },
+    "loggers": {
+        "mysite.slow_queries": {"handlers": ["slow_queries"], "level": "WARNING", "propagate": False},
+    },
+}
+
+# スタッフ用のリクエストごとのプロファイル (mysite.profiling, mysite.middleware.ProfilingMiddleware)
+PROFILE_DIR = BASE_DIR / "profiles"
+# 新しいものからこの数だけ残す
+PROFILE_MAX_FILES = 50
+# sample のときにスタックを取る間隔 (秒)
+PROFILE_SAMPLE_INTERVAL = 0.005
@@ -0,0 +1,174 @@
+"""
+クエリの記録と遅いクエリのログ。
+
+SLOW_QUERY_LOG_ENABLED のとき、接続ごとに query_log を execute_wrapper として付ける (mysite.db)。
+クエリは fingerprint (mysite.sql) ごとに回数・合計時間・時間のヒストグラムを数え、
+SLOW_QUERY_THRESHOLD_MS 以上かかった SELECT は実行計画と一緒にロガー mysite.slow_queries に1行のJSONで書く。
+書き出し先はローテートするファイル (settings.LOGGING)。
+
+集計はプロセスごとなので、metrics と同じく共有キャッシュに書き出し、dump_query_stats で合算して見る。
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+
+from mysite.metrics import estimate_percentile, process_id
+from mysite.sql import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# クエリはリクエストより短いので、metrics.DURATION_BUCKETS より細かくする
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+SNAPSHOT_KEY = "perf:query_snapshots"
+
+EXPLAINABLE = ("SELECT", "WITH")
+
+# 実行計画を取るクエリや共有キャッシュへの書き出しを、もう一度数えないための目印
+_inside = ContextVar("slow_query_log_inside", default=False)
+
+
+class QueryLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # {fingerprint: {"count", "total", "max", "counts"}}。counts の最後は +Inf
+            self._stats = {}
+            self.published_at = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper に渡す。"""
+        if _inside.get():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+
+        token = _inside.set(True)
+        try:
+            key = fingerprint(sql)
+            self.record(key, duration)
+            if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+                self.log_slow_query(context["connection"], key, sql, params, many, duration)
+            self.publish()
+        finally:
+            _inside.reset(token)
+        return result
+
+    def record(self, key, duration):
+        index = bisect_left(QUERY_BUCKETS, duration)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "counts": [0] * (len(QUERY_BUCKETS) + 1),
+                }
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+            stats["counts"][index] += 1
+
+    def log_slow_query(self, connection, key, sql, params, many, duration):
+        plan = None
+        # 更新系のクエリは EXPLAIN でも実行されることがある (PostgreSQL の EXPLAIN ANALYZE など) ので、読み込みだけにする
+        if not many and sql.lstrip().upper().startswith(EXPLAINABLE):
+            plan = explain(connection, sql, params)
+        logger.warning(
+            json.dumps(
+                {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "database": connection.alias,
+                    "duration_ms": round(duration * 1000, 2),
+                    "fingerprint": key,
+                    "sql": sql,
+                    "params": None if many else [str(param) for param in params or ()],
+                    "plan": plan,
+                },
+                ensure_ascii=False,
+            )
+        )
+
+    def snapshot(self):
+        with self._lock:
+            return {"updated_at": time.time(), "queries": {key: dict(stats) for key, stats in self._stats.items()}}
+
+    def publish(self, force=False):
+        """前回から PERF_SNAPSHOT_INTERVAL 秒以上たっていれば、このプロセスの集計を共有キャッシュに書き出す。"""
+        now = time.time()
+        if not force and now - self.published_at < settings.PERF_SNAPSHOT_INTERVAL:
+            return
+        self.published_at = now
+        cache = caches[settings.PERF_SNAPSHOT_CACHE]
+        snapshots = cache.get(SNAPSHOT_KEY, {})
+        snapshots[process_id()] = self.snapshot()
+        snapshots = {
+            process: snapshot
+            for process, snapshot in snapshots.items()
+            if now - snapshot["updated_at"] < settings.PERF_SNAPSHOT_MAX_AGE
+        }
+        cache.set(SNAPSHOT_KEY, snapshots, None)
+
+
+query_log = QueryLog()
+
+
+def install(connection):
+    """接続に query_log を付ける。connection_created は再接続のたびに呼ばれるので、付いていれば何もしない。"""
+    if query_log not in connection.execute_wrappers:
+        # 実行中の execute_wrapper() は終わるときに最後の要素を外すので、先頭に入れる
+        connection.execute_wrappers.insert(0, query_log)
+
+
+def explain(connection, sql, params):
+    """
+    実行計画の各行。EXPLAIN の書き方はバックエンドに任せる (SQLite は EXPLAIN QUERY PLAN)。
+    取れなくても元のクエリは成功しているので、エラーは文字列にして返す。
+    """
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def collect():
+    """すべてのプロセスの集計を fingerprint ごとに合算する。"""
+    query_log.publish(force=True)
+    merged = {}
+    for snapshot in caches[settings.PERF_SNAPSHOT_CACHE].get(SNAPSHOT_KEY, {}).values():
+        for key, stats in snapshot["queries"].items():
+            target = merged.setdefault(
+                key, {"count": 0, "total": 0.0, "max": 0.0, "counts": [0] * len(stats["counts"])}
+            )
+            target["count"] += stats["count"]
+            target["total"] += stats["total"]
+            target["max"] = max(target["max"], stats["max"])
+            target["counts"] = [a + b for a, b in zip(target["counts"], stats["counts"])]
+    return merged
+
+
+def summarize(stats):
+    """ミリ秒単位の回数・合計・平均・p99 (バケットの上限)・最大。"""
+    return {
+        "count": stats["count"],
+        "total_ms": round(stats["total"] * 1000, 2),
+        "avg_ms": round(stats["total"] / stats["count"] * 1000, 3),
+        "p99_ms": round(estimate_percentile(QUERY_BUCKETS, stats, 99) * 1000, 2),
+        "max_ms": round(stats["max"] * 1000, 2),
+    }
@@ -0,0 +1,21 @@
+"""
+SQLの集計用の補助。
+"""
+
+import re
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# Django が execute に渡す SQL のプレースホルダー (%% はエスケープした % なので除く)
+_PLACEHOLDER = re.compile(r"(?<!%)%s")
+_IN_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """リテラルとプレースホルダーを ? に置き換え、IN の要素数の違いもまとめた、同じ形のクエリを数えるための文字列。"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    return _SPACES.sub(" ", sql).strip()
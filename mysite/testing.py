@@ -0,0 +1,81 @@
+"""
+テスト用の補助。
+"""
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from mysite.sql import fingerprint
+
+
+class QueryBudgetMixin:
+    """
+    TestCase に混ぜ、ビューごとのクエリ数の上限を query_budgets = {URL名: 上限} で宣言する。
+    GET以外は "create:post" のようにメソッド名を付けたキーにする。
+
+    assertQueryBudget はリクエスト1回のクエリ数が上限以下であること、
+    assertNoNPlusOne は表示する行を増やしてもクエリ数が変わらないこと (N+1 になっていないこと) を確かめる。
+    """
+
+    query_budgets = {}
+    # assertEveryViewHasBudget で対象にする urls モジュール
+    urls_module = None
+
+    def capture_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return context.captured_queries
+
+    def format_queries(self, queries):
+        return "\n".join(f"  {query['sql']}" for query in queries)
+
+    def _check_budget(self, name, queries):
+        budget = self.query_budgets[name]
+        if len(queries) > budget:
+            self.fail(f"{name}: {len(queries)} queries (budget {budget})\n{self.format_queries(queries)}")
+
+    def assertQueryBudget(self, name, func):
+        queries = self.capture_queries(func)
+        self._check_budget(name, queries)
+        return queries
+
+    def assertNoNPlusOne(self, name, func, grow):
+        """grow() でデータを増やす前後で func() のクエリ数が同じで、上限も超えないこと。"""
+        before = self.capture_queries(func)
+        grow()
+        after = self.capture_queries(func)
+        if len(after) != len(before):
+            # 増えた形のクエリを示す
+            grown = Counter(fingerprint(q["sql"]) for q in after) - Counter(fingerprint(q["sql"]) for q in before)
+            details = "\n".join(f"  +{count} {sql}" for sql, count in grown.items())
+            self.fail(f"{name}: {len(before)} -> {len(after)} queries as the data grew\n{details}")
+        self._check_budget(name, after)
+
+    def assertEveryViewHasBudget(self):
+        names = {pattern.name for pattern in self.urls_module.urlpatterns}
+        budgeted = {key.split(":")[0] for key in self.query_budgets}
+        self.assertEqual(names - budgeted, set(), "query_budgets がないビューがあります")
+
+
+class TestRunner(DiscoverRunner):
+    """
+    settings.TEST_RUNNER。共有キャッシュ (shared) をプロセス内の LocMemCache に差し替えて実行し、
+    開発環境の .cache を読み書きしない。前回の実行で残ったエントリで結果が変わることもなくなる。
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        caches = {
+            **settings.CACHES,
+            "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-shared"},
+        }
+        self._cache_settings = override_settings(CACHES=caches)
+        self._cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,549 @@
+import json
+import logging
+import pstats
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from accounts.models import Follow
+from mysite.benchmark import percentile
+from mysite.metrics import registry
+from mysite.middleware import PrimaryPinningMiddleware
+from mysite.slow_queries import install, query_log
+from mysite.sql import fingerprint
+from mysite.testing import QueryBudgetMixin
+from tweets.models import TimelineEntry, Tweet
+from tweets.stream import route_stream
+from tweets.views import HomeView
+
+
+class TestTestRunner(SimpleTestCase):
+    def test_shared_cache_is_in_memory(self):
+        # テストは開発環境の .cache を読み書きしない
+        self.assertIsInstance(caches["shared"], LocMemCache)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "mysite.cache.TieredCache",
+            "LOCATION": "test-shared",
+            "OPTIONS": {"LOCAL_MAX_ENTRIES": 2, "LOCAL_TIMEOUT": 5},
+        },
+        "test-shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-shared"},
+    }
+)
+class TestTieredCache(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches["default"]
+        self.shared = caches["test-shared"]
+        self.cache.clear()
+        self.cache.reset_stats()
+
+    def test_read_through_and_stats(self):
+        self.shared.set("tweet:fragment:1", "html")
+        self.assertEqual(self.cache.get("tweet:fragment:1"), "html")
+        self.shared.delete("tweet:fragment:1")
+        # 2回目はプロセス内から返る
+        self.assertEqual(self.cache.get("tweet:fragment:1"), "html")
+        self.assertIsNone(self.cache.get("tweet:fragment:2"))
+        self.assertEqual(
+            self.cache.get_stats(),
+            {"tweet:fragment": {"shared_hits": 1, "local_hits": 1, "misses": 1}},
+        )
+
+    def test_get_many_and_set_many(self):
+        self.cache.set_many({"a:1": 1, "a:2": 2})
+        self.assertEqual(self.shared.get_many(["a:1", "a:2"]), {"a:1": 1, "a:2": 2})
+        self.assertEqual(self.cache.get_many(["a:1", "a:2", "a:3"]), {"a:1": 1, "a:2": 2})
+        self.assertEqual(self.cache.get_stats()["a"], {"local_hits": 2, "misses": 1})
+
+    def test_lru_eviction(self):
+        for i in range(3):
+            self.cache.set(f"k:{i}", i)
+        self.shared.clear()
+        self.assertIsNone(self.cache.get("k:0"))
+        self.assertEqual(self.cache.get("k:1"), 1)
+        self.assertEqual(self.cache.get("k:2"), 2)
+
+    def test_local_ttl(self):
+        with mock.patch("mysite.cache.time.monotonic", return_value=100.0):
+            self.cache.set("k:1", "old")
+        self.shared.set("k:1", "new")
+        with mock.patch("mysite.cache.time.monotonic", return_value=104.0):
+            self.assertEqual(self.cache.get("k:1"), "old")
+        with mock.patch("mysite.cache.time.monotonic", return_value=106.0):
+            self.assertEqual(self.cache.get("k:1"), "new")
+
+    def test_delete_removes_both_tiers(self):
+        self.cache.set("k:1", "value")
+        self.cache.delete("k:1")
+        self.assertIsNone(self.shared.get("k:1"))
+        self.assertIsNone(self.cache.get("k:1"))
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite専用")
+class TestSQLitePragmas(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        # 1 = NORMAL
+        self.assertEqual(self.pragma("synchronous"), 1)
+        self.assertEqual(self.pragma("busy_timeout"), settings.SQLITE_PRAGMAS["busy_timeout"])
+        # テスト用のインメモリDBではWALにならないので、ファイルDBのときだけ確認する
+        if not connection.is_in_memory_db():
+            self.assertEqual(self.pragma("journal_mode"), "wal")
+
+
+@override_settings(DATABASE_READ_REPLICAS=["replica1"])
+class TestPrimaryReplicaRouting(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        def view(request):
+            response = HttpResponse()
+            response.read_db = router.db_for_read(Tweet)
+            response.write_db = router.db_for_write(Tweet)
+            return response
+
+        self.middleware = PrimaryPinningMiddleware(view)
+
+    def test_reads_go_to_replica(self):
+        response = self.middleware(self.factory.get("/tweets/home/"))
+        self.assertEqual(response.read_db, "replica1")
+        self.assertEqual(response.write_db, "default")
+        self.assertNotIn("pin_primary", response.cookies)
+
+    def test_write_request_pins_to_primary(self):
+        response = self.middleware(self.factory.post("/tweets/1/like/"))
+        self.assertEqual(response.read_db, "default")
+        self.assertEqual(response.cookies["pin_primary"]["max-age"], 5)
+
+        # 書き込み直後のGETはクッキーがある間プライマリから読む
+        request = self.factory.get("/tweets/home/")
+        request.COOKIES["pin_primary"] = "1"
+        self.assertEqual(self.middleware(request).read_db, "default")
+
+    def test_reads_outside_requests_go_to_primary(self):
+        # 管理コマンドやマイグレーションは、読んだ結果でプライマリに書き込むのでレプリカを使わない
+        self.assertEqual(router.db_for_read(Tweet), "default")
+
+    def test_reads_in_transaction_go_to_primary(self):
+        def view(request):
+            with mock.patch.object(connections["default"], "in_atomic_block", True):
+                return HttpResponse(router.db_for_read(Tweet))
+
+        response = PrimaryPinningMiddleware(view)(self.factory.get("/tweets/home/"))
+        self.assertEqual(response.content, b"default")
+
+    @override_settings(DATABASE_READ_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.middleware(self.factory.get("/tweets/home/")).read_db, "default")
+
+    def test_async(self):
+        async def view(request):
+            response = HttpResponse()
+            # ORM の処理と同じく、スレッドで動かしても固定が引き継がれること
+            response.read_db = await sync_to_async(router.db_for_read)(Tweet)
+            return response
+
+        middleware = PrimaryPinningMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.get("/tweets/home/"))
+        self.assertEqual(response.read_db, "replica1")
+        response = async_to_sync(middleware)(self.factory.post("/tweets/1/like/"))
+        self.assertEqual(response.read_db, "default")
+        self.assertIn("pin_primary", response.cookies)
+
+
+@skipUnless(settings.DATABASE_READ_REPLICAS, "DB_REPLICAS を設定したときだけ実行する")
+class TestReplicaReads(TransactionTestCase):
+    """
+    DB_REPLICAS=/tmp/replica.sqlite3 python manage.py test mysite のように実行する。
+    レプリカは別の接続なので、プライマリの書き込みがコミットされるよう TransactionTestCase を使う。
+    """
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="test", password="testpass0000")
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+        self.client.force_login(self.user)
+        self.replica = connections[settings.DATABASE_READ_REPLICAS[0]]
+
+    def test_get_reads_replica_and_post_reads_primary(self):
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            self.client.get(reverse("tweets:home"))
+        self.assertTrue(any("tweets_tweet" in query["sql"] for query in replica_queries.captured_queries))
+
+        self.client.cookies.clear()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(replica_queries.captured_queries, [])
+
+
+class TestBenchmark(TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_seed_data_and_benchmark(self):
+        call_command("seed_data", users=20, tweets=100, likes=200, follows_per_user=5, stdout=StringIO())
+        self.assertEqual(get_user_model().objects.filter(username__startswith="seed").count(), 20)
+        self.assertEqual(Tweet.objects.count(), 100)
+        self.assertTrue(TimelineEntry.objects.exists())
+        # 件数の列は中間テーブルと一致している
+        call_command("rebuild_follow_counts", "--check", stdout=StringIO())
+        call_command("rebuild_like_counts", "--check", stdout=StringIO())
+
+        stdout = StringIO()
+        call_command("benchmark", requests=2, stdout=stdout, stderr=StringIO())
+        results = json.loads(stdout.getvalue())["runs"][0]["results"]
+        self.assertIn("tweets:home", results)
+        self.assertNotIn("accounts:logout", results)
+        self.assertNotIn("tweets:like", results)
+        self.assertEqual(results["accounts:user_profile"]["status"], 200)
+        self.assertGreater(results["tweets:home"]["queries"], 0)
+
+
+class TestQueryBudgetMixin(QueryBudgetMixin, TestCase):
+    query_budgets = {"tweets": 2}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="test", password="testpass0000")
+        self.add_tweet()
+
+    def add_tweet(self):
+        Tweet.objects.create(user=get_user_model().objects.create_user(username=f"u{Tweet.objects.count()}"))
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,3) LIMIT 21"),
+            "SELECT * FROM t WHERE a = ? AND b IN (?) LIMIT ?",
+        )
+
+    def test_fingerprint_orm_in_list(self):
+        # ORM の SQL は %s のプレースホルダーなので、IN の要素数が違っても同じ形になること
+        def sql(pks):
+            return str(Tweet.objects.filter(pk__in=pks).values("pk").query.sql_with_params()[0])
+
+        short, long = sql([1, 2]), sql([1, 2, 3, 4, 5])
+        self.assertIn("IN (%s, %s)", short)
+        self.assertEqual(fingerprint(short), fingerprint(long))
+        self.assertIn('"id" IN (?)', fingerprint(short))
+
+    def test_detects_n_plus_one(self):
+        def render():
+            for tweet in Tweet.objects.all():
+                tweet.user.username
+
+        with self.assertRaisesMessage(AssertionError, "tweets: 2 -> 3 queries as the data grew"):
+            self.assertNoNPlusOne("tweets", render, self.add_tweet)
+
+    def test_constant_queries_pass(self):
+        def render():
+            for tweet in Tweet.objects.select_related("user"):
+                tweet.user.username
+
+        self.assertNoNPlusOne("tweets", render, self.add_tweet)
+
+    def test_budget_exceeded(self):
+        with self.assertRaisesMessage(AssertionError, "tweets: 3 queries (budget 2)"):
+            self.assertQueryBudget("tweets", lambda: [Tweet.objects.count() for _ in range(3)])
+
+
+@override_settings(
+    PERF_SERVER_TIMING=True,
+    PERF_SNAPSHOT_CACHE="perf-test",
+    CACHES={
+        **settings.CACHES,
+        "perf-test": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "perf-test"},
+    },
+)
+class TestPerformanceMetrics(TestCase):
+    def setUp(self):
+        registry.reset()
+        caches["perf-test"].clear()
+        self.user = get_user_model().objects.create_user(username="test", password="testpass0000")
+        Tweet.objects.create(user=self.user, content="hello")
+        self.client.force_login(self.user)
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(reverse("tweets:home"))
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r"^total;dur=[\d.]+, db;dur=[\d.]+;desc=\"4 queries\", tpl;dur=[\d.]+, cache;desc=")
+        self.assertNotRegex(timing, r"tpl;dur=0\.0,")
+
+        snapshot = registry.snapshot()
+        self.assertEqual(sum(snapshot["histograms"][("db_queries", "tweets:home")]["counts"]), 1)
+        self.assertEqual(snapshot["histograms"][("db_queries", "tweets:home")]["sum"], 4)
+
+    def test_async_view(self):
+        async def get():
+            return await self.async_client.get(reverse("tweets:async_home"))
+
+        self.async_client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+        self.assertIn(f'desc="{len(queries)} queries"', response["Server-Timing"])
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["histograms"][("db_queries", "tweets:async_home")]["sum"], len(queries))
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("tweets:home"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        with self.settings(PERF_METRICS_TOKEN="secret"):
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn("# TYPE mysite_http_request_duration_seconds histogram", body)
+        self.assertIn('mysite_db_queries_bucket{view="tweets:home",le="5"} 1', body)
+        self.assertIn('mysite_db_queries_count{view="tweets:home"} 1', body)
+
+    def test_dump_metrics_merges_processes(self):
+        self.client.get(reverse("tweets:home"))
+        other = registry.snapshot()
+        caches["perf-test"].set("perf:snapshots", {"other:1": other}, None)
+
+        stdout = StringIO()
+        call_command("dump_metrics", stdout=stdout)
+        line = next(line for line in stdout.getvalue().splitlines() if line.startswith("tweets:home"))
+        self.assertEqual(line.split()[1], "2")
+
+        stdout = StringIO()
+        call_command("dump_metrics", "--prometheus", stdout=stdout)
+        self.assertIn('mysite_db_queries_count{view="tweets:home"} 2', stdout.getvalue())
+
+
+@override_settings(
+    SLOW_QUERY_THRESHOLD_MS=10000,
+    PERF_SNAPSHOT_CACHE="perf-test",
+    CACHES={
+        **settings.CACHES,
+        "perf-test": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "perf-test"},
+    },
+)
+class TestSlowQueryLog(TestCase):
+    def setUp(self):
+        query_log.reset()
+        caches["perf-test"].clear()
+        self.user = get_user_model().objects.create_user(username="test", password="testpass0000")
+
+    def test_stats_by_fingerprint(self):
+        with connection.execute_wrapper(query_log):
+            Tweet.objects.filter(pk=1).exists()
+            Tweet.objects.filter(pk=2).exists()
+        stats = query_log.snapshot()["queries"]
+        self.assertEqual(len(stats), 1)
+        (key,) = stats
+        self.assertIn('FROM "tweets_tweet" WHERE "tweets_tweet"."id" = ?', key)
+        self.assertEqual(stats[key]["count"], 2)
+        self.assertEqual(sum(stats[key]["counts"]), 2)
+
+    def test_slow_select_is_logged_with_plan(self):
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs("mysite.slow_queries") as logs:
+            with connection.execute_wrapper(query_log):
+                list(Tweet.objects.filter(user=self.user))
+                Tweet.objects.create(user=self.user, content="hello")
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        select = next(entry for entry in entries if entry["sql"].startswith("SELECT"))
+        self.assertEqual(select["params"], [str(self.user.pk)])
+        self.assertTrue(any("SEARCH tweets_tweet" in line for line in select["plan"]), select["plan"])
+        insert = next(entry for entry in entries if entry["sql"].startswith("INSERT"))
+        self.assertIsNone(insert["plan"])
+        # 実行計画のクエリは数えない
+        self.assertFalse(any(key.startswith("EXPLAIN") for key in query_log.snapshot()["queries"]))
+
+    def test_install_once(self):
+        wrappers = connection.execute_wrappers
+        try:
+            connection.execute_wrappers = []
+            with connection.execute_wrapper(lambda *args: args[0](*args[1:])):
+                install(connection)
+                install(connection)
+            self.assertEqual(connection.execute_wrappers, [query_log])
+        finally:
+            connection.execute_wrappers = wrappers
+
+    def test_dump_query_stats_merges_processes(self):
+        with connection.execute_wrapper(query_log):
+            Tweet.objects.count()
+        caches["perf-test"].set("perf:query_snapshots", {"other:1": query_log.snapshot()}, None)
+
+        stdout = StringIO()
+        call_command("dump_query_stats", stdout=stdout)
+        line = next(line for line in stdout.getvalue().splitlines() if 'FROM "tweets_tweet"' in line)
+        self.assertEqual(line.split()[0], "2")
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = self.settings(PROFILE_DIR=self.directory, PROFILE_SAMPLE_INTERVAL=0.0001)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        User = get_user_model()
+        self.staff = User.objects.create_user(username="staff", password="testpass0000", is_staff=True)
+        self.user = User.objects.create_user(username="test", password="testpass0000")
+        Tweet.objects.create(user=self.user, content="hello")
+
+    def test_cprofile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("tweets:home"), {"_profile": "cprofile"})
+        self.assertEqual(response.status_code, 200)
+        (path,) = self.directory.iterdir()
+        self.assertEqual(response["X-Profile-Url"], reverse("profile_download", args=[path.name]))
+        stats = pstats.Stats(str(path))
+        self.assertTrue(any(function[2] == "get" for function in stats.stats))
+
+        download = self.client.get(response["X-Profile-Url"])
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(b"".join(download.streaming_content), path.read_bytes())
+        download.close()
+
+    def test_sample(self):
+        get = HomeView.get
+
+        def slow_get(view, request, *args, **kwargs):
+            # 標本を取るスレッドに GIL を渡し、リクエストの処理中のスタックを確実に数えさせる
+            time.sleep(0.05)
+            return get(view, request, *args, **kwargs)
+
+        self.client.force_login(self.staff)
+        with mock.patch.object(HomeView, "get", slow_get):
+            response = self.client.get(reverse("tweets:home"), HTTP_X_PROFILE="sample")
+        self.assertTrue(response["X-Profile-Url"].endswith(".collapsed/"))
+        (path,) = self.directory.iterdir()
+        lines = path.read_text().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any("middleware.py:<lambda>" in line for line in lines))
+        for line in lines:
+            self.assertRegex(line, r"^[^ ;]+(;[^ ;]+)* \d+$")
+
+    def test_async(self):
+        async def get(mode):
+            return await self.async_client.get(reverse("tweets:async_home"), {"_profile": mode})
+
+        self.async_client.force_login(self.staff)
+        response = async_to_sync(get)("cprofile")
+        self.assertEqual(response.status_code, 200)
+        (path,) = self.directory.iterdir()
+        self.assertEqual(response["X-Profile-Url"], reverse("profile_download", args=[path.name]))
+        # イベントループのコルーチンと、sync_to_async のスレッドで実行したクエリの両方が入る
+        functions = pstats.Stats(str(path)).stats
+        self.assertTrue(any(function[2] == "get_page" for function in functions))
+        self.assertTrue(any(function[0].endswith("sqlite3/base.py") for function in functions))
+
+        response = async_to_sync(get)("sample")
+        self.assertTrue(response["X-Profile-Url"].endswith(".collapsed/"))
+
+        self.async_client.force_login(self.user)
+        self.assertNotIn("X-Profile-Url", async_to_sync(get)("cprofile"))
+        self.assertEqual(len(list(self.directory.iterdir())), 2)
+
+    def test_only_staff(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("tweets:home"), {"_profile": "cprofile"})
+        self.assertNotIn("X-Profile-Url", response)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+        (self.directory / "x.prof").write_bytes(b"")
+        self.assertEqual(self.client.get(reverse("profile_download", args=["x.prof"])).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse("profile_download", args=["x.txt"])).status_code, 404)
+
+    def test_keeps_newest_files(self):
+        self.client.force_login(self.staff)
+        with self.settings(PROFILE_MAX_FILES=2):
+            for _ in range(3):
+                self.client.get(reverse("tweets:home"), {"_profile": "cprofile"})
+        self.assertEqual(len(list(self.directory.iterdir())), 2)
+
+
+class TestAsgiApplication(TransactionTestCase):
+    """
+    mysite.asgi と同じ構成のASGIアプリで非同期ビューを動かし、ミドルウェアがスレッドへの切り替えを挟まないことを確かめる。
+    リクエストごとの sync_to_async のスレッドは別の接続を使うので、TransactionTestCase でコミットしておく。
+    """
+
+    async def get(self, application, path, query_string=b""):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "query_string": query_string,
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 0),
+        }
+        await application(scope, receive, send)
+        return messages[0]["status"]
+
+    @override_settings(DEBUG=True)
+    def test_async_views_are_not_adapted(self):
+        User = get_user_model()
+        user = User.objects.create_user(username="test", password="testpass0000")
+        other = User.objects.create_user(username="other", password="testpass0000")
+        Follow.objects.create(follower=user, followee=other)
+        tweet = Tweet.objects.create(user=other, content="hello")
+        self.client.force_login(user)
+        requests = [
+            (reverse("tweets:async_home"), b""),
+            (reverse("tweets:async_home"), b"feed=following"),
+            (reverse("tweets:async_detail", args=[tweet.pk]), b""),
+            (reverse("accounts:async_user_profile", args=["other"]), b""),
+            (reverse("accounts:async_following_list", args=["test"]), b""),
+            (reverse("accounts:async_follower_list", args=["other"]), b""),
+        ]
+
+        async def get_all(application):
+            return [await self.get(application, path, query_string) for path, query_string in requests]
+
+        # ミドルウェアの読み込み時の切り替えは DEBUG のときに django.request に記録される
+        with self.assertLogs("django.request", "DEBUG") as logs:
+            logging.getLogger("django.request").debug("start")
+            application = route_stream(ASGIHandler())
+            statuses = async_to_sync(get_all)(application)
+        self.assertEqual(statuses, [200] * len(requests))
+        self.assertEqual([line for line in logs.output if "adapted" in line], [])
+        for path, _ in requests:
+            self.assertTrue(iscoroutinefunction(resolve(path).func), path)
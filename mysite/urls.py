@@ -16,9 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from mysite.views import MetricsView, ProfileDownloadView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls")),
     path("tweets/", include("tweets.urls")),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    path("profiles/<str:name>/", ProfileDownloadView.as_view(), name="profile_download"),
     path("", include("welcome.urls")),
 ]
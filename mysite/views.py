@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.generic import View
+
+from mysite.metrics import collect, format_prometheus
+from mysite.profiling import FILENAME
+
+
+class MetricsView(View):
+    """全プロセスのリクエストの計測値を Prometheus のテキスト形式で返す。"""
+
+    def has_permission(self, request):
+        if request.user.is_staff:
+            return True
+        token = settings.PERF_METRICS_TOKEN
+        authorization = request.headers.get("Authorization", "")
+        return bool(token) and constant_time_compare(authorization, f"Bearer {token}")
+
+    def get(self, request, *args, **kwargs):
+        if not self.has_permission(request):
+            return HttpResponseForbidden()
+        return HttpResponse(format_prometheus(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ProfileDownloadView(View):
+    """ProfilingMiddleware が保存したプロファイルをスタッフユーザーだけにダウンロードさせる。"""
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        name = kwargs["name"]
+        path = Path(settings.PROFILE_DIR) / name
+        if not FILENAME.match(name) or not path.is_file():
+            raise Http404
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
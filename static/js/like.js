@@ -19,31 +19,118 @@ function renderBtn(likeBtn) {
     likeBtn.style.color = isLiked ? 'red' : 'gray';
 }
 
-async function updateLikeState(likeBtn) {
-    const count = parseInt(likeBtn.dataset.likeCount);
+// まとめて送る先 (tweets:like_batch) は、読み込んだ script タグの data-likes-url で受け取る
+const LIKES_URL = document.currentScript.dataset.likesUrl;
+// 短い間の連打は1回のリクエストにまとめて送る
+const FLUSH_DELAY_MS = 300;
+// サーバーが知っている状態 (最後に成功した応答)、送信中の操作、まだ送っていない操作
+const confirmed = new Map();
+const pending = new Map();
+let inFlight = null;
+let flushTimer = null;
+
+function buttonsFor(pk) {
+    return document.querySelectorAll(`.likebtn[data-pk="${pk}"]`);
+}
+
+function setState(pk, isLiked, likeCount) {
+    for (const likeBtn of buttonsFor(pk)) {
+        likeBtn.dataset.isLiked = isLiked ? 'T' : 'F';
+        likeBtn.dataset.likeCount = likeCount;
+        renderBtn(likeBtn);
+    }
+}
+
+function scheduleFlush() {
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushLikes, FLUSH_DELAY_MS);
+}
+
+function toggleLike(likeBtn) {
+    const pk = likeBtn.dataset.pk;
     const isLiked = likeBtn.dataset.isLiked === 'T';
-    const csrftoken = getCookie('csrftoken');
+    const count = parseInt(likeBtn.dataset.likeCount);
+    if (!confirmed.has(pk)) {
+        confirmed.set(pk, { liked: isLiked, likeCount: count });
+    }
+    // 先に表示を切り替え、サーバーの数は応答で上書きする
+    setState(pk, !isLiked, count + (isLiked ? -1 : 1));
+    // 送信中の操作があれば、それが通った後の状態と比べる
+    const expected = inFlight && inFlight.has(pk) ? inFlight.get(pk) : confirmed.get(pk).liked;
+    if (expected === !isLiked) {
+        // いいね→取り消しのように元に戻ったら送らなくてよい
+        pending.delete(pk);
+    } else {
+        pending.set(pk, !isLiked);
+    }
+    scheduleFlush();
+}
+
+// 送信は1つずつ行い、応答を待つ間の操作は pending に残して次の送信に回す。
+// force はページを離れるときで、送信中でも残りを送る
+async function flushLikes(force = false) {
+    if (pending.size === 0 || (inFlight && !force)) {
+        return;
+    }
+    const batch = new Map(pending);
+    pending.clear();
+    inFlight = batch;
+    const operations = Array.from(batch, ([pk, liked]) => ({ tweet_id: parseInt(pk), liked: liked }));
     const headers = new Headers({
         'Content-Type': 'application/json',
-        'X-CSRFToken': csrftoken
+        'X-CSRFToken': getCookie('csrftoken')
     });
-    const response = await fetch(`/tweets/${likeBtn.dataset.pk}/${isLiked ? 'unlike' : 'like'}/`, {
-        method: 'POST',
-        headers: headers,
-    });
-    if (response.ok) {
-        likeBtn.dataset.likeCount = count + (isLiked ? -1 : 1);
-        likeBtn.dataset.isLiked = isLiked ? 'F' : 'T';
-        renderBtn(likeBtn);
+    try {
+        const response = await fetch(LIKES_URL, {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ operations: operations }),
+            // ページを離れるときの送信も途中で切られないようにする
+            keepalive: true,
+        });
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        const data = await response.json();
+        for (const tweet of data.tweets) {
+            const pk = String(tweet.tweet_id);
+            confirmed.set(pk, { liked: tweet.liked, likeCount: tweet.like_count });
+            // 応答を待つ間にまた押されたものは、表示をそのままにして次の送信に任せる
+            if (!pending.has(pk)) {
+                setState(pk, tweet.liked, tweet.like_count);
+            }
+        }
+    } catch (error) {
+        // 失敗したら最後に確認できた状態に戻す。待つ間に押されたものは、確認できた状態と比べて送り直す
+        for (const pk of batch.keys()) {
+            const state = confirmed.get(pk);
+            if (pending.has(pk) && pending.get(pk) === state.liked) {
+                pending.delete(pk);
+            }
+            if (!pending.has(pk)) {
+                setState(pk, state.liked, state.likeCount);
+            }
+        }
+    } finally {
+        if (inFlight === batch) {
+            inFlight = null;
+        }
+        if (pending.size > 0) {
+            scheduleFlush();
+        }
     }
 }
 
 document.addEventListener('DOMContentLoaded', () => {
     for (const likeBtn of document.getElementsByClassName('likebtn')) {
         renderBtn(likeBtn);
-        likeBtn.addEventListener('click', async () => {
-            await updateLikeState(likeBtn);
+        likeBtn.addEventListener('click', () => {
+            toggleLike(likeBtn);
         });
     }
 });
 
+window.addEventListener('pagehide', () => {
+    clearTimeout(flushTimer);
+    flushLikes(true);
+});
@@ -0,0 +1,41 @@
+// 新しいツイートといいね数の増減を Server-Sent Events で受け取る (like.js の後に読み込む)
+document.addEventListener('DOMContentLoaded', () => {
+    const banner = document.getElementById('new-tweets');
+    if (!banner || !window.EventSource) {
+        return;
+    }
+    const source = new EventSource(banner.dataset.streamUrl);
+    let newTweets = 0;
+
+    source.addEventListener('tweet', () => {
+        // 行を差し込むとテンプレートと二重管理になるので、件数だけ知らせて読み込み直してもらう
+        newTweets += 1;
+        banner.querySelector('a').innerText = `新しいツイートが${newTweets}件あります`;
+        banner.hidden = false;
+    });
+
+    source.addEventListener('likes', (event) => {
+        const data = JSON.parse(event.data);
+        for (const [pk, delta] of Object.entries(data.deltas)) {
+            if (confirmed.has(pk)) {
+                const state = confirmed.get(pk);
+                confirmed.set(pk, { liked: state.liked, likeCount: state.likeCount + delta });
+            }
+            // 自分の操作の送信待ちのものは、送信後の応答で正しい数になる
+            if (pending.has(pk)) {
+                continue;
+            }
+            for (const likeBtn of buttonsFor(pk)) {
+                likeBtn.dataset.likeCount = Math.max(0, parseInt(likeBtn.dataset.likeCount) + delta);
+                renderBtn(likeBtn);
+            }
+        }
+    });
+
+    source.addEventListener('delete', (event) => {
+        const data = JSON.parse(event.data);
+        for (const likeBtn of buttonsFor(data.id)) {
+            likeBtn.closest('tr').remove();
+        }
+    });
+});
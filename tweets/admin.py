@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import Tweet
+from .models import PendingLike, TimelineEntry, Tweet
 
 admin.site.register(Tweet)
+admin.site.register(TimelineEntry)
+admin.site.register(PendingLike)
@@ -0,0 +1,149 @@
+"""
+タイムラインのJSON API。
+
+ETagは1ページ分の (id, updated_at, like_count, 投稿者名) と閲覧者のいいね状態から作る。
+投稿者名はツイートの updated_at では変わらないので、tweets.fragments の版と同じく別に入れる。
+If-None-Match が一致すれば、本文を読まず、JSONも作らずに 304 を返す。
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.views.generic import View
+
+from tweets.feed import FollowingFeedPaginator
+from tweets.likes import overlay_pending_likes
+from tweets.models import Tweet
+from tweets.pagination import InvalidCursor, KeysetPaginator
+from tweets.search import SearchPaginator, search_available, search_tweets
+from tweets.timeline import resolve_liked
+
+# ETagに必要な列だけ読む (投稿者は select_related で同じ検索で読む)
+VERSION_FIELDS = ("id", "user_id", "created_at", "updated_at", "like_count", "user__username")
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(json.dumps(parts, default=str).encode(), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+def api_response(data, etag=None, status=200):
+    response = JsonResponse(data, status=status, json_dumps_params={"ensure_ascii": False, "separators": (",", ":")})
+    if etag:
+        response["ETag"] = etag
+    return response
+
+
+def tweet_versions(tweets):
+    return [(tweet.pk, tweet.updated_at, tweet.like_count, tweet.is_liked, tweet.user.username) for tweet in tweets]
+
+
+def serialize_tweets(tweets):
+    """バージョン列だけを読んだツイートに、本文を1回の検索で付けて辞書にする。"""
+    contents = dict(Tweet.objects.filter(pk__in=[tweet.pk for tweet in tweets]).values_list("pk", "content"))
+    return [
+        {
+            "id": tweet.pk,
+            "user": tweet.user.username,
+            "content": contents[tweet.pk],
+            "created_at": tweet.created_at,
+            "like_count": tweet.like_count,
+            "liked": tweet.is_liked,
+        }
+        for tweet in tweets
+        if tweet.pk in contents
+    ]
+
+
+class ApiLoginRequiredMixin(LoginRequiredMixin):
+    # APIではログイン画面へリダイレクトせずに 403 を返す
+    raise_exception = True
+
+
+class TimelineApiView(ApiLoginRequiredMixin, View):
+    """ツイート一覧のAPIの共通部分。get_queryset と get_paginator を差し替えて使う。"""
+
+    def get_queryset(self):
+        return Tweet.objects.all()
+
+    def get_paginator(self, page_size):
+        return KeysetPaginator(page_size)
+
+    def get(self, request, *args, **kwargs):
+        paginator = self.get_paginator(settings.TIMELINE_PAGE_SIZE)
+        cursor = request.GET.get("cursor")
+        try:
+            page = paginator.paginate(self.get_queryset().select_related("user").only(*VERSION_FIELDS), cursor)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        tweets = page.object_list
+        resolve_liked(tweets, request.user)
+        overlay_pending_likes(tweets, request.user)
+
+        etag = make_etag(request.user.pk, cursor, tweet_versions(tweets))
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        return api_response({"tweets": serialize_tweets(tweets), "next_cursor": page.next_cursor}, etag)
+
+
+class HomeApiView(TimelineApiView):
+    def get_paginator(self, page_size):
+        if self.request.GET.get("feed") == "following":
+            return FollowingFeedPaginator(self.request.user, page_size)
+        return super().get_paginator(page_size)
+
+
+class TweetDetailApiView(ApiLoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet.objects.select_related("user").only(*VERSION_FIELDS), pk=kwargs["pk"])
+        resolve_liked([tweet], request.user)
+        overlay_pending_likes([tweet], request.user)
+
+        etag = make_etag(request.user.pk, tweet_versions([tweet]))
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        data = serialize_tweets([tweet])
+        if not data:
+            # バージョン列を読んだ後に削除された
+            raise Http404("No Tweet matches the given query.")
+        return api_response(data[0], etag)
+
+
+class SearchApiView(ApiLoginRequiredMixin, View):
+    """TweetSearchView のJSON版。並びは合う順で、各ツイートに score を付ける。"""
+
+    def get(self, request, *args, **kwargs):
+        if not search_available():
+            return api_response({"error": "全文検索は SQLite (FTS5) でだけ使えます。"}, status=501)
+        queryset = search_tweets(request.GET.get("q", ""), request.GET.get("user"))
+        # 索引の terms は読まない
+        queryset = queryset.select_related("tweet__user").only(*[f"tweet__{field}" for field in VERSION_FIELDS])
+        paginator = SearchPaginator(settings.TIMELINE_PAGE_SIZE)
+        cursor = request.GET.get("cursor")
+        try:
+            page = paginator.paginate(queryset, cursor)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        tweets = page.object_list
+        resolve_liked(tweets, request.user)
+        overlay_pending_likes(tweets, request.user)
+
+        etag = make_etag(
+            request.user.pk, request.GET.get("q"), request.GET.get("user"), cursor, tweet_versions(tweets)
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        # 読んでいる間に削除されたツイートは serialize_tweets が除くので、順番ではなくIDで合わせる
+        scores = {tweet.pk: tweet.search_score for tweet in tweets}
+        data = serialize_tweets(tweets)
+        for item in data:
+            item["score"] = scores[item["id"]]
+        return api_response({"tweets": data, "next_cursor": page.next_cursor}, etag)
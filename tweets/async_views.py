@@ -0,0 +1,87 @@
+"""
+読み込み系のビューの非同期版。ASGI (mysite.asgi) で動かすと、DBを待つ間にワーカーのスレッドを占有しない。
+
+Django 4.1 の非同期ORMは内部で sync_to_async を使うので、クエリ自体は共有の1スレッドで順に実行される。
+テンプレートは TemplateResponse で返し、描画はDjangoにイベントループの外で行わせる。
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404
+from django.views.generic import View
+from django.views.generic.base import TemplateResponseMixin
+
+from tweets.feed import FollowingFeedPaginator
+from tweets.likes import overlay_pending_likes
+from tweets.models import Tweet
+from tweets.pagination import InvalidCursor, KeysetPaginator
+from tweets.timeline import aassemble_timeline, aresolve_liked
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    async def dispatch(self, request, *args, **kwargs):
+        # request.user はセッションとユーザーをDBから読む遅延オブジェクトなので、イベントループの外で評価しておく
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        return await View.dispatch(self, request, *args, **kwargs)
+
+
+class AsyncTimelineView(AsyncLoginRequiredMixin, TemplateResponseMixin, View):
+    """ツイート一覧の非同期ビュー。TimelineMixin と同じくキーセット方式でページを取得してから組み立てる。"""
+
+    def get_queryset(self):
+        return Tweet.objects.select_related("user")
+
+    def get_cursor_paginator(self, page_size):
+        return KeysetPaginator(page_size)
+
+    async def get_page(self):
+        paginator = self.get_cursor_paginator(settings.TIMELINE_PAGE_SIZE)
+        try:
+            page = await paginator.apaginate(self.get_queryset(), self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        await aassemble_timeline(page.object_list, self.request.user)
+        return page
+
+    def get_timeline_context(self, page):
+        return {
+            "object_list": page.object_list,
+            "tweet_list": page.object_list,
+            "page_obj": page,
+            "is_paginated": page.has_next(),
+        }
+
+
+class AsyncHomeView(AsyncTimelineView):
+    template_name = "tweets/home.html"
+
+    def get_feed(self):
+        return "following" if self.request.GET.get("feed") == "following" else "all"
+
+    def get_cursor_paginator(self, page_size):
+        if self.get_feed() == "following":
+            return FollowingFeedPaginator(self.request.user, page_size)
+        return super().get_cursor_paginator(page_size)
+
+    async def get(self, request, *args, **kwargs):
+        page = await self.get_page()
+        return self.render_to_response({**self.get_timeline_context(page), "feed": self.get_feed()})
+
+
+class AsyncTweetDetailView(AsyncLoginRequiredMixin, TemplateResponseMixin, View):
+    template_name = "tweets/detail.html"
+
+    async def get(self, request, *args, **kwargs):
+        tweet = await aget_object_or_404(Tweet.objects.select_related("user"), pk=kwargs["pk"])
+        await aresolve_liked([tweet], request.user)
+        await sync_to_async(overlay_pending_likes)([tweet], request.user)
+        return self.render_to_response({"object": tweet, "tweet": tweet, "is_liked": tweet.is_liked})
@@ -0,0 +1,145 @@
+"""
+フォロー中タイムライン。
+
+ツイート時にフォロワーの受信箱 (TimelineEntry) へまとめて書き込み (fan-out-on-write)、
+読み込みは受信箱の範囲検索1回で済ませる。
+フォロワーが FEED_FANOUT_MAX_FOLLOWERS 人以上いるアカウントは書き込みを行わず、
+読み込み時にそのアカウントのツイートを取りに行って受信箱の結果とマージする (fan-out-on-read)。
+"""
+
+from django.conf import settings
+
+from accounts.models import User
+from tweets.models import TimelineEntry, Tweet
+from tweets.pagination import CursorPage, KeysetPaginator, encode_cursor, keyset_condition
+
+Follow = User.following.through
+
+
+def is_fanout_on_read(user):
+    return user.followers_count >= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def get_fanout_on_read_users(user):
+    return User.objects.filter(follower=user, followers_count__gte=settings.FEED_FANOUT_MAX_FOLLOWERS)
+
+
+def get_fanout_on_read_user_ids(user):
+    return list(get_fanout_on_read_users(user).values_list("pk", flat=True))
+
+
+def _bulk_insert(owner_ids, tweets):
+    batch_size = settings.FEED_FANOUT_BATCH_SIZE
+    entries = []
+    for owner_id in owner_ids:
+        for tweet in tweets:
+            entries.append(TimelineEntry(owner_id=owner_id, tweet_id=tweet.pk, created_at=tweet.created_at))
+            if len(entries) >= batch_size:
+                TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+    if entries:
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def fan_out_tweet(tweet):
+    """新しいツイートを本人とフォロワーの受信箱に書き込む。"""
+    owner_ids = [tweet.user_id]
+    if not is_fanout_on_read(tweet.user):
+        follower_ids = Follow.objects.filter(followee_id=tweet.user_id).values_list("follower_id", flat=True)
+        owner_ids = list(follower_ids.iterator(chunk_size=settings.FEED_FANOUT_BATCH_SIZE)) + owner_ids
+    _bulk_insert(owner_ids, [tweet])
+
+
+def _recent_tweets(user_id):
+    tweets = Tweet.objects.filter(user_id=user_id).order_by("-created_at", "-id")[: settings.FEED_BACKFILL_SIZE]
+    return list(tweets.only("pk", "created_at"))
+
+
+def backfill_timeline(user, followee):
+    """フォローした直後に、相手の最近のツイートを受信箱へ入れておく。"""
+    if is_fanout_on_read(followee):
+        return
+    _bulk_insert([user.pk], _recent_tweets(followee.pk))
+
+
+def backfill_follows(pairs):
+    """
+    (フォローする側のID, される側のID) の組について、backfill_timeline と同じく受信箱を埋める。
+    Follow.objects.bulk_follow のように1件ずつのフォローを通らずに作ったフォローの後に呼ぶ。
+    """
+    follower_ids = {}
+    for follower_id, followee_id in pairs:
+        follower_ids.setdefault(followee_id, set()).add(follower_id)
+    followees = User.objects.filter(pk__in=follower_ids).only("pk", "followers_count")
+    for followee in followees.iterator(chunk_size=settings.FEED_FANOUT_BATCH_SIZE):
+        if not is_fanout_on_read(followee):
+            _bulk_insert(sorted(follower_ids[followee.pk]), _recent_tweets(followee.pk))
+
+
+def backfill_followers(followee):
+    """followee の最近のツイートを、本人とフォロワーの受信箱へ入れる。既にある行はそのまま残す。"""
+    owner_ids = [followee.pk]
+    if not is_fanout_on_read(followee):
+        follower_ids = Follow.objects.filter(followee_id=followee.pk).values_list("follower_id", flat=True)
+        owner_ids += follower_ids.iterator(chunk_size=settings.FEED_FANOUT_BATCH_SIZE)
+    tweets = _recent_tweets(followee.pk)
+    if tweets:
+        _bulk_insert(owner_ids, tweets)
+
+
+def purge_timeline(user, followee):
+    """フォロー解除した相手のツイートを受信箱から取り除く。"""
+    TimelineEntry.objects.filter(owner=user, tweet__user=followee).delete()
+
+
+class FollowingFeedPaginator(KeysetPaginator):
+    """
+    受信箱と fan-out-on-read 対象アカウントのツイートをそれぞれ (created_at, id) の降順で
+    page_size + 1 件ずつ読み、マージしてから1ページ分のツイートを取得する。
+    カーソルの形式は KeysetPaginator と同じ。
+    """
+
+    def __init__(self, user, page_size):
+        super().__init__(page_size, keys=("created_at", "id"))
+        self.user = user
+
+    def get_inbox_keys(self, values):
+        entries = TimelineEntry.objects.filter(owner=self.user)
+        if values:
+            entries = entries.filter(keyset_condition(("created_at", "tweet_id"), values))
+        entries = entries.order_by("-created_at", "-tweet_id").values_list("created_at", "tweet_id")
+        return entries[: self.page_size + 1]
+
+    def get_pulled_keys(self, user_ids, values):
+        tweets = Tweet.objects.filter(user_id__in=user_ids)
+        if values:
+            tweets = self.filter_after(tweets, values)
+        tweets = tweets.order_by("-created_at", "-id").values_list("created_at", "id")
+        return tweets[: self.page_size + 1]
+
+    def _merge_keys(self, inbox_keys, pulled_keys):
+        # フォロワー数が閾値をまたいだアカウントのツイートは両方に現れるので重複を除く
+        keys = sorted(set(inbox_keys) | set(pulled_keys), reverse=True)
+        next_cursor = None
+        if len(keys) > self.page_size:
+            keys = keys[: self.page_size]
+            next_cursor = encode_cursor(keys[-1])
+        return keys, next_cursor
+
+    def paginate(self, queryset, cursor=None):
+        values = self.parse_cursor(Tweet, cursor) if cursor else None
+        user_ids = get_fanout_on_read_user_ids(self.user)
+        pulled_keys = list(self.get_pulled_keys(user_ids, values)) if user_ids else []
+        keys, next_cursor = self._merge_keys(list(self.get_inbox_keys(values)), pulled_keys)
+        tweets = queryset.in_bulk([pk for _, pk in keys])
+        return CursorPage([tweets[pk] for _, pk in keys if pk in tweets], next_cursor)
+
+    async def apaginate(self, queryset, cursor=None):
+        """paginate の非同期版。"""
+        values = self.parse_cursor(Tweet, cursor) if cursor else None
+        user_ids = [pk async for pk in get_fanout_on_read_users(self.user).values_list("pk", flat=True)]
+        pulled_keys = [key async for key in self.get_pulled_keys(user_ids, values)] if user_ids else []
+        inbox_keys = [key async for key in self.get_inbox_keys(values)]
+        keys, next_cursor = self._merge_keys(inbox_keys, pulled_keys)
+        tweets = await queryset.ain_bulk([pk for _, pk in keys])
+        return CursorPage([tweets[pk] for _, pk in keys if pk in tweets], next_cursor)
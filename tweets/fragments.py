@@ -0,0 +1,40 @@
+"""
+タイムラインの1行のうち、閲覧者によって変わらない部分 (ID・本文・作成日・投稿者) のHTMLキャッシュ。
+
+キーはツイートIDで、値には updated_at と投稿者名を版として持たせ、版が違えば描き直す。
+いいねの状態と削除ボタンは閲覧者ごとに違うので、キャッシュせずにテンプレート側で毎回描く。
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+def fragment_key(tweet_id):
+    return f"tweet:fragment:{tweet_id}"
+
+
+def fragment_version(tweet):
+    return (tweet.updated_at.isoformat(), tweet.user.username)
+
+
+def attach_fragments(tweets):
+    """tweets の各要素に fragment を付ける。キャッシュの読み書きはページ全体で get_many / set_many 1回ずつ。"""
+    cached = cache.get_many([fragment_key(tweet.pk) for tweet in tweets])
+    missing = {}
+    for tweet in tweets:
+        key = fragment_key(tweet.pk)
+        version = fragment_version(tweet)
+        entry = cached.get(key)
+        if entry is None or entry["version"] != version:
+            entry = {"version": version, "html": render_to_string("tweets/_tweet.html", {"tweet": tweet})}
+            missing[key] = entry
+        tweet.fragment = mark_safe(entry["html"])
+    if missing:
+        cache.set_many(missing, settings.TWEET_FRAGMENT_CACHE_TIMEOUT)
+    return tweets
+
+
+def invalidate_fragments(tweet_ids):
+    cache.delete_many([fragment_key(tweet_id) for tweet_id in tweet_ids])
@@ -0,0 +1,131 @@
+"""
+いいねの書き込み。
+
+通常は liked_by へ直接書き込む。settings.LIKES_WRITE_BEHIND を有効にすると、操作を PendingLike に追記するだけにして、
+flush_likes コマンドがまとめて反映する。人気のツイートにいいねが集中しても、
+リクエストごとに同じ行を奪い合わずに済む。
+反映前の操作は読み込み時に like_count と is_liked へ足し込むので、本人には自分の操作がすぐに見える。
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, OuterRef, Q, Sum, When
+
+from tweets.models import PendingLike, Tweet, likes_changed
+
+Like = Tweet.liked_by.through
+
+
+def like_tweet(user, tweet, liked):
+    if settings.LIKES_WRITE_BEHIND:
+        PendingLike.objects.create(user=user, tweet=tweet, liked=liked)
+    elif liked:
+        tweet.add_like(user)
+    else:
+        tweet.remove_like(user)
+
+
+def set_likes(user, desired):
+    """
+    desired ({ツイートID: いいねするか}) をまとめて反映し、{ツイートID: 保留中の操作を含めたいいね数} を返す。
+    存在しないツイートは無視する。
+    """
+    liked_ids = [pk for pk, liked in desired.items() if liked]
+    unliked_ids = [pk for pk, liked in desired.items() if not liked]
+    if not settings.LIKES_WRITE_BEHIND:
+        return Tweet.objects.apply_likes(user, liked_ids, unliked_ids)
+
+    counts = dict(Tweet.objects.filter(pk__in=desired).values_list("pk", "like_count"))
+    PendingLike.objects.bulk_create([PendingLike(user=user, tweet_id=pk, liked=desired[pk]) for pk in counts])
+    for pk, delta in get_pending_deltas(counts).items():
+        counts[pk] += delta
+    return counts
+
+
+def _latest_intents(rows):
+    """(user_id, tweet_id, liked) を古い順に受け取り、組ごとに最後の操作だけを残す。いいね→取り消しはここで打ち消し合う。"""
+    latest = {}
+    for user_id, tweet_id, liked in rows:
+        latest[(user_id, tweet_id)] = liked
+    return latest
+
+
+def get_pending_deltas(tweet_ids):
+    """
+    まだ反映していない操作による、ツイートごとのいいね数の増減。
+    (ユーザー, ツイート) ごとに最後の操作だけを liked_by の状態と比べ、SQLでツイートごとに合計する。
+    いいねが集中したツイートでも、保留中の操作の行をPythonへ読み込まない。
+    """
+    newer = PendingLike.objects.filter(
+        user_id=OuterRef("user_id"), tweet_id=OuterRef("tweet_id"), id__gt=OuterRef("id")
+    )
+    existing = Like.objects.filter(user_id=OuterRef("user_id"), tweet_id=OuterRef("tweet_id"))
+    delta = Case(
+        When(liked=True, existing=False, then=1),
+        When(liked=False, existing=True, then=-1),
+        default=0,
+    )
+    rows = (
+        PendingLike.objects.filter(tweet_id__in=tweet_ids)
+        .filter(~Exists(newer))
+        .annotate(existing=Exists(existing))
+        .order_by()
+        .values("tweet_id")
+        .annotate(delta=Sum(delta))
+        .values_list("tweet_id", "delta")
+    )
+    return {tweet_id: delta for tweet_id, delta in rows if delta}
+
+
+def overlay_pending_likes(tweets, user):
+    """ツイートの like_count と is_liked に、反映前の操作を足し込む。"""
+    if not settings.LIKES_WRITE_BEHIND or not tweets:
+        return tweets
+    tweet_ids = [tweet.pk for tweet in tweets]
+    deltas = get_pending_deltas(tweet_ids)
+    mine = PendingLike.objects.filter(user_id=user.pk, tweet_id__in=tweet_ids).order_by("id")
+    liked_by_me = dict(mine.values_list("tweet_id", "liked"))
+    for tweet in tweets:
+        tweet.like_count += deltas.get(tweet.pk, 0)
+        if tweet.pk in liked_by_me:
+            tweet.is_liked = liked_by_me[tweet.pk]
+    return tweets
+
+
+def flush_pending_likes(batch_size):
+    """
+    古い順に batch_size 件の操作を1トランザクションで liked_by に反映し、反映した件数を返す。
+    対象ツイートの like_count は中間テーブルから数え直すので、反映のたびに正しい数になる。
+    """
+    with transaction.atomic():
+        rows = list(PendingLike.objects.order_by("id").values_list("id", "user_id", "tweet_id", "liked")[:batch_size])
+        if not rows:
+            return 0
+        latest = _latest_intents(row[1:] for row in rows)
+
+        Like.objects.bulk_create(
+            [Like(user_id=user_id, tweet_id=tweet_id) for (user_id, tweet_id), liked in latest.items() if liked],
+            ignore_conflicts=True,
+        )
+        # いいねが集中するのは少数のツイートなので、ツイートごとにまとめて条件を作る
+        unliked = defaultdict(list)
+        for (user_id, tweet_id), liked in latest.items():
+            if not liked:
+                unliked[tweet_id].append(user_id)
+        if unliked:
+            condition = Q()
+            for tweet_id, user_ids in unliked.items():
+                condition |= Q(tweet_id=tweet_id, user_id__in=user_ids)
+            Like.objects.filter(condition).delete()
+
+        tweets = Tweet.objects.filter(pk__in={tweet_id for _, tweet_id in latest})
+        before = dict(tweets.values_list("pk", "like_count"))
+        tweets.sync_like_counts()
+        after = dict(tweets.values_list("pk", "like_count"))
+        deltas = {pk: count - before[pk] for pk, count in after.items() if count != before[pk]}
+        if deltas:
+            likes_changed.send(sender=Tweet, user=None, deltas=deltas)
+        PendingLike.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
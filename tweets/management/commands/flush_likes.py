@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets.likes import flush_pending_likes
+
+
+class Command(BaseCommand):
+    help = "書き込み遅延モードで溜まったいいねの操作 (PendingLike) を liked_by にまとめて反映する。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="1トランザクションで反映する操作の数")
+        parser.add_argument("--loop", action="store_true", help="終了せずに反映を続ける")
+        parser.add_argument("--interval", type=float, default=1.0, help="--loop で操作がないときに待つ秒数")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            flushed = flush_pending_likes(options["batch_size"])
+            total += flushed
+            if flushed:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"{total} 件のいいねの操作を反映しました。")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Max
+
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Tweet.like_count を liked_by の中間テーブルから数え直す。--check のときは不一致を報告するだけ。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="更新せずに不一致があれば失敗する")
+        parser.add_argument("--batch-size", type=int, default=10000, help="1回に処理するツイートIDの範囲")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_pk = Tweet.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+        mismatched = 0
+        # 主キーの範囲ごとに区切り、長いロックや巨大なGROUP BYを避ける
+        for start in range(0, max_pk + 1, batch_size):
+            tweets = Tweet.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+            wrong = tweets.with_actual_like_count().exclude(like_count=F("actual_like_count"))
+            pks = list(wrong.values_list("pk", flat=True))
+            if not pks:
+                continue
+            mismatched += len(pks)
+            if not options["check"]:
+                Tweet.objects.filter(pk__in=pks).sync_like_counts()
+
+        if options["check"]:
+            if mismatched:
+                raise CommandError(f"{mismatched} 件のツイートで like_count が一致しません。")
+            self.stdout.write("like_count はすべて一致しています。")
+        else:
+            self.stdout.write(f"{mismatched} 件のツイートの like_count を修正しました。")
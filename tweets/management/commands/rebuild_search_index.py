@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from tweets.models import Tweet
+from tweets.search import clear_index, index_tweets, optimize_index, search_available
+
+
+class Command(BaseCommand):
+    help = (
+        "ツイートの全文検索の索引 (tweets_tweet_fts) を作り直す。"
+        "seed_data の bulk_create などシグナルを通らずにツイートを書き込んだ後に使う。SQLite 以外では何もしない。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="1回に処理するツイートIDの範囲")
+
+    def handle(self, *args, **options):
+        if not search_available():
+            # seed_data から呼ばれても止めないよう、エラーにはしない
+            self.stderr.write("全文検索は SQLite (FTS5) でだけ使えます。索引は作りませんでした。")
+            return
+
+        batch_size = options["batch_size"]
+        max_pk = Tweet.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+        clear_index()
+        indexed = 0
+        # 主キーの範囲ごとにトランザクションを分け、書き込みのロックを長く持たない
+        for start in range(0, max_pk + 1, batch_size):
+            with transaction.atomic():
+                tweets = list(Tweet.objects.filter(pk__gte=start, pk__lt=start + batch_size).only("pk", "content"))
+                index_tweets(tweets)
+            indexed += len(tweets)
+        optimize_index()
+        self.stdout.write(f"{indexed} 件のツイートを索引に入れました。")
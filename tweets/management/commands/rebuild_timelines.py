@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from accounts.models import User
+from tweets.feed import backfill_followers
+
+
+class Command(BaseCommand):
+    help = (
+        "フォロー中タイムラインの受信箱 (TimelineEntry) に、今あるフォローの分の最近のツイートを入れる。"
+        "受信箱を作る前からあるフォローや、bulk_follow など1件ずつのフォローを通らずに作ったフォローの後に使う。既にある行は残す。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="1回に読むユーザーIDの範囲")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_pk = User.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+        users = 0
+        # ユーザーごとに、そのツイートを本人とフォロワーの受信箱へ入れる
+        for start in range(0, max_pk + 1, batch_size):
+            chunk = User.objects.filter(pk__gte=start, pk__lt=start + batch_size).only("pk", "followers_count")
+            for user in chunk:
+                backfill_followers(user)
+                users += 1
+        self.stdout.write(f"{users} 人のユーザーのツイートを受信箱に入れました。")
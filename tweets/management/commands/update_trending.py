@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = "前回の続きから新しいいいねを読み、トレンドのスコア (TrendingScore) に足し込む。定期的に実行する。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="1トランザクションで読むいいねの数")
+        parser.add_argument("--loop", action="store_true", help="終了せずに更新を続ける")
+        parser.add_argument("--interval", type=float, default=60.0, help="--loop で更新の間に待つ秒数")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            total += update_trending(options["batch_size"])
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"{total} 件のいいねをトレンドのスコアに反映しました。")
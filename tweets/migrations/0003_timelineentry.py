@@ -0,0 +1,90 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# tweets.feed と同じく、相手1人あたり最近の BACKFILL_SIZE 件 (settings.FEED_BACKFILL_SIZE の既定値) を入れる
+BACKFILL_SIZE = 50
+BATCH_SIZE = 1000
+
+
+def _bulk_insert(entries, owner_ids, tweets):
+    """tweets.feed._bulk_insert と同じく、BATCH_SIZE 行ずつ書き込む。"""
+    rows = []
+    for owner_id in owner_ids:
+        for tweet_id, created_at in tweets:
+            rows.append(entries.model(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at))
+            if len(rows) >= BATCH_SIZE:
+                entries.bulk_create(rows, ignore_conflicts=True)
+                rows = []
+    if rows:
+        entries.bulk_create(rows, ignore_conflicts=True)
+
+
+def backfill_timelines(apps, schema_editor):
+    """
+    既にあるフォローとツイートの分、受信箱を埋める。ツイートした人ごとに、最近のツイートを本人とフォロワーの受信箱へ入れる。
+    fan-out-on-read の対象かどうかは見ない (読み込み時のマージで重複は除かれる)。
+    """
+    alias = schema_editor.connection.alias
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Tweet = apps.get_model("tweets", "Tweet")
+    TimelineEntry = apps.get_model("tweets", "TimelineEntry")
+    # accounts のマイグレーションが先に進んでいると、中間テーブルは列の名前が変わった Follow (accounts 0005) になっている
+    Follow = User._meta.get_field("following").remote_field.through
+    if "follower" in {field.name for field in Follow._meta.get_fields()}:
+        follower, followee = "follower", "followee"
+    else:
+        follower, followee = "from_user", "to_user"
+    author_ids = list(Tweet.objects.using(alias).order_by("user_id").values_list("user_id", flat=True).distinct())
+    for author_id in author_ids:
+        tweets = Tweet.objects.using(alias).filter(user_id=author_id).order_by("-created_at", "-id")
+        tweets = list(tweets.values_list("pk", "created_at")[:BACKFILL_SIZE])
+        follower_ids = Follow.objects.using(alias).filter(**{followee: author_id}).values_list(follower, flat=True)
+        owner_ids = [author_id, *follower_ids.iterator(chunk_size=BATCH_SIZE)]
+        _bulk_insert(TimelineEntry.objects.using(alias), owner_ids, tweets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("tweets", "0002_tweet_liked_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField()),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "tweet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="timeline_entries", to="tweets.tweet"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "タイムライン",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="timelineentry",
+            index=models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="timelineentry",
+            constraint=models.UniqueConstraint(fields=("owner", "tweet"), name="unique_timeline_entry"),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
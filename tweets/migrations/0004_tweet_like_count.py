@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_like_count(apps, schema_editor):
+    Tweet = apps.get_model("tweets", "Tweet")
+    likes = (
+        Tweet.liked_by.through.objects.filter(tweet_id=OuterRef("pk"))
+        .order_by()
+        .values("tweet_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Tweet.objects.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0003_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_like_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0004_tweet_like_count"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["-created_at", "-id"], name="tweet_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"),
+        ),
+        # 自動生成の中間テーブルは Meta.indexes を持てないのでSQLで作る。
+        # 一意制約の (tweet_id, user_id) とは逆向きで、「自分がいいねしたツイート」の検索用。
+        migrations.RunSQL(
+            'CREATE INDEX "tweet_liked_by_user_tweet_idx" ON "tweets_tweet_liked_by" ("user_id", "tweet_id")',
+            'DROP INDEX "tweet_liked_by_user_tweet_idx"',
+        ),
+    ]
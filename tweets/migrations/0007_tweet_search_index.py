@@ -0,0 +1,91 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:17
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tweets.models
+
+TABLE = "tweets_tweet_fts"
+
+# 語の分け方は、このマイグレーションを作った時点の tweets.search.index_terms の写し。
+# tweets.search を後で変えても、このマイグレーションの結果は変わらないようにする
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_WORD = re.compile(r"[^\W_]+")
+_RUN = re.compile(rf"[{_CJK_CHARS}]+|[^{_CJK_CHARS}]+")
+_CJK = re.compile(rf"[{_CJK_CHARS}]")
+
+
+def _runs(text):
+    text = unicodedata.normalize("NFKC", text).casefold()
+    for word in _WORD.findall(text):
+        for run in _RUN.findall(word):
+            yield bool(_CJK.match(run)), run
+
+
+def _bigrams(run):
+    return [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def index_terms(text):
+    terms = []
+    for is_cjk, run in _runs(text):
+        terms += [*_bigrams(run), run[-1]] if is_cjk else [run]
+    return " ".join(terms)
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 は SQLite 専用。他のバックエンドではテーブルを作らない (tweets.search.search_available)
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(terms)")
+    Tweet = apps.get_model("tweets", "Tweet")
+    rows = Tweet.objects.order_by("pk").values_list("pk", "content")
+    with schema_editor.connection.cursor() as cursor:
+        batch = []
+        for pk, content in rows.iterator(chunk_size=2000):
+            batch.append((pk, index_terms(content)))
+            if len(batch) >= 2000:
+                cursor.executemany(f"INSERT INTO {TABLE} (rowid, terms) VALUES (%s, %s)", batch)
+                batch = []
+        cursor.executemany(f"INSERT INTO {TABLE} (rowid, terms) VALUES (%s, %s)", batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0006_pendinglike"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TweetSearchIndex",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("terms", tweets.models.SearchTermsField()),
+            ],
+            options={
+                "verbose_name_plural": "検索の索引",
+                "db_table": "tweets_tweet_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+
+def seed_watermark(apps, schema_editor):
+    # 今あるいいねはトレンドに数えず、この後のいいねから読む
+    Tweet = apps.get_model("tweets", "Tweet")
+    Watermark = apps.get_model("tweets", "Watermark")
+    last_id = Tweet.liked_by.through.objects.aggregate(last_id=Max("pk"))["last_id"] or 0
+    Watermark.objects.get_or_create(name="trending", defaults={"last_id": last_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_tweet_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingScore",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trending_score",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("score", models.FloatField()),
+            ],
+            options={
+                "verbose_name_plural": "トレンドのスコア",
+            },
+        ),
+        migrations.CreateModel(
+            name="Watermark",
+            fields=[
+                ("name", models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "処理済みの位置",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="trendingscore",
+            index=models.Index(fields=["-score", "-tweet"], name="trending_score_idx"),
+        ),
+        migrations.RunPython(seed_watermark, migrations.RunPython.noop),
+    ]
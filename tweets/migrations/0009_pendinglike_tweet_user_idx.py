@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0008_trending_score"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pendinglike",
+            index=models.Index(fields=["tweet", "user", "id"], name="pendinglike_tweet_user_idx"),
+        ),
+    ]
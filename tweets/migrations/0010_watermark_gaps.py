@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0009_pendinglike_tweet_user_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="watermark",
+            name="gaps",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,7 +1,57 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Lookup, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 
 from accounts.models import User
 
+# いいねの付け外しで like_count が変わったときに送る。user は操作したユーザー、deltas は {ツイートID: 増減}
+likes_changed = Signal()
+
+
+class TweetQuerySet(models.QuerySet):
+    def _actual_like_count(self):
+        likes = (
+            Tweet.liked_by.through.objects.filter(tweet_id=OuterRef("pk"))
+            .order_by()
+            .values("tweet_id")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return Coalesce(Subquery(likes), 0)
+
+    def with_actual_like_count(self):
+        """中間テーブルから数えたいいね数を actual_like_count として付ける。"""
+        return self.annotate(actual_like_count=self._actual_like_count())
+
+    def sync_like_counts(self):
+        """like_count を中間テーブルの行数で上書きする。"""
+        return self.update(like_count=self._actual_like_count())
+
+    def apply_likes(self, user, liked_ids, unliked_ids):
+        """
+        user のいいねを1トランザクションでまとめて付け外しする。
+        追加は重複を無視する bulk_create、削除は DELETE 1回で行い、対象ツイートの like_count は中間テーブルから数え直す。
+        存在しないツイートは無視し、{ツイートID: like_count} を返す。
+        """
+        Like = Tweet.liked_by.through
+        before = dict(self.filter(pk__in=set(liked_ids) | set(unliked_ids)).values_list("pk", "like_count"))
+        if not before:
+            return {}
+        with transaction.atomic():
+            Like.objects.bulk_create(
+                [Like(tweet_id=pk, user_id=user.pk) for pk in liked_ids if pk in before],
+                ignore_conflicts=True,
+            )
+            Like.objects.filter(user_id=user.pk, tweet_id__in=unliked_ids).delete()
+            tweets = Tweet.objects.filter(pk__in=before)
+            tweets.sync_like_counts()
+            counts = dict(tweets.values_list("pk", "like_count"))
+            deltas = {pk: count - before[pk] for pk, count in counts.items() if count != before[pk]}
+            if deltas:
+                likes_changed.send(sender=Tweet, user=user, deltas=deltas)
+            return counts
+
 
 class Tweet(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tweets")
@@ -12,9 +62,160 @@ class Tweet(models.Model):
         User,
         related_name="liking",
     )
+    # liked_by の件数。add_like / remove_like で中間テーブルと同じトランザクション内で更新する
+    like_count = models.PositiveIntegerField(default=0)
+
+    objects = TweetQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.username} : {self.content}"
 
+    def add_like(self, user):
+        """いいねを付ける。中間テーブルに実際に行が追加されたときだけ like_count を増やして True を返す。"""
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    Tweet.liked_by.through.objects.create(tweet_id=self.pk, user_id=user.pk)
+            except IntegrityError:
+                return False
+            Tweet.objects.filter(pk=self.pk).update(like_count=F("like_count") + 1)
+            likes_changed.send(sender=Tweet, user=user, deltas={self.pk: 1})
+        return True
+
+    def remove_like(self, user):
+        """いいねを外す。中間テーブルから実際に行が削除されたときだけ like_count を減らして True を返す。"""
+        with transaction.atomic():
+            deleted, _ = Tweet.liked_by.through.objects.filter(tweet_id=self.pk, user_id=user.pk).delete()
+            if not deleted:
+                return False
+            # like_count がずれていても負の値にはしない (ずれは rebuild_like_counts で直す)
+            Tweet.objects.filter(pk=self.pk, like_count__gt=0).update(like_count=F("like_count") - 1)
+            likes_changed.send(sender=Tweet, user=user, deltas={self.pk: -1})
+        return True
+
     class Meta:
         verbose_name_plural = "ツイート"
+        indexes = [
+            # ホームのタイムライン (created_at, id の降順)
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_idx"),
+            # プロフィールのタイムライン・fan-out-on-read の取得
+            models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    フォロー中タイムライン用に、ツイートをフォロワーごとの受信箱へ書き込んだもの。
+    created_at はツイートの作成日時をコピーしておき、(owner, created_at, tweet) の範囲検索だけで読めるようにする。
+    """
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.owner.username} : {self.tweet_id}"
+
+    class Meta:
+        verbose_name_plural = "タイムライン"
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx"),
+        ]
+
+
+class PendingLike(models.Model):
+    """
+    書き込み遅延モード (settings.LIKES_WRITE_BEHIND) で、まだ liked_by に反映していないいいねの操作。
+    追記するだけのログとして使い、flush_likes コマンドが古い順にまとめて反映してから削除する。
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="pending_likes")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="pending_likes")
+    liked = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} : {self.tweet_id} : {'like' if self.liked else 'unlike'}"
+
+    class Meta:
+        verbose_name_plural = "保留中のいいね"
+        indexes = [
+            # 表示するツイートの保留中の操作を読み、(ユーザー, ツイート) ごとに最後の操作を探す (tweets.likes)
+            models.Index(fields=["tweet", "user", "id"], name="pendinglike_tweet_user_idx"),
+        ]
+
+
+class TrendingScore(models.Model):
+    """
+    トレンドのスコア。時間で減衰させたいいねの数の log を、いいねが増えたツイートの分だけ update_trending で更新する。
+    減衰は基準の日時からの経過で表すので、時間がたっても他の行を書き換えずに score の大小で順位を比べられる (tweets.trending)。
+    """
+
+    tweet = models.OneToOneField(Tweet, on_delete=models.CASCADE, primary_key=True, related_name="trending_score")
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.tweet_id} : {self.score:.2f}"
+
+    class Meta:
+        verbose_name_plural = "トレンドのスコア"
+        indexes = [
+            models.Index(fields=["-score", "-tweet"], name="trending_score_idx"),
+        ]
+
+
+class Watermark(models.Model):
+    """
+    定期的な処理が、name の表をどの行まで読んだか (読んだ最後の行のID)。
+    gaps は last_id より小さいのに読んだときにはなかったID と、それに気付いた日時 ({ID: UNIXTIME})。
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    gaps = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} : {self.last_id}"
+
+    class Meta:
+        verbose_name_plural = "処理済みの位置"
+
+
+class SearchTermsField(models.TextField):
+    """FTS5 の列。terms__match="..." で MATCH 検索する。"""
+
+
+@SearchTermsField.register_lookup
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class TweetSearchIndex(models.Model):
+    """
+    ツイートの全文検索の索引 (FTS5 の仮想テーブル)。rowid がツイートIDで、terms は tweets.search.index_terms で分けた語。
+    テーブルはマイグレーションで SQLite のときだけ作り、行は tweets.search から直接書き込む。
+    """
+
+    tweet = models.OneToOneField(
+        Tweet,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="+",
+    )
+    terms = SearchTermsField()
+
+    class Meta:
+        managed = False
+        db_table = "tweets_tweet_fts"
+        verbose_name_plural = "検索の索引"
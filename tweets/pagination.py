@@ -0,0 +1,134 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoderはマイクロ秒を切り捨てるので、同じミリ秒内の行を取りこぼさないよう自前で変換する
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def keyset_condition(keys, values):
+    # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+    condition = Q()
+    for i, key in enumerate(keys):
+        equal = {k: v for k, v in zip(keys[:i], values[:i])}
+        condition |= Q(**equal, **{f"{key}__lt": values[i]})
+    return condition
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    (created_at, id) のような一意なキーの降順で、OFFSETを使わずにページ分割する。
+    次ページは「最後の行より小さいキー」を条件にした範囲検索になるので、
+    何ページ目でもインデックスを先頭から読むのと同じコストで済む。
+    """
+
+    def __init__(self, page_size, keys=("created_at", "id")):
+        self.page_size = page_size
+        self.keys = keys
+
+    def get_ordering(self):
+        return [f"-{key}" for key in self.keys]
+
+    def get_key(self, obj):
+        return [getattr(obj, key) for key in self.keys]
+
+    def parse_cursor(self, model, token):
+        values = decode_cursor(token)
+        if len(values) != len(self.keys):
+            raise InvalidCursor(token)
+        try:
+            return [model._meta.get_field(key).to_python(value) for key, value in zip(self.keys, values)]
+        except ValidationError:
+            raise InvalidCursor(token)
+
+    def filter_after(self, queryset, values):
+        return queryset.filter(keyset_condition(self.keys, values))
+
+    def paginate(self, queryset, cursor=None):
+        if cursor:
+            queryset = self.filter_after(queryset, self.parse_cursor(queryset.model, cursor))
+        rows = list(queryset.order_by(*self.get_ordering())[: self.page_size + 1])
+        return self._make_page(rows)
+
+    async def apaginate(self, queryset, cursor=None):
+        """paginate の非同期版。"""
+        if cursor:
+            queryset = self.filter_after(queryset, self.parse_cursor(queryset.model, cursor))
+        rows = [row async for row in queryset.order_by(*self.get_ordering())[: self.page_size + 1]]
+        return self._make_page(rows)
+
+    def _make_page(self, rows):
+        next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[: self.page_size]
+            next_cursor = encode_cursor(self.get_key(rows[-1]))
+        return CursorPage(rows, next_cursor)
+
+
+class CursorPaginationMixin:
+    """
+    ListViewのページ分割を ?cursor= によるキーセット方式に置き換える。
+    テンプレートでは page_obj.next_cursor で次ページへのリンクを作る。
+    """
+
+    cursor_query_param = "cursor"
+    cursor_keys = ("created_at", "id")
+
+    def get_paginate_by(self, queryset):
+        return self.paginate_by or settings.TIMELINE_PAGE_SIZE
+
+    def get_cursor_paginator(self, page_size):
+        return KeysetPaginator(page_size, keys=self.cursor_keys)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_cursor_paginator(page_size)
+        try:
+            page = paginator.paginate(queryset, self.request.GET.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (paginator, page, page.object_list, page.has_next())
@@ -0,0 +1,148 @@
+"""
+ツイートの全文検索。
+
+SQLite の FTS5 の仮想テーブル tweets_tweet_fts (rowid = ツイートID) に、本文を検索語に分けて空白でつないだものを入れる。
+FTS5 の unicode61 は空白や記号でしか区切らず日本語の単語を切り出せないので、語の分割は Python 側で行う。
+
+- 英数字などは NFKC で正規化して小文字にした単語1つを1語にする。
+- かな・カタカナ・漢字が続く部分は、2文字ずつずらした bigram と、末尾の1文字を語にする。
+  「東京都」は 東京 / 京都 / 都 になり、2文字以上の検索語は bigram の並び (フレーズ) で、
+  1文字の検索語は前方一致で探す。
+
+索引は Tweet の post_save / post_delete で更新する (tweets.signals)。bulk_create などシグナルを通らない書き込みの後は
+rebuild_search_index で作り直す。FTS5 は SQLite 専用なので、他のバックエンドでは検索できない (search_available)。
+"""
+
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from tweets.models import Tweet, TweetSearchIndex
+from tweets.pagination import InvalidCursor, KeysetPaginator, decode_cursor
+
+TABLE = TweetSearchIndex._meta.db_table
+
+# ひらがな・カタカナ・CJK統合漢字 (拡張A)・CJK互換漢字
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_WORD = re.compile(r"[^\W_]+")
+_RUN = re.compile(rf"[{_CJK_CHARS}]+|[^{_CJK_CHARS}]+")
+_CJK = re.compile(rf"[{_CJK_CHARS}]")
+
+
+def _runs(text):
+    """(CJK の並びか, 文字列) を順に返す。"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    for word in _WORD.findall(text):
+        for run in _RUN.findall(word):
+            yield bool(_CJK.match(run)), run
+
+
+def _bigrams(run):
+    return [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def index_terms(text):
+    """索引に入れる、空白で区切った語の並び。"""
+    terms = []
+    for is_cjk, run in _runs(text):
+        terms += [*_bigrams(run), run[-1]] if is_cjk else [run]
+    return " ".join(terms)
+
+
+def build_query(text):
+    """検索語から FTS5 の MATCH の式を作る。語がなければ None。語はすべて含むもの (AND) を探す。"""
+    phrases = []
+    for is_cjk, run in _runs(text):
+        if not is_cjk:
+            phrases.append(f'"{run}"')
+        elif len(run) == 1:
+            phrases.append(f'"{run}"*')
+        else:
+            phrases.append('"' + " ".join(_bigrams(run)) + '"')
+    return " ".join(phrases) or None
+
+
+def _connection():
+    connection = connections[router.db_for_write(Tweet)]
+    return connection if connection.vendor == "sqlite" else None
+
+
+def search_available():
+    return _connection() is not None
+
+
+def index_tweets(tweets):
+    """tweets を索引に入れる (同じIDの行は置き換える)。"""
+    connection = _connection()
+    if connection is None or not tweets:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, terms) VALUES (%s, %s)",
+            [(tweet.pk, index_terms(tweet.content)) for tweet in tweets],
+        )
+
+
+def remove_from_index(tweet_ids):
+    connection = _connection()
+    if connection is None or not tweet_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(tweet_ids))})", list(tweet_ids))
+
+
+def clear_index():
+    connection = _connection()
+    if connection is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+
+def optimize_index():
+    """索引の b-tree をまとめる。一括で作り直した後に呼ぶ。"""
+    connection = _connection()
+    if connection is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+
+
+def search_tweets(text, username=None):
+    """
+    検索語に合う TweetSearchIndex の QuerySet。score (bm25 の符号を反転したもの、大きいほど合う) を付ける。
+    SearchPaginator で score, tweet_id の降順に並べて読む。語がないときや検索できないバックエンドでは空にする。
+    """
+    queryset = TweetSearchIndex.objects.annotate(score=RawSQL(f"-bm25({TABLE})", [], output_field=FloatField()))
+    query = build_query(text)
+    if query is None or not search_available():
+        return queryset.none()
+    queryset = queryset.filter(terms__match=query)
+    if username:
+        queryset = queryset.filter(tweet__user__username=username)
+    return queryset
+
+
+class SearchPaginator(KeysetPaginator):
+    """検索結果を (score, tweet_id) の降順でページ分割し、ページには索引の行ではなくツイートを入れる。"""
+
+    def __init__(self, page_size):
+        super().__init__(page_size, keys=("score", "tweet_id"))
+
+    def parse_cursor(self, model, token):
+        values = decode_cursor(token)
+        if len(values) != 2 or not isinstance(values[0], (int, float)) or not isinstance(values[1], int):
+            raise InvalidCursor(token)
+        return values
+
+    def _make_page(self, rows):
+        page = super()._make_page(rows)
+        tweets = []
+        for row in page.object_list:
+            row.tweet.search_score = row.score
+            tweets.append(row.tweet)
+        page.object_list = tweets
+        return page
@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tweets.fragments import invalidate_fragments
+from tweets.models import Tweet, likes_changed
+from tweets.search import index_tweets, remove_from_index
+from tweets.stream import hub
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_fragment(sender, instance, **kwargs):
+    invalidate_fragments([instance.pk])
+
+
+@receiver(post_save, sender=Tweet)
+def update_search_index(sender, instance, **kwargs):
+    index_tweets([instance])
+
+
+@receiver(post_delete, sender=Tweet)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_from_index([instance.pk])
+
+
+@receiver(post_save, sender=Tweet)
+def publish_tweet(sender, instance, created, **kwargs):
+    if not created or not hub.has_subscribers():
+        return
+    data = {
+        "id": instance.pk,
+        "user_id": instance.user_id,
+        "user": instance.user.username,
+        "content": instance.content,
+        "created_at": instance.created_at,
+    }
+    transaction.on_commit(lambda: hub.publish("tweet", data))
+
+
+@receiver(post_delete, sender=Tweet)
+def publish_tweet_deletion(sender, instance, **kwargs):
+    if not hub.has_subscribers():
+        return
+    # 削除後は instance.pk が None になるので先に取り出しておく
+    data = {"id": instance.pk}
+    transaction.on_commit(lambda: hub.publish("delete", data))
+
+
+@receiver(likes_changed, sender=Tweet)
+def publish_likes(sender, user, deltas, **kwargs):
+    if not hub.has_subscribers():
+        return
+    data = {"deltas": {str(pk): delta for pk, delta in deltas.items()}}
+    actor_id = user.pk if user else None
+    transaction.on_commit(lambda: hub.publish("likes", data, actor_id=actor_id))
@@ -0,0 +1,188 @@
+"""
+新しいツイートといいね数の増減を Server-Sent Events で配信する。
+
+Django 4.1 の StreamingHttpResponse は非同期イテレータを扱えないので、mysite/asgi.py で STREAM_PATH だけを
+このモジュールのASGIアプリに振り分ける。接続はイベントループ上のコルーチン1つとキュー1つで待つだけなので、
+何千もの待機中の接続をスレッドなしで保持できる。
+
+イベントはプロセス内のハブを通る。ツイートの保存・削除といいねの変更 (tweets.signals) がコミット後に publish し、
+ハブは購読中の各接続のイベントループへ call_soon_threadsafe で渡す。同じプロセスで起きた変更しか届かないので、
+複数のワーカーで動かす場合は Redis の pub/sub などに置き換える。
+"""
+
+import asyncio
+import json
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import Http404, QueryDict
+
+from tweets.feed import Follow
+
+# tweets.urls の "stream" と同じパス。テンプレートでは {% url 'tweets:stream' %} で参照する
+STREAM_PATH = "/tweets/stream/"
+
+
+class Subscription:
+    def __init__(self, loop, max_events, user_ids=None, exclude_actor=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_events)
+        # None なら全員のツイートを受け取る
+        self.user_ids = user_ids
+        # 自分のいいねは like.js の応答で反映済みなので送らない
+        self.exclude_actor = exclude_actor
+
+    def wants(self, event, data, actor_id):
+        if event == "tweet" and self.user_ids is not None:
+            return data["user_id"] in self.user_ids
+        if event == "likes":
+            return actor_id is None or actor_id != self.exclude_actor
+        return True
+
+    def put(self, message):
+        # イベントループのスレッドで呼ばれる。読むのが遅い接続では古いイベントから捨てる
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class Hub:
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self, **kwargs):
+        subscription = Subscription(asyncio.get_running_loop(), settings.STREAM_QUEUE_SIZE, **kwargs)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, data, actor_id=None):
+        """どのスレッドからでも呼べる。"""
+        message = format_event(event, data)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(event, data, actor_id):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.put, message)
+                except RuntimeError:
+                    # イベントループが閉じている
+                    self.unsubscribe(subscription)
+
+
+hub = Hub()
+
+
+def format_event(event, data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+
+def _get_header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+@sync_to_async
+def get_viewer(scope):
+    """Cookieのセッションからログインユーザーと、?feed=following ならフォロー中のユーザーIDを読む。"""
+    close_old_connections()
+    try:
+        cookie = SimpleCookie(_get_header(scope, b"cookie"))
+        morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+        session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value if morsel else None)
+        user = get_user(SimpleNamespace(session=session))
+        if not user.is_authenticated:
+            return None, None
+        user_ids = None
+        if QueryDict(scope.get("query_string", b"")).get("feed") == "following":
+            user_ids = set(Follow.objects.filter(follower_id=user.pk).values_list("followee_id", flat=True))
+            user_ids.add(user.pk)
+        return user, user_ids
+    finally:
+        close_old_connections()
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_application(scope, receive, send):
+    user, user_ids = await get_viewer(scope)
+    if user is None:
+        await send({"type": "http.response.start", "status": 403, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Forbidden"})
+        return
+
+    subscription = hub.subscribe(user_ids=user_ids, exclude_actor=user.pk)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # nginx などのプロキシにバッファさせない
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+        while not disconnected.done():
+            next_message = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {next_message, disconnected},
+                timeout=settings.STREAM_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if next_message in done:
+                body = next_message.result()
+            else:
+                next_message.cancel()
+                # 切れた接続を見つけるため、イベントがなくてもコメント行を送る
+                body = b": keepalive\n\n"
+            if disconnected.done():
+                break
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        hub.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+def stream_view(request):
+    """
+    tweets:stream のURLを引けるようにするためのビュー。ASGIでは route_stream が先に受け取るので、
+    ここに来るのは WSGI (runserver など) で動かしているときだけで、配信はできないので 404 にする。
+    """
+    raise Http404("配信はASGIで動かしているときだけ使えます")
+
+
+def route_stream(django_application):
+    """STREAM_PATH へのリクエストだけを stream_application に渡すASGIアプリを返す。"""
+
+    async def application(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == STREAM_PATH:
+            return await stream_application(scope, receive, send)
+        return await django_application(scope, receive, send)
+
+    return application
@@ -1,12 +1,464 @@
+import importlib
+import json
+import re
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from tweets.models import Tweet
+from accounts.models import Follow
+from mysite.testing import QueryBudgetMixin
+from tweets import fragments
+from tweets import urls as tweets_urls
+from tweets.feed import backfill_follows, fan_out_tweet
+from tweets.likes import get_pending_deltas
+from tweets.models import PendingLike, TimelineEntry, TrendingScore, Tweet, Watermark
+from tweets.stream import STREAM_PATH, stream_application
+from tweets.trending import WATERMARK, current_weight, update_trending
 
 User = get_user_model()
 
 
+@override_settings(TIMELINE_PAGE_SIZE=3)
+class TestHomeView(TestCase):
+    def setUp(self):
+        self.url = reverse("tweets:home")
+        self.user = User.objects.create_user(username="test", email="hoge@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(7)]
+        # 同じ時刻のツイートがあってもページの境目で重複・欠落しないこと
+        Tweet.objects.filter(pk__in=[t.pk for t in self.tweets[2:5]]).update(created_at=timezone.now())
+
+    def test_success_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/home.html")
+        self.assertEqual(len(response.context["tweet_list"]), 3)
+        self.assertTrue(response.context["page_obj"].has_next())
+
+    def test_walk_all_pages_with_cursor(self):
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get(self.url, {"cursor": cursor} if cursor else {})
+            page = response.context["page_obj"]
+            seen += [tweet.pk for tweet in page]
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        expected = list(Tweet.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTimelineAssembly(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", email="viewer@email.com", password="testpass0000")
+        self.likers = [
+            User.objects.create_user(username=f"liker{i}", email=f"liker{i}@email.com", password="testpass0000")
+            for i in range(5)
+        ]
+        self.client.force_login(self.user)
+
+    def create_tweets(self, count):
+        for i in range(count):
+            tweet = Tweet.objects.create(user=self.likers[i % len(self.likers)], content=f"tweet {i}")
+            tweet.liked_by.add(*self.likers)
+            if i % 2 == 0:
+                tweet.liked_by.add(self.user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in queries.captured_queries]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for url in [reverse("tweets:home"), reverse("accounts:user_profile", kwargs={"username": "liker0"})]:
+            Tweet.objects.all().delete()
+            self.create_tweets(2)
+            _, small = self.get(url)
+            self.create_tweets(10)
+            _, large = self.get(url)
+            self.assertEqual(len(small), len(large), url)
+
+    def test_liked_state_resolved_from_viewer_rows_only(self):
+        self.create_tweets(6)
+        response, queries = self.get(reverse("tweets:home"))
+        liked = {tweet.pk: tweet.is_liked for tweet in response.context["tweet_list"]}
+        expected = set(self.user.liking.values_list("pk", flat=True))
+        self.assertEqual({pk for pk, is_liked in liked.items() if is_liked}, expected)
+        like_queries = [sql for sql in queries if "tweets_tweet_liked_by" in sql]
+        self.assertEqual(len(like_queries), 1)
+        self.assertIn(f'"user_id" = {self.user.pk}', like_queries[0])
+
+
+class TestTweetFragments(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("tweets:home")
+        self.user = User.objects.create_user(username="test", email="hoge@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(3)]
+
+    def test_second_render_uses_cache(self):
+        self.client.get(self.url)
+        with mock.patch.object(fragments, "render_to_string", wraps=fragments.render_to_string) as render:
+            response = self.client.get(self.url)
+        render.assert_not_called()
+        self.assertContains(response, "tweet 2")
+
+    def test_save_and_delete_invalidate(self):
+        self.client.get(self.url)
+        tweet = self.tweets[0]
+        tweet.content = "edited"
+        tweet.save()
+        self.assertIsNone(cache.get(fragments.fragment_key(tweet.pk)))
+        self.assertContains(self.client.get(self.url), "edited")
+        self.client.get(self.url)
+        tweet_pk = tweet.pk
+        tweet.delete()
+        self.assertIsNone(cache.get(fragments.fragment_key(tweet_pk)))
+
+    def test_liked_state_is_per_viewer(self):
+        other = User.objects.create_user(username="other", email="other@email.com", password="testpass0000")
+        self.tweets[0].add_like(other)
+        self.client.get(self.url)
+        self.client.force_login(other)
+        liked = {tweet.pk: tweet.is_liked for tweet in self.client.get(self.url).context["tweet_list"]}
+        self.assertEqual(liked, {self.tweets[0].pk: True, self.tweets[1].pk: False, self.tweets[2].pk: False})
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN はSQLite専用")
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestQueryPlans(TestCase):
+    """各ビューが発行するクエリが全件スキャンや一時B-treeでのソートにならないことを確認する。"""
+
+    full_scan = re.compile(r"^SCAN \S+$")
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="planner", email="plan@email.com", password="testpass0000")
+        self.other = User.objects.create_user(username="other", email="other@email.com", password="testpass0000")
+        self.user.follow(self.other)
+        self.other.follow(self.user)
+        for i in range(5):
+            Tweet.objects.create(user=self.user, content=f"tweet {i}").add_like(self.other)
+        self.client.force_login(self.user)
+
+    def assertIndexedPlans(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[3] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertIsNone(self.full_scan.match(step), f"{url}: {query['sql']}\n{plan}")
+                self.assertNotIn("TEMP B-TREE", step, f"{url}: {query['sql']}\n{plan}")
+        return response
+
+    def test_home(self):
+        response = self.assertIndexedPlans(reverse("tweets:home"))
+        self.assertIndexedPlans(reverse("tweets:home"), {"cursor": response.context["page_obj"].next_cursor})
+        self.assertIndexedPlans(reverse("tweets:home"), {"feed": "following"})
+
+    def test_user_profile(self):
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        response = self.assertIndexedPlans(url)
+        self.assertIndexedPlans(url, {"cursor": response.context["page_obj"].next_cursor})
+
+    def test_follow_lists(self):
+        self.assertIndexedPlans(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
+        self.assertIndexedPlans(reverse("accounts:following_list", kwargs={"username": self.user.username}))
+
+    def test_tweet_detail(self):
+        self.assertIndexedPlans(reverse("tweets:detail", kwargs={"pk": Tweet.objects.first().pk}))
+
+
+class TestFollowingFeed(TestCase):
+    def setUp(self):
+        self.url = reverse("tweets:home")
+        self.user = User.objects.create_user(username="reader", email="reader@email.com", password="testpass0000")
+        self.author = User.objects.create_user(username="author", email="author@email.com", password="testpass0000")
+        self.stranger = User.objects.create_user(
+            username="stranger", email="stranger@email.com", password="testpass0000"
+        )
+        self.user.follow(self.author)
+
+    def post_tweet(self, user, content):
+        self.client.force_login(user)
+        self.client.post(reverse("tweets:create"), {"content": content})
+        return Tweet.objects.get(user=user, content=content)
+
+    def get_feed(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {"feed": "following"})
+        self.assertEqual(response.status_code, 200)
+        return [tweet.pk for tweet in response.context["tweet_list"]]
+
+    def test_fan_out_on_create(self):
+        tweet = self.post_tweet(self.author, "hello followers")
+        self.post_tweet(self.stranger, "nobody follows me")
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.author, tweet=tweet).exists())
+        self.assertEqual(self.get_feed(), [tweet.pk])
+
+    def test_delete_removes_entries(self):
+        tweet = self.post_tweet(self.author, "soon deleted")
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertFalse(TimelineEntry.objects.filter(tweet_id=tweet.pk).exists())
+        self.assertEqual(self.get_feed(), [])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_fan_out_on_read_for_large_accounts(self):
+        tweet = self.post_tweet(self.author, "too many followers")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+        self.assertEqual(self.get_feed(), [tweet.pk])
+
+    def test_follow_and_unfollow_update_timeline(self):
+        tweet = self.post_tweet(self.stranger, "before follow")
+        self.client.force_login(self.user)
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.stranger.username}))
+        self.assertEqual(self.get_feed(), [tweet.pk])
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": self.stranger.username}))
+        self.assertEqual(self.get_feed(), [])
+
+    def test_bulk_follow_then_backfill(self):
+        tweet = Tweet.objects.create(user=self.stranger, content="before follow")
+        Follow.objects.bulk_follow([(self.user.pk, self.stranger.pk)])
+        self.assertEqual(self.get_feed(), [])
+        backfill_follows([(self.user.pk, self.stranger.pk)])
+        self.assertEqual(self.get_feed(), [tweet.pk])
+
+    def test_rebuild_timelines_command(self):
+        # 受信箱ができる前からあるフォローとツイート
+        tweets = [Tweet.objects.create(user=self.author, content=f"old {i}") for i in range(3)]
+        Follow.objects.bulk_follow([(self.stranger.pk, self.author.pk)])
+        TimelineEntry.objects.all().delete()
+        with self.settings(FEED_BACKFILL_SIZE=2):
+            call_command("rebuild_timelines", "--batch-size", "1", stdout=StringIO())
+        recent = {tweets[2].pk, tweets[1].pk}
+        for owner in [self.user, self.author, self.stranger]:
+            self.assertEqual(set(TimelineEntry.objects.filter(owner=owner).values_list("tweet_id", flat=True)), recent)
+        self.assertEqual(self.get_feed(), [tweets[2].pk, tweets[1].pk])
+
+    def test_migration_backfills_existing_follows(self):
+        tweets = [Tweet.objects.create(user=self.author, content=f"old {i}") for i in range(3)]
+        own = Tweet.objects.create(user=self.user, content="mine")
+        TimelineEntry.objects.all().delete()
+        migration = importlib.import_module("tweets.migrations.0003_timelineentry")
+        migration.backfill_timelines(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.get_feed(), [own.pk, tweets[2].pk, tweets[1].pk, tweets[0].pk])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.stranger).exists())
+
+
+@override_settings(TIMELINE_PAGE_SIZE=3)
+class TestTimelineApi(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="hoge@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(5)]
+        self.url = reverse("tweets:api_home")
+
+    def test_success_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([tweet["id"] for tweet in data["tweets"]], [t.pk for t in self.tweets[:1:-1]])
+        self.assertEqual(data["tweets"][0]["user"], "test")
+        self.assertIsNotNone(data["next_cursor"])
+        self.assertTrue(response["ETag"].startswith('W/"'))
+
+        response = self.client.get(self.url, {"cursor": data["next_cursor"]})
+        self.assertEqual([tweet["id"] for tweet in response.json()["tweets"]], [t.pk for t in self.tweets[1::-1]])
+
+    def test_not_modified_without_serialising(self):
+        etag = self.client.get(self.url)["ETag"]
+        # session, ログインユーザー, ページのバージョン列, いいね済みか
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_etag_changes_with_likes_and_edits(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.tweets[-1].add_like(self.user)
+        liked = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(liked.status_code, 200)
+        self.assertTrue(liked.json()["tweets"][0]["liked"])
+
+        self.tweets[-1].save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=liked["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+        # 投稿者名が変わってもツイートの updated_at は変わらない
+        User.objects.filter(pk=self.user.pk).update(username="renamed")
+        renamed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.json()["tweets"][0]["user"], "renamed")
+
+    def test_detail(self):
+        url = reverse("tweets:api_detail", kwargs={"pk": self.tweets[0].pk})
+        response = self.client.get(url)
+        self.assertEqual(response.json()["content"], "tweet 0")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse("tweets:api_detail", kwargs={"pk": 0})).status_code, 404)
+
+    def test_detail_deleted_while_reading(self):
+        tweet = self.tweets[0]
+        url = reverse("tweets:api_detail", kwargs={"pk": tweet.pk})
+        with mock.patch("tweets.api.overlay_pending_likes", side_effect=lambda *args: tweet.delete()):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_failure_get_without_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class TestLiveStream(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", email="viewer@email.com", password="testpass0000")
+        self.other = User.objects.create_user(username="other", email="other@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+
+    def connect(self, query_string=b""):
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        scope = {
+            "type": "http",
+            "path": STREAM_PATH,
+            "query_string": query_string,
+            "headers": [(b"cookie", cookie.encode())],
+        }
+        return ApplicationCommunicator(stream_application, scope)
+
+    @sync_to_async
+    def commit(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            return func()
+
+    async def test_streams_tweets_and_likes(self):
+        communicator = self.connect()
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output()
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        self.assertEqual((await communicator.receive_output())["body"], b"retry: 3000\n\n")
+
+        tweet = await self.commit(lambda: Tweet.objects.create(user=self.other, content="こんにちは"))
+        body = (await communicator.receive_output())["body"].decode()
+        self.assertTrue(body.startswith("event: tweet\n"))
+        self.assertIn('"content":"こんにちは"', body)
+
+        # 自分のいいねは送らず、他人のいいねは増減を送る
+        await self.commit(lambda: tweet.add_like(self.user))
+        await self.commit(lambda: tweet.add_like(self.other))
+        body = (await communicator.receive_output())["body"].decode()
+        self.assertEqual(body, f'event: likes\ndata: {{"deltas":{{"{tweet.pk}":1}}}}\n\n')
+
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait()
+
+    async def test_following_feed_only_streams_followees(self):
+        stranger = await sync_to_async(User.objects.create_user)(
+            username="stranger", email="stranger@email.com", password="testpass0000"
+        )
+        await sync_to_async(self.user.follow)(self.other)
+        communicator = self.connect(b"feed=following")
+        await communicator.send_input({"type": "http.request"})
+        await communicator.receive_output()
+        await communicator.receive_output()
+
+        await self.commit(lambda: Tweet.objects.create(user=stranger, content="stranger"))
+        await self.commit(lambda: Tweet.objects.create(user=self.other, content="followee"))
+        body = (await communicator.receive_output())["body"].decode()
+        self.assertIn('"content":"followee"', body)
+
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait()
+
+    def test_url(self):
+        # テンプレートの {% url 'tweets:stream' %} が route_stream の振り分けるパスと一致すること
+        self.assertEqual(reverse("tweets:stream"), STREAM_PATH)
+        # Djangoまで来たとき (WSGI) は配信できないので 404
+        self.assertEqual(self.client.get(STREAM_PATH).status_code, 404)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, f'data-stream-url="{STREAM_PATH}"')
+        self.assertContains(response, f'data-likes-url="{reverse("tweets:like_batch")}"')
+
+    async def test_failure_without_login(self):
+        await sync_to_async(self.client.logout)()
+        communicator = ApplicationCommunicator(
+            stream_application, {"type": "http", "path": STREAM_PATH, "query_string": b"", "headers": []}
+        )
+        await communicator.send_input({"type": "http.request"})
+        self.assertEqual((await communicator.receive_output())["status"], 403)
+        await communicator.wait()
+
+
+@override_settings(TIMELINE_PAGE_SIZE=3)
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="hoge@email.com", password="testpass0000")
+        self.other = User.objects.create_user(username="other", email="other@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.user.follow(self.other)
+        self.tweets = [Tweet.objects.create(user=user, content="tweet") for user in [self.user, self.other] * 3]
+        self.tweets[0].add_like(self.user)
+        for tweet in self.tweets:
+            TimelineEntry.objects.create(owner=self.user, tweet=tweet, created_at=tweet.created_at)
+
+    def assertSameTimeline(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        response = self.client.get(async_url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/home.html")
+        self.assertEqual(
+            [(t.pk, t.is_liked, t.like_count) for t in response.context["object_list"]],
+            [(t.pk, t.is_liked, t.like_count) for t in expected.context["object_list"]],
+        )
+        self.assertEqual(response.context["page_obj"].next_cursor, expected.context["page_obj"].next_cursor)
+        return response
+
+    def test_home(self):
+        response = self.assertSameTimeline(reverse("tweets:home"), reverse("tweets:async_home"))
+        cursor = response.context["page_obj"].next_cursor
+        self.assertSameTimeline(reverse("tweets:home"), reverse("tweets:async_home"), {"cursor": cursor})
+        self.assertSameTimeline(reverse("tweets:home"), reverse("tweets:async_home"), {"feed": "following"})
+        self.assertEqual(self.client.get(reverse("tweets:async_home"), {"cursor": "invalid"}).status_code, 404)
+
+    def test_detail(self):
+        response = self.client.get(reverse("tweets:async_detail", kwargs={"pk": self.tweets[0].pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet"], self.tweets[0])
+        self.assertTrue(response.context["is_liked"])
+        self.assertEqual(self.client.get(reverse("tweets:async_detail", kwargs={"pk": 0})).status_code, 404)
+
+    def test_failure_get_without_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("tweets:async_home"))
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={reverse('tweets:async_home')}")
+
+
 class TestTweetCreateView(TestCase):
     def setUp(self):
         self.create_url = reverse("tweets:create")
@@ -109,6 +561,8 @@ class TestLikeView(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(self.tweet.liked_by.count(), 1)
         self.assertEqual(self.tweet.liked_by.first(), self.user)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         res = self.client.post(
@@ -126,6 +580,13 @@ class TestLikeView(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(self.tweet.liked_by.count(), 1)
 
+    def test_like_count_not_inflated_by_duplicate_likes(self):
+        url = reverse("tweets:like", kwargs={"pk": self.tweet.id})
+        self.client.post(url)
+        self.client.post(url)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
 
 class TestUnlikeView(TestCase):
     def setUp(self):
@@ -151,6 +612,8 @@ class TestUnlikeView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(self.tweet.liked_by.count(), 0)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         res = self.client.post(
@@ -166,3 +629,455 @@ class TestUnlikeView(TestCase):
         )
         self.assertEqual(res.status_code, 200)
         self.assertEqual(self.tweet.liked_by.count(), 0)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        self.url = reverse("tweets:like_batch")
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="@0dg8gwO7_0Gw")
+        self.other = User.objects.create_user(username="other", email="other@example.com", password="@0dg8gwO7_0Gw")
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet {i}") for i in range(3)]
+        self.tweets[1].add_like(self.user)
+        self.tweets[1].add_like(self.other)
+        self.client.force_login(self.user)
+
+    def post(self, operations):
+        return self.client.post(self.url, {"operations": operations}, content_type="application/json")
+
+    def test_success_post(self):
+        operations = [
+            {"tweet_id": self.tweets[0].pk, "liked": True},
+            {"tweet_id": self.tweets[1].pk, "liked": False},
+            # 同じツイートへの連打は最後の操作だけが効く
+            {"tweet_id": self.tweets[2].pk, "liked": True},
+            {"tweet_id": self.tweets[2].pk, "liked": False},
+            {"tweet_id": 999, "liked": True},
+        ]
+        # session, ユーザー, ツイートの存在確認, INSERT, DELETE, 件数の更新と読み込み (+ SAVEPOINT/RELEASE)
+        with self.assertNumQueries(9):
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200)
+        result = {tweet["tweet_id"]: tweet for tweet in response.json()["tweets"]}
+        self.assertEqual(result[self.tweets[0].pk], {"tweet_id": self.tweets[0].pk, "liked": True, "like_count": 1})
+        self.assertEqual(result[self.tweets[1].pk], {"tweet_id": self.tweets[1].pk, "liked": False, "like_count": 1})
+        self.assertEqual(result[self.tweets[2].pk]["like_count"], 0)
+        self.assertNotIn(999, result)
+        self.assertEqual(set(self.user.liking.values_list("pk", flat=True)), {self.tweets[0].pk})
+
+    def test_repeated_like_does_not_inflate(self):
+        for _ in range(2):
+            response = self.post([{"tweet_id": self.tweets[1].pk, "liked": True}])
+        self.assertEqual(response.json()["tweets"][0]["like_count"], 2)
+
+    def test_failure_post_with_invalid_body(self):
+        response = self.client.post(self.url, "not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"tweet_id": "x", "liked": True}])
+        self.assertEqual(response.status_code, 400)
+        for liked in ["false", 0, None]:
+            response = self.post([{"tweet_id": self.tweets[0].pk, "liked": liked}])
+            self.assertEqual(response.status_code, 400)
+        response = self.post({"tweet_id": self.tweets[0].pk, "liked": True})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LIKE_BATCH_MAX_OPERATIONS=1)
+    def test_failure_post_with_too_many_operations(self):
+        response = self.post([{"tweet_id": tweet.pk, "liked": True} for tweet in self.tweets])
+        self.assertEqual(response.status_code, 400)
+        # 同じツイートへの操作でも、まとめる前の数で断る
+        response = self.post([{"tweet_id": self.tweets[0].pk, "liked": True}] * 2)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(LIKES_WRITE_BEHIND=True)
+class TestWriteBehindLikes(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="@0dg8gwO7_0Gw")
+        self.other = User.objects.create_user(username="other", email="other@example.com", password="@0dg8gwO7_0Gw")
+        self.tweet = Tweet.objects.create(user=self.user, content="Hello, world!")
+        self.tweet.add_like(self.other)
+        self.client.force_login(self.user)
+
+    def like(self, user, liked):
+        self.client.force_login(user)
+        self.client.post(reverse("tweets:like" if liked else "tweets:unlike", kwargs={"pk": self.tweet.pk}))
+
+    def get_home_tweet(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse("tweets:home")).context["tweet_list"][0]
+
+    def test_pending_likes_are_visible_before_flush(self):
+        self.like(self.user, True)
+        self.like(self.other, False)
+        self.assertEqual(self.tweet.liked_by.count(), 1)
+        self.assertEqual(PendingLike.objects.count(), 2)
+        mine = self.get_home_tweet(self.user)
+        self.assertEqual((mine.like_count, mine.is_liked), (1, True))
+        theirs = self.get_home_tweet(self.other)
+        self.assertEqual((theirs.like_count, theirs.is_liked), (1, False))
+
+    def test_flush_collapses_and_applies(self):
+        self.like(self.user, True)
+        self.like(self.user, False)
+        self.like(self.user, True)
+        self.like(self.other, False)
+        self.like(self.other, True)
+        call_command("flush_likes", "--batch-size", "2", stdout=StringIO())
+        self.assertFalse(PendingLike.objects.exists())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 2)
+        self.assertEqual(set(self.tweet.liked_by.all()), {self.user, self.other})
+
+    def test_batch_view_returns_pending_counts(self):
+        response = self.client.post(
+            reverse("tweets:like_batch"),
+            {"operations": [{"tweet_id": self.tweet.pk, "liked": True}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["tweets"][0]["like_count"], 2)
+        self.assertEqual(self.tweet.liked_by.count(), 1)
+
+    def test_pending_deltas_use_latest_operation(self):
+        other_tweet = Tweet.objects.create(user=self.other, content="Hi")
+        self.like(self.user, True)
+        self.like(self.user, False)
+        self.like(self.user, True)
+        self.like(self.other, False)
+        self.like(self.other, True)
+        PendingLike.objects.create(user=self.user, tweet=other_tweet, liked=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_pending_deltas([self.tweet.pk]), {self.tweet.pk: 1})
+        self.like(self.other, False)
+        self.assertEqual(get_pending_deltas([self.tweet.pk, other_tweet.pk]), {other_tweet.pk: 1})
+
+
+class TestRebuildLikeCountsCommand(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="@0dg8gwO7_0Gw")
+        self.tweet = Tweet.objects.create(user=self.user, content="Hello, world!")
+        self.tweet.liked_by.add(self.user)
+
+    def test_check_fails_then_rebuild_fixes(self):
+        with self.assertRaises(CommandError):
+            call_command("rebuild_like_counts", "--check", stdout=StringIO())
+        call_command("rebuild_like_counts", stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+        call_command("rebuild_like_counts", "--check", stdout=StringIO())
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestTweetSearch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="hoge@email.com", password="testpass0000")
+        self.other = User.objects.create_user(username="other", email="other@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.tokyo = Tweet.objects.create(user=self.user, content="東京都庁に行った")
+        self.kyoto = Tweet.objects.create(user=self.other, content="京都タワーを見た")
+        self.both = Tweet.objects.create(user=self.other, content="東京から京都へ。京都は暑い！")
+        self.english = Tweet.objects.create(user=self.user, content="Hello, ＷＯＲＬＤ")
+
+    def search(self, **params):
+        response = self.client.get(reverse("tweets:api_search"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, **params):
+        return [tweet["id"] for tweet in self.search(**params)["tweets"]]
+
+    def test_japanese(self):
+        self.assertEqual(set(self.ids(q="京都")), {self.kyoto.pk, self.both.pk})
+        # 「東京都」は「東京」「京都」の並びとして探す
+        self.assertEqual(self.ids(q="東京都"), [self.tokyo.pk])
+        # 1文字は前方一致
+        self.assertEqual(set(self.ids(q="暑")), {self.both.pk})
+        self.assertEqual(self.ids(q="京都 暑い"), [self.both.pk])
+        self.assertEqual(self.ids(q="大阪"), [])
+
+    def test_normalization(self):
+        self.assertEqual(self.ids(q="world"), [self.english.pk])
+        self.assertEqual(self.ids(q="ｈｅｌｌｏ!"), [self.english.pk])
+
+    def test_ranked_and_paginated(self):
+        first = self.search(q="京")
+        # 「京」を多く含むツイートが先
+        self.assertEqual(first["tweets"][0]["id"], self.both.pk)
+        self.assertGreaterEqual(first["tweets"][0]["score"], first["tweets"][1]["score"])
+        second = self.search(q="京", cursor=first["next_cursor"])
+        self.assertIsNone(second["next_cursor"])
+        ids = [tweet["id"] for tweet in first["tweets"] + second["tweets"]]
+        self.assertEqual(sorted(ids), sorted([self.tokyo.pk, self.kyoto.pk, self.both.pk]))
+
+    def test_scores_match_tweets_after_deletion(self):
+        scores = {tweet["id"]: tweet["score"] for tweet in self.search(q="京")["tweets"]}
+        both_pk = self.both.pk
+        # ページを読んだ後に先頭のツイートが削除されても、残りのツイートには自分のスコアが付く
+        with mock.patch("tweets.api.overlay_pending_likes", side_effect=lambda *args: self.both.delete()):
+            (tweet,) = self.search(q="京")["tweets"]
+        self.assertNotEqual(tweet["id"], both_pk)
+        self.assertEqual(tweet["score"], scores[tweet["id"]])
+        self.assertNotEqual(tweet["score"], scores[both_pk])
+
+    def test_filter_by_author(self):
+        self.assertEqual(set(self.ids(q="京都", user="other")), {self.kyoto.pk, self.both.pk})
+        # 「東京都」も「京都」を含む
+        self.assertEqual(self.ids(q="京都", user="test"), [self.tokyo.pk])
+
+    def test_index_follows_tweets(self):
+        self.tokyo.content = "大阪城に行った"
+        self.tokyo.save()
+        self.assertEqual(self.ids(q="東京都"), [])
+        self.assertEqual(self.ids(q="大阪"), [self.tokyo.pk])
+        self.tokyo.delete()
+        self.assertEqual(self.ids(q="大阪"), [])
+
+    def test_view(self):
+        response = self.client.get(reverse("tweets:search"), {"q": "京都"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["object_list"]), 2)
+        self.assertTrue(response.context["page_obj"].has_next())
+        self.assertContains(response, "京都タワーを見た")
+
+        self.assertEqual(self.client.get(reverse("tweets:search"), {"q": "京都", "cursor": "x"}).status_code, 404)
+        self.assertEqual(self.client.get(reverse("tweets:search")).status_code, 200)
+
+    def test_rebuild_command(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content="名古屋の味噌カツ")])
+        self.assertEqual(self.ids(q="名古屋"), [])
+        stdout = StringIO()
+        call_command("rebuild_search_index", "--batch-size", "2", stdout=stdout)
+        self.assertIn("5 件", stdout.getvalue())
+        self.assertEqual(len(self.ids(q="名古屋")), 1)
+        self.assertEqual(set(self.ids(q="京都")), {self.kyoto.pk, self.both.pk})
+
+    def test_unavailable(self):
+        with mock.patch("tweets.search._connection", return_value=None):
+            self.assertEqual(self.client.get(reverse("tweets:api_search"), {"q": "京都"}).status_code, 501)
+            response = self.client.get(reverse("tweets:search"), {"q": "京都"})
+        self.assertContains(response, "検索を使えません")
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2, TRENDING_HALF_LIFE=60 * 60)
+class TestTrending(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@email.com", password="testpass0000")
+            for i in range(4)
+        ]
+        self.client.force_login(self.users[0])
+        self.tweets = [Tweet.objects.create(user=self.users[0], content=f"tweet {i}") for i in range(3)]
+        self.start = timezone.now()
+        # マイグレーションが作る位置 (いいねがなければ 0)
+        Watermark.objects.get_or_create(name=WATERMARK)
+
+    def like(self, tweet, count):
+        for user in self.users[:count]:
+            tweet.add_like(user)
+
+    def scores(self, now):
+        return {row.tweet_id: current_weight(row.score, now) for row in TrendingScore.objects.all()}
+
+    def test_decay(self):
+        self.like(self.tweets[0], 2)
+        self.assertEqual(update_trending(now=self.start), 2)
+        self.assertAlmostEqual(self.scores(self.start)[self.tweets[0].pk], 2)
+        # 半減期の後の1件は、前の2件の半分と合わせて2件分になる
+        later = self.start + timedelta(hours=1)
+        self.like(self.tweets[1], 1)
+        self.tweets[0].add_like(self.users[2])
+        self.assertEqual(update_trending(now=later), 2)
+        scores = self.scores(later)
+        self.assertAlmostEqual(scores[self.tweets[0].pk], 2)
+        self.assertAlmostEqual(scores[self.tweets[1].pk], 1)
+
+    def test_incremental(self):
+        self.like(self.tweets[0], 1)
+        update_trending(batch_size=1, now=self.start)
+        self.assertEqual(update_trending(now=self.start), 0)
+        self.like(self.tweets[1], 3)
+        self.assertEqual(update_trending(batch_size=2, now=self.start), 3)
+        last_like = Tweet.liked_by.through.objects.latest("pk")
+        self.assertEqual(Watermark.objects.get(name=WATERMARK).last_id, last_like.pk)
+
+    def test_existing_likes_are_skipped(self):
+        # いいねがある状態で導入したとき、今までのいいねを全部いまのいいねとして数えない
+        self.like(self.tweets[0], 3)
+        Watermark.objects.all().delete()
+        migration = importlib.import_module("tweets.migrations.0008_trending_score")
+        migration.seed_watermark(apps, None)
+        last_like = Tweet.liked_by.through.objects.latest("pk")
+        self.assertEqual(Watermark.objects.get(name=WATERMARK).last_id, last_like.pk)
+        self.assertEqual(update_trending(now=self.start), 0)
+        self.assertFalse(TrendingScore.objects.exists())
+
+        # 位置の行が消えていても、同じく最後のいいねから始める
+        Watermark.objects.all().delete()
+        self.assertEqual(update_trending(now=self.start), 0)
+        self.assertEqual(Watermark.objects.get(name=WATERMARK).last_id, last_like.pk)
+        self.like(self.tweets[1], 1)
+        self.assertEqual(update_trending(now=self.start), 1)
+        self.assertEqual(list(TrendingScore.objects.values_list("tweet_id", flat=True)), [self.tweets[1].pk])
+
+    def test_late_commits_are_counted_once(self):
+        # IDを採番した後、大きいIDのいいねより遅れてコミットされたいいね
+        self.like(self.tweets[0], 3)
+        Like = Tweet.liked_by.through
+        late = Like.objects.order_by("pk")[1]
+        late_pk = late.pk
+        late.delete()
+        self.assertEqual(update_trending(now=self.start), 2)
+        self.assertEqual(list(Watermark.objects.get(name=WATERMARK).gaps), [str(late_pk)])
+        Like.objects.create(pk=late_pk, tweet_id=late.tweet_id, user_id=late.user_id)
+        self.assertEqual(update_trending(now=self.start), 1)
+        self.assertEqual(update_trending(now=self.start), 0)
+        self.assertAlmostEqual(self.scores(self.start)[self.tweets[0].pk], 3)
+
+        # TRENDING_GAP_SECONDS たっても現れないIDは忘れる
+        self.like(self.tweets[1], 3)
+        Like.objects.filter(tweet=self.tweets[1]).order_by("pk")[1].delete()
+        update_trending(now=self.start)
+        later = self.start + timedelta(seconds=settings.TRENDING_GAP_SECONDS + 1)
+        self.assertEqual(update_trending(now=later), 0)
+        self.assertEqual(Watermark.objects.get(name=WATERMARK).gaps, {})
+
+    def test_prune(self):
+        self.like(self.tweets[0], 1)
+        update_trending(now=self.start)
+        # 1件のいいねは 0.1 件分まで減ると消える (半減期4回分)
+        update_trending(now=self.start + timedelta(hours=3))
+        self.assertEqual(TrendingScore.objects.count(), 1)
+        update_trending(now=self.start + timedelta(hours=4))
+        self.assertEqual(TrendingScore.objects.count(), 0)
+
+    def test_view(self):
+        self.like(self.tweets[1], 3)
+        self.like(self.tweets[2], 2)
+        self.like(self.tweets[0], 1)
+        call_command("update_trending", stdout=StringIO())
+        self.tweets[0].delete()
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual(response.context["object_list"], [self.tweets[1], self.tweets[2]])
+        self.assertFalse(response.context["page_obj"].has_next())
+        self.assertContains(response, "tweet 1")
+        self.assertEqual(self.client.get(reverse("tweets:trending"), {"cursor": "x"}).status_code, 404)
+
+    def test_query_plan(self):
+        queryset = TrendingScore.objects.order_by("-score", "-tweet_id")[:10]
+        self.assertIn("trending_score_idx", queryset.explain())
+
+
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    """どのビューも、表示する行の数によらず一定のクエリ数で応答すること。"""
+
+    urls_module = tweets_urls
+    # session とログインユーザーの2回を含む。フォロー中タイムラインは受信箱と fan-out-on-read の分、
+    # 書き込み遅延モードは反映前のいいねを読む分だけ多い。ツイートの作成・削除は検索の索引の更新を含み、
+    # 削除はトレンドのスコアの削除も含む
+    query_budgets = {
+        "home": 7,
+        "create": 2,
+        "create:post": 6,
+        "detail": 4,
+        "delete:post": 10,
+        "like:post": 9,
+        "unlike:post": 7,
+        "like_batch:post": 9,
+        "api_home": 7,
+        "api_detail": 5,
+        "search": 7,
+        "api_search": 7,
+        "trending": 7,
+        "stream": 0,
+        "async_home": 6,
+        "async_detail": 4,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", email="viewer@email.com", password="testpass0000")
+        self.client.force_login(self.user)
+        self.users = []
+        self.tweets = []
+        self.grow()
+
+    def grow(self, count=3):
+        """ユーザー・フォロー・ツイート・いいね・受信箱の行を count ずつ増やす。"""
+        start = len(self.users)
+        for i in range(start, start + count):
+            user = User.objects.create_user(username=f"user{i}", email=f"user{i}@email.com", password="testpass0000")
+            user.follow(self.user)
+            self.user.follow(user)
+            self.users.append(user)
+            tweet = Tweet.objects.create(user=user, content=f"tweet {i}")
+            fan_out_tweet(tweet)
+            self.tweets.append(tweet)
+        for user in self.users:
+            for tweet in self.tweets[-count:]:
+                tweet.add_like(user)
+        PendingLike.objects.create(user=self.users[-1], tweet=self.tweets[-1], liked=True)
+
+    def test_every_view_has_budget(self):
+        self.assertEveryViewHasBudget()
+
+    def test_timelines(self):
+        for name in ["home", "api_home", "async_home"]:
+            for params in [{}, {"feed": "following"}]:
+                with self.subTest(name=name, params=params):
+                    self.assertNoNPlusOne(name, lambda: self.client.get(reverse(f"tweets:{name}"), params), self.grow)
+
+    @override_settings(LIKES_WRITE_BEHIND=True)
+    def test_timelines_with_write_behind(self):
+        self.assertNoNPlusOne("home", lambda: self.client.get(reverse("tweets:home")), self.grow)
+
+    def test_search(self):
+        for name in ["search", "api_search"]:
+            with self.subTest(name=name):
+                url = reverse(f"tweets:{name}")
+                self.assertNoNPlusOne(name, lambda: self.client.get(url, {"q": "tweet"}), self.grow)
+
+    def test_trending(self):
+        def grow():
+            self.grow()
+            update_trending()
+
+        update_trending()
+        self.assertNoNPlusOne("trending", lambda: self.client.get(reverse("tweets:trending")), grow)
+
+    def test_detail(self):
+        tweet = self.tweets[0]
+        for name in ["detail", "api_detail", "async_detail"]:
+            with self.subTest(name=name):
+                url = reverse(f"tweets:{name}", kwargs={"pk": tweet.pk})
+                self.assertNoNPlusOne(name, lambda: self.client.get(url), self.grow)
+
+    def test_create(self):
+        self.assertQueryBudget("create", lambda: self.client.get(reverse("tweets:create")))
+        post = lambda: self.client.post(reverse("tweets:create"), {"content": "hello"})  # noqa: E731
+        self.assertNoNPlusOne("create:post", post, self.grow)
+
+    def test_delete(self):
+        def delete():
+            tweet = Tweet.objects.create(user=self.user, content="to delete")
+            fan_out_tweet(tweet)
+            for user in self.users:
+                tweet.add_like(user)
+            self.assertQueryBudget("delete:post", lambda: self.client.post(reverse("tweets:delete", args=[tweet.pk])))
+
+        delete()
+        self.grow()
+        delete()
+
+    def test_like_and_unlike(self):
+        tweet = self.tweets[0]
+        self.assertQueryBudget("like:post", lambda: self.client.post(reverse("tweets:like", args=[tweet.pk])))
+        self.assertQueryBudget("unlike:post", lambda: self.client.post(reverse("tweets:unlike", args=[tweet.pk])))
+
+    def test_like_batch(self):
+        def post():
+            operations = [{"tweet_id": tweet.pk, "liked": i % 2 == 0} for i, tweet in enumerate(self.tweets)]
+            self.client.post(
+                reverse("tweets:like_batch"), json.dumps({"operations": operations}), content_type="application/json"
+            )
+
+        self.assertNoNPlusOne("like_batch:post", post, self.grow)
@@ -0,0 +1,153 @@
+"""
+トレンド (いいねが最近集まっているツイート)。
+
+いいね1件の重みを、半減期 TRENDING_HALF_LIFE で時間とともに減らし、その合計で並べる。
+合計を直接持つと時間がたつたびに全行を書き換えることになるので、基準の日時 EPOCH からの経過で重みを表して log で持つ。
+
+    score = log(Σ exp((いいねの日時 - EPOCH) / τ))    τ = TRENDING_HALF_LIFE / log(2)
+
+いま時点の重みの合計は exp(score - (いま - EPOCH) / τ) で、どのツイートにも同じ係数が掛かるので score の順がそのまま順位になる。
+update_trending コマンドが、前回読んだ位置 (Watermark) より後の liked_by の行だけを読んでスコアに足し込む。
+位置はマイグレーションで、その時点の最後のいいねにしておく。既存のいいねを全部「今」のいいねとして数えないため。
+IDは挿入時に採番されるので、PostgreSQL などではIDの小さいいいねが後からコミットされることがある。
+読んだときに抜けていたIDは Watermark.gaps に残し、TRENDING_GAP_SECONDS の間は次の回に読み直す。
+中間テーブルにはいいねの日時がないので、読んだ日時をいいねの日時として扱う。取り消されたいいねは減衰で消えるのを待つ。
+トレンドのページは TrendingScore を (score, tweet) の索引で上から読むだけにする。
+"""
+
+import datetime
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from tweets.models import TrendingScore, Tweet, Watermark
+from tweets.pagination import KeysetPaginator
+
+Like = Tweet.liked_by.through
+
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+WATERMARK = "trending"
+# Watermark.gaps に残すIDの数の上限 (新しいものから残す)
+MAX_GAPS = 10000
+
+
+def decay_exponent(when):
+    """when に付いたいいね1件の、score での値。"""
+    return (when - EPOCH).total_seconds() * math.log(2) / settings.TRENDING_HALF_LIFE
+
+
+def current_weight(score, now=None):
+    """score のいま時点の重みの合計 (減衰させたいいねの数)。"""
+    return math.exp(score - decay_exponent(now or timezone.now()))
+
+
+def _log_add(a, b):
+    """log(exp(a) + exp(b)) を桁あふれさせずに求める。"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def latest_like_id():
+    return Like.objects.aggregate(last_id=Max("pk"))["last_id"] or 0
+
+
+def _add_to_scores(likes, exponent):
+    """(いいねのID, ツイートID) の組をスコアに足し込む。"""
+    counts = Counter(tweet_id for _, tweet_id in likes)
+    # 読んでいる間に削除されたツイートは除き、今のスコアも同じ検索で読む
+    scores = Tweet.objects.filter(pk__in=counts).values_list("pk", "trending_score__score")
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(tweet_id=pk, score=_log_add(score, exponent + math.log(counts[pk]))) for pk, score in scores],
+        update_conflicts=True,
+        unique_fields=["tweet"],
+        update_fields=["score"],
+    )
+
+
+def _find_gaps(last_id, ids):
+    """last_id の次から昇順の ids の最後までで、ids にないID (新しいものから MAX_GAPS 件まで)。"""
+    gaps = []
+    previous = last_id
+    for pk in ids:
+        gaps.extend(range(max(previous + 1, pk - MAX_GAPS), pk))
+        previous = pk
+    return gaps[-MAX_GAPS:]
+
+
+def _replay_gaps(now, exponent):
+    """前の回に抜けていたIDのうち、その後コミットされたいいねをスコアに足し込み、その数を返す。"""
+    with transaction.atomic():
+        watermark = Watermark.objects.select_for_update().filter(name=WATERMARK).first()
+        if watermark is None or not watermark.gaps:
+            return 0
+        likes = list(Like.objects.filter(pk__in=[int(pk) for pk in watermark.gaps]).values_list("pk", "tweet_id"))
+        if likes:
+            _add_to_scores(likes, exponent)
+        found = {str(pk) for pk, _ in likes}
+        # ロールバックされたり、すぐ削除されたりしたいいねのIDはいつまでも現れないので忘れる
+        expires = (now - datetime.timedelta(seconds=settings.TRENDING_GAP_SECONDS)).timestamp()
+        watermark.gaps = {pk: seen for pk, seen in watermark.gaps.items() if pk not in found and seen >= expires}
+        watermark.save()
+    return len(likes)
+
+
+def update_trending(batch_size=1000, now=None):
+    """前回の続きから liked_by を batch_size 行ずつ読んでスコアに足し込み、読んだいいねの数を返す。"""
+    now = now or timezone.now()
+    exponent = decay_exponent(now)
+    processed = _replay_gaps(now, exponent)
+    while True:
+        with transaction.atomic():
+            # 位置がなければ最後のいいねから始め、今あるいいねはスコアに入れない
+            watermark, _ = Watermark.objects.select_for_update().get_or_create(
+                name=WATERMARK, defaults={"last_id": latest_like_id}
+            )
+            likes = list(
+                Like.objects.filter(pk__gt=watermark.last_id).order_by("pk").values_list("pk", "tweet_id")[:batch_size]
+            )
+            if not likes:
+                break
+            _add_to_scores(likes, exponent)
+            gaps = _find_gaps(watermark.last_id, [pk for pk, _ in likes])
+            if gaps:
+                watermark.gaps.update((str(pk), now.timestamp()) for pk in gaps)
+                watermark.gaps = dict(sorted(watermark.gaps.items(), key=lambda item: int(item[0]))[-MAX_GAPS:])
+            watermark.last_id = likes[-1][0]
+            watermark.save()
+        processed += len(likes)
+    prune(now)
+    return processed
+
+
+def prune(now=None):
+    """重みが TRENDING_MIN_SCORE を下回ったツイートを消し、表を小さく保つ。消した件数を返す。"""
+    threshold = decay_exponent(now or timezone.now()) + math.log(settings.TRENDING_MIN_SCORE)
+    deleted, _ = TrendingScore.objects.filter(score__lt=threshold).delete()
+    return deleted
+
+
+def trending_queryset():
+    return TrendingScore.objects.select_related("tweet__user")
+
+
+class TrendingPaginator(KeysetPaginator):
+    """TrendingScore を (score, tweet_id) の降順でページ分割し、ページにはツイートを入れる。"""
+
+    def __init__(self, page_size):
+        super().__init__(page_size, keys=("score", "tweet_id"))
+
+    def _make_page(self, rows):
+        page = super()._make_page(rows)
+        now = timezone.now()
+        tweets = []
+        for row in page.object_list:
+            row.tweet.trending_weight = current_weight(row.score, now)
+            tweets.append(row.tweet)
+        page.object_list = tweets
+        return page
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, async_views, stream, views
 
 app_name = "tweets"
 urlpatterns = [
@@ -10,4 +10,15 @@ urlpatterns = [
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("likes/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("search/", views.TweetSearchView.as_view(), name="search"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
+    # ASGIでは mysite/asgi.py の route_stream が tweets.stream.STREAM_PATH を先に受け取る
+    path("stream/", stream.stream_view, name="stream"),
+    path("api/home/", api.HomeApiView.as_view(), name="api_home"),
+    path("api/<int:pk>/", api.TweetDetailApiView.as_view(), name="api_detail"),
+    path("api/search/", api.SearchApiView.as_view(), name="api_search"),
+    # 読み込み系の非同期版 (ASGIで動かす)
+    path("async/home/", async_views.AsyncHomeView.as_view(), name="async_home"),
+    path("async/<int:pk>/", async_views.AsyncTweetDetailView.as_view(), name="async_detail"),
 ]
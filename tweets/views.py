@@ -1,32 +1,69 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Exists, OuterRef
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.generic import DetailView, ListView, View
 
+from tweets.feed import FollowingFeedPaginator, fan_out_tweet
 from tweets.forms import TweetCreateForm
+from tweets.likes import like_tweet, overlay_pending_likes, set_likes
 from tweets.models import Tweet
+from tweets.search import SearchPaginator, search_available, search_tweets
+from tweets.timeline import TimelineMixin, resolve_liked
+from tweets.trending import TrendingPaginator, trending_queryset
 
 
-class HomeView(LoginRequiredMixin, ListView):
+class HomeView(LoginRequiredMixin, TimelineMixin, ListView):
     template_name = "tweets/home.html"
     model = Tweet
 
+    def get_feed(self):
+        # ?feed=following でフォロー中のユーザーのツイートだけを表示する
+        return "following" if self.request.GET.get("feed") == "following" else "all"
+
+    def get_cursor_paginator(self, page_size):
+        if self.get_feed() == "following":
+            return FollowingFeedPaginator(self.request.user, page_size)
+        return super().get_cursor_paginator(page_size)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["feed"] = self.get_feed()
+        return context
+
+
+class TweetSearchView(LoginRequiredMixin, TimelineMixin, ListView):
+    """?q= の語をすべて含むツイートを、合う順に表示する。?user= で投稿者を絞り込む。"""
+
+    template_name = "tweets/search.html"
+
     def get_queryset(self, **kwargs):
-        return (
-            Tweet.objects.select_related("user")
-            .prefetch_related("liked_by")
-            .order_by("-created_at")
-            .annotate(
-                like_counts=Count("liked_by"),
-                is_liked=Exists(
-                    Tweet.objects.filter(
-                        pk=OuterRef("pk"),
-                        liked_by=self.request.user,
-                    ),
-                ),
-            )
-        )
+        queryset = search_tweets(self.request.GET.get("q", ""), self.request.GET.get("user"))
+        return queryset.select_related("tweet__user")
+
+    def get_cursor_paginator(self, page_size):
+        return SearchPaginator(page_size)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.request.GET.get("q", "")
+        context["username"] = self.request.GET.get("user", "")
+        context["search_unavailable"] = not search_available()
+        return context
+
+
+class TrendingView(LoginRequiredMixin, TimelineMixin, ListView):
+    """最近いいねが集まっているツイートを、トレンドのスコアの順に表示する (tweets.trending)。"""
+
+    template_name = "tweets/trending.html"
+
+    def get_queryset(self, **kwargs):
+        return trending_queryset()
+
+    def get_cursor_paginator(self, page_size):
+        return TrendingPaginator(page_size)
 
 
 class TweetCreateView(LoginRequiredMixin, View):
@@ -38,7 +75,8 @@ class TweetCreateView(LoginRequiredMixin, View):
         form = TweetCreateForm(data=request.POST)
         if form.is_valid():
             content = form.cleaned_data.get("content")
-            Tweet.objects.create(user=request.user, content=content)
+            tweet = Tweet.objects.create(user=request.user, content=content)
+            fan_out_tweet(tweet)
             return redirect("tweets:home")
         return render(request, "tweets/create.html", {"form": form})
 
@@ -50,10 +88,9 @@ class TweetDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like_counts"] = self.object.liked_by.count()
-        context["is_liked"] = self.object.liked_by.filter(
-            pk=self.request.user.pk,
-        ).exists()
+        resolve_liked([self.object], self.request.user)
+        overlay_pending_likes([self.object], self.request.user)
+        context["is_liked"] = self.object.is_liked
         return context
 
 
@@ -72,12 +109,47 @@ class TweetDeleteView(LoginRequiredMixin, View):
 class LikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
-        tweet.liked_by.add(request.user)
+        like_tweet(request.user, tweet, True)
         return HttpResponse("ok")
 
 
 class UnlikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
-        tweet.liked_by.remove(request.user)
+        like_tweet(request.user, tweet, False)
         return HttpResponse("ok")
+
+
+class LikeBatchView(LoginRequiredMixin, View):
+    """
+    いいねの付け外しをまとめて受け付ける。like.js が短時間のクリックをまとめて送ってくる。
+    リクエスト: {"operations": [{"tweet_id": 1, "liked": true}, ...]}
+    同じツイートへの操作が複数あるときは最後のものだけを使う。
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = json.loads(request.body)["operations"]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest("不正なリクエストです。")
+        if not isinstance(operations, list):
+            return HttpResponseBadRequest("不正なリクエストです。")
+        # 辞書を作る前に数を確かめ、大きな配列は読まずに断る
+        if len(operations) > settings.LIKE_BATCH_MAX_OPERATIONS:
+            return HttpResponseBadRequest("操作が多すぎます。")
+        try:
+            # "false" のような文字列も bool() では True になるので、JSONの真偽値だけを受け付ける
+            if not all(isinstance(op["liked"], bool) for op in operations):
+                return HttpResponseBadRequest("不正なリクエストです。")
+            desired = {int(op["tweet_id"]): op["liked"] for op in operations}
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest("不正なリクエストです。")
+        counts = set_likes(request.user, desired)
+        return JsonResponse(
+            {
+                "tweets": [
+                    {"tweet_id": pk, "liked": desired[pk], "like_count": like_count}
+                    for pk, like_count in counts.items()
+                ]
+            }
+        )